@@ -0,0 +1,1169 @@
+"""
+SOCHOW Benchmarks
+
+Offline performance checks for bot.py. Every benchmark runs against a
+throwaway database in a temp directory, never your real sochow.db.
+
+Usage:
+    python bench.py orders-api                   # GET /api/orders at 1k/10k/100k orders
+    python bench.py orders-api --sizes 1000 5000 --repeat 3
+    python bench.py stats                        # GET /api/stats at 1k/10k/100k orders, rollups vs rebuild
+    python bench.py order-ids                    # 500 simultaneous checkouts, check for duplicate IDs
+    python bench.py order-ids --checkouts 2000 --threads 64 --legacy
+    python bench.py query-plans                  # fail if a hot query scans a table instead of using an index
+    python bench.py webhook                      # update latency, webhook vs polling, via a fake Bot API (needs uvicorn)
+    python bench.py load                         # 100 synthetic customers from /start to receipt, per-step latency
+    python bench.py load --latency 50 --max-p99 500   # pre-deploy check: exit 1 if slow or anything fails
+    python bench.py api-workers                  # /api/orders and /api/menu/items req/s at 1/4/8 gunicorn workers
+    python bench.py images                       # bytes per dashboard load / menu view, originals vs variants
+    python bench.py startup                      # import time and cold start to first reply
+"""
+
+import os
+import sys
+import asyncio
+import json
+import logging
+import email
+import signal
+import socket
+import subprocess
+import http.client
+import urllib.request
+import time
+import re
+import random
+import argparse
+import tempfile
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ============================================================================
+# SETUP HELPERS
+# ============================================================================
+
+def load_bot(workdir):
+    """Import bot.py and bootstrap a fresh database inside workdir"""
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench.db')
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    import bot
+    bot.setup_logging()
+    bot.ensure_started()
+    return bot
+
+def seed_orders(bot, count, users=500, items_per_order=(1, 4)):
+    """Insert count synthetic orders (with carts and cart items) in bulk"""
+    db = bot.get_db()
+    menu_ids = [row['id'] for row in db.execute('SELECT id, price_naira FROM menu_items')]
+    prices = {row['id']: row['price_naira'] for row in db.execute('SELECT id, price_naira FROM menu_items')}
+    start_cart = db.execute('SELECT COALESCE(MAX(id), 0) FROM carts').fetchone()[0]
+    start_order = db.execute('SELECT COALESCE(MAX(id), 0) FROM orders').fetchone()[0]
+
+    db.executemany('INSERT OR IGNORE INTO users (telegram_id, name) VALUES (?, ?)',
+                   [(str(900000 + i), f'Customer {i}') for i in range(users)])
+    user_ids = [row[0] for row in db.execute('SELECT id FROM users')]
+
+    rng = random.Random(42)
+    carts, cart_items, orders, messages = [], [], [], []
+    for n in range(count):
+        cart_id = start_cart + n + 1
+        user_id = rng.choice(user_ids)
+        total = 0
+        for menu_item_id in rng.sample(menu_ids, rng.randint(*items_per_order)):
+            qty = rng.randint(1, 3)
+            cart_items.append((cart_id, menu_item_id, qty, prices[menu_item_id]))
+            total += qty * prices[menu_item_id]
+        carts.append((cart_id, user_id, 'checked_out'))
+        day = 1 + n % 28
+        orders.append((user_id, cart_id, f'BENCH-{start_order + n + 1:08d}', total, 'Bench Street', '0800',
+                       rng.choice(['pending', 'verified', 'verified', 'denied']),
+                       rng.choice(['processing', 'prepared', 'delivered', 'delivered']),
+                       f'2026-01-{day:02d} {n % 24:02d}:{n % 60:02d}:00'))
+        # Their notifications went out long ago: the queue is mostly sent rows
+        messages += [(str(user_id), 'Order update', 'sent'), (bot.ADMIN_CHAT_ID, 'New receipt', 'sent')]
+
+    db.executemany('INSERT INTO carts (id, user_id, status) VALUES (?, ?, ?)', carts)
+    db.executemany('INSERT INTO cart_items (cart_id, menu_item_id, qty, unit_price) VALUES (?, ?, ?, ?)', cart_items)
+    db.executemany('''INSERT INTO orders (user_id, cart_id, order_id, total_naira, delivery_address, contact_number,
+                                          payment_status, order_status, created_at)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', orders)
+    db.executemany('INSERT INTO outbound_messages (chat_id, text, status) VALUES (?, ?, ?)', messages)
+    db.commit()
+    db.close()
+
+def timed(func, repeat):
+    """Run func repeat times; returns list of durations in milliseconds"""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+# ============================================================================
+# BENCHMARK: GET /api/orders
+# ============================================================================
+
+def n_plus_one_orders(bot):
+    """The previous get_orders() shape: one items query per order, for comparison"""
+    db = bot.get_db()
+    orders = db.execute('''SELECT o.*, u.name as customer_name, u.telegram_id as customer_telegram,
+                                  r.image_url as receipt_url
+                           FROM orders o
+                           JOIN users u ON o.user_id = u.id
+                           LEFT JOIN receipts r ON o.id = r.order_id
+                           ORDER BY o.created_at DESC''').fetchall()
+    result = []
+    for order in orders:
+        order_dict = dict(order)
+        items = db.execute('''SELECT ci.qty, mi.name, mi.price_naira
+                              FROM cart_items ci
+                              JOIN menu_items mi ON ci.menu_item_id = mi.id
+                              WHERE ci.cart_id = ?''', (order['cart_id'],)).fetchall()
+        order_dict['items'] = [dict(item) for item in items]
+        result.append(order_dict)
+    db.close()
+    return result
+
+def bench_orders_api(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+    client = bot.create_app().test_client()
+
+    print(f'\n{"orders":>8} {"batched p50":>12} {"batched max":>12} {"N+1 p50":>10} {"body":>10}')
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed_orders(bot, size - seeded)
+        seeded = size
+
+        body_size = len(client.get('/api/orders').get_data())
+        batched = timed(lambda: client.get('/api/orders').get_data(), args.repeat)
+        if size <= args.legacy_max:
+            legacy = f'{statistics.median(timed(lambda: n_plus_one_orders(bot), 1)):>8.1f}ms'
+        else:
+            legacy = f'{"skipped":>10}'
+        print(f'{size:>8} {statistics.median(batched):>10.1f}ms {max(batched):>10.1f}ms '
+              f'{legacy} {body_size / 1024:>8.0f}KB', flush=True)
+
+# ============================================================================
+# BENCHMARK: GET /api/stats
+# ============================================================================
+
+STATS_TABLES = {
+    'daily_stats': 'SELECT * FROM daily_stats ORDER BY day',
+    'hourly_stats': 'SELECT * FROM hourly_stats ORDER BY day, hour',
+    'item_daily_stats': 'SELECT * FROM item_daily_stats ORDER BY day, menu_item_id',
+    'order_status_counts': 'SELECT * FROM order_status_counts WHERE orders > 0 ORDER BY kind, status',
+}
+
+def shuffle_statuses(bot, count, rng):
+    """Push count random orders through the dashboard's payment/status transitions"""
+    db = bot.get_db()
+    ids = [row[0] for row in db.execute('SELECT id FROM orders')]
+    for order_id in rng.sample(ids, min(count, len(ids))):
+        column, value = rng.choice([('payment_status', 'verified'), ('payment_status', 'denied'),
+                                    ('payment_status', 'expired'), ('order_status', 'delivered'),
+                                    ('order_status', 'cancelled'), ('order_status', 'out-for-delivery')])
+        db.execute(f'UPDATE orders SET {column} = ? WHERE id = ?', (value, order_id))
+    db.commit()
+    db.close()
+
+def rollups_match_rebuild(bot):
+    """Compare the trigger-maintained rollups with a from-scratch rebuild (rolled back)"""
+    db = bot.get_db()
+    try:
+        live = {table: [tuple(row) for row in db.execute(sql)] for table, sql in STATS_TABLES.items()}
+        db.begin()
+        bot.rebuild_sales_stats(db)
+        rebuilt = {table: [tuple(row) for row in db.execute(sql)] for table, sql in STATS_TABLES.items()}
+        db.rollback()
+    finally:
+        db.close()
+    return [table for table in STATS_TABLES if live[table] != rebuilt[table]]
+
+def client_side_stats(client):
+    """What the dashboard did before /api/stats: download every order and total them locally"""
+    orders = json.loads(client.get('/api/orders').get_data())
+    day = [o for o in orders if o['created_at'].startswith('2026-01-15')]
+    return len(day), sum(o['total_naira'] for o in day if o['payment_status'] == 'verified')
+
+def bench_stats(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+    client = bot.create_app().test_client()
+    rng = random.Random(17)
+
+    print(f'\n{"orders":>8} {"/api/stats p50":>15} {"month p50":>10} {"client-side p50":>16}  rollups')
+    seeded = 0
+    for size in sorted(args.sizes):
+        seed_orders(bot, size - seeded)
+        shuffle_statuses(bot, (size - seeded) // 4, rng)
+        seeded = size
+
+        day = timed(lambda: client.get('/api/stats?from=2026-01-15&to=2026-01-15').get_data(), args.repeat)
+        month = timed(lambda: client.get('/api/stats?from=2026-01-01&to=2026-01-31').get_data(), args.repeat)
+        if size <= args.legacy_max:
+            legacy = f'{statistics.median(timed(lambda: client_side_stats(client), 1)):>14.1f}ms'
+        else:
+            legacy = f'{"skipped":>16}'
+        mismatched = rollups_match_rebuild(bot)
+        check = f'MISMATCH in {", ".join(mismatched)}' if mismatched else 'match rebuild'
+        print(f'{size:>8} {statistics.median(day):>13.2f}ms {statistics.median(month):>8.2f}ms {legacy}  {check}',
+              flush=True)
+        if mismatched:
+            sys.exit(1)
+
+# ============================================================================
+# STRESS TEST: order ID allocation
+# ============================================================================
+
+def seed_checkouts(bot, count):
+    """One user with a single-item active cart per checkout; returns (user, state) pairs"""
+    db = bot.get_db()
+    menu_item = db.execute('SELECT id, price_naira FROM menu_items LIMIT 1').fetchone()
+    last_user = db.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]
+    last_cart = db.execute('SELECT COALESCE(MAX(id), 0) FROM carts').fetchone()[0]
+    db.executemany('INSERT INTO users (telegram_id, name) VALUES (?, ?)',
+                   [(str(700000 + last_user + i), f'Checkout {i}') for i in range(count)])
+    users = db.execute('SELECT * FROM users WHERE id > ? ORDER BY id', (last_user,)).fetchall()
+    db.executemany("INSERT INTO carts (user_id, status) VALUES (?, 'active')", [(user['id'],) for user in users])
+    carts = db.execute('SELECT id, user_id FROM carts WHERE id > ? ORDER BY id', (last_cart,)).fetchall()
+    db.executemany('INSERT INTO cart_items (cart_id, menu_item_id, qty, unit_price) VALUES (?, ?, 1, ?)',
+                   [(cart['id'], menu_item['id'], menu_item['price_naira']) for cart in carts])
+    db.commit()
+    db.close()
+    return [(user, {'cart_id': cart['id'], 'address': 'Bench Street', 'phone': '0800'})
+            for user, cart in zip(users, carts)]
+
+def legacy_place_order(bot, user, state):
+    """The previous allocator: count today's orders, then insert, for comparison"""
+    db = bot.get_db()
+    try:
+        date_str = bot.datetime.now().strftime('%Y%m%d')
+        count = db.execute("SELECT COUNT(*) as cnt FROM orders WHERE DATE(created_at) = DATE('now')").fetchone()['cnt']
+        order_id = f'SOCHOW-{date_str}-{str(count + 1).zfill(4)}'
+        db.execute('''INSERT INTO orders (user_id, cart_id, order_id, total_naira, delivery_address, contact_number)
+                      VALUES (?, ?, ?, 0, ?, ?)''', (user['id'], state['cart_id'], order_id, state['address'], state['phone']))
+        db.commit()
+    finally:
+        db.close()
+
+def fire_checkouts(place, checkouts, threads):
+    """Release every checkout at once from a thread pool; returns (ids, errors, seconds)"""
+    start = threading.Barrier(threads)
+    results, errors = [], []
+
+    def run(batch):
+        start.wait()
+        for user, state in batch:
+            try:
+                results.append(place(user, state))
+            except Exception as e:
+                errors.append(e)
+
+    batches = [checkouts[i::threads] for i in range(threads)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, batches))
+    return results, errors, time.perf_counter() - started
+
+def bench_order_ids(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+
+    print(f'\n{args.checkouts} checkouts from {args.threads} threads, released together')
+    if args.legacy:
+        checkouts = seed_checkouts(bot, args.checkouts)
+        _, errors, elapsed = fire_checkouts(lambda user, state: legacy_place_order(bot, user, state),
+                                            checkouts, args.threads)
+        print(f'  COUNT(*) allocator: {len(errors)} of {args.checkouts} checkouts failed '
+              f'({errors[0] if errors else "no errors"}), {elapsed:.2f}s', flush=True)
+        db = bot.get_db()
+        db.execute('DELETE FROM orders')
+        db.commit()
+        db.close()
+
+    checkouts = seed_checkouts(bot, args.checkouts)
+    results, errors, elapsed = fire_checkouts(lambda user, state: bot.place_order(user, state)[0],
+                                              checkouts, args.threads)
+    numbers = sorted(int(order_id.rsplit('-', 1)[1]) for order_id in results)
+    stats = bot.db_pool.snapshot()
+    print(f'  order_sequences:    {len(errors)} failed, {len(results)} placed, '
+          f'{len(results) - len(set(results))} duplicate IDs, '
+          f'numbers {"contiguous" if numbers == list(range(1, len(numbers) + 1)) else "NOT contiguous"}, '
+          f'{elapsed:.2f}s ({len(results) / elapsed:.0f} orders/s)')
+    print(f'  write lock waits: {stats["lock_waits"]} totalling {stats["lock_wait_seconds"]:.2f}s')
+    if errors:
+        print(f'  first error: {errors[0]!r}')
+        sys.exit(1)
+
+# ============================================================================
+# CHECK: query plans of hot queries
+# ============================================================================
+
+# Tables (as named in the plan, i.e. by alias if the query uses one) that a
+# hot path may read in full on purpose
+ALLOWED_SCANS = {
+    'menu_items': 'the whole menu is loaded into MenuCache',
+    'order_status_counts': 'one row per payment/order status, read whole by /api/stats',
+}
+
+def trace_statements(bot):
+    """Record every SQL statement bot.py runs from now on; returns the (growing) list"""
+    statements = []
+    get_db = bot.get_db
+
+    def traced_get_db():
+        db = get_db()
+        db.conn.set_trace_callback(statements.append)
+        return db
+
+    bot.get_db = traced_get_db
+    return statements
+
+def exercise_hot_paths(bot):
+    """Drive one customer through ordering and the dashboard through its calls"""
+    client = bot.create_app().test_client()
+    user = bot.get_or_create_user(555000, 'Plan Check')
+    menu_item = bot.menu_cache.get().available[0]
+    bot.add_item_to_cart(user['id'], menu_item['id'])
+    bot.add_item_to_cart(user['id'], menu_item['id'])
+    cart, items, total = bot.fetch_active_cart(user['id'])
+    bot.change_cart_item_qty(items[0]['id'], -1)
+    bot.checkout_states.set(user['id'], {'step': 'awaiting_phone', 'cart_id': cart['id']})
+    bot.checkout_states.flush()
+    bot.SQLiteStateStore().get(user['id'])
+    bot.place_order(user, {'cart_id': cart['id'], 'address': 'Plan Street', 'phone': '0800'})
+    order = bot.find_pending_order(user['id'])
+    receipt_id, image_url, _ = bot.save_receipt(order, user['id'], 'PLAN-FILE-ID', 'PLAN-UNIQUE-ID')
+    bot.check_receipt(receipt_id, 'plan-content-hash', 0x0123456789abcdef)
+    bot.save_receipt(order, user['id'], 'PLAN-FILE-ID', 'PLAN-UNIQUE-ID')  # same file again
+    receipt_id, image_url, _ = bot.save_receipt(order, user['id'], 'PLAN-FILE-ID-2', 'PLAN-UNIQUE-ID-2')
+    bot.check_receipt(receipt_id, 'plan-content-hash-2', 0x0123456789abcdee)
+    bot.fetch_recent_orders(user['id'])
+    bot.fetch_due_messages(bot.OUTBOUND_BATCH)
+    bot.unchecked_receipts()
+    bot.SQLiteStateStore().purge_expired(time.time())
+    for name, func, interval, first in bot.MAINTENANCE_JOBS:
+        bot.run_maintenance(name, func)
+
+    cursor = client.get('/api/orders?updated_since=').get_json()['cursor']
+    client.get(f'/api/orders?updated_since={cursor}')
+    client.get('/api/stats?from=2026-01-01&to=2026-01-31')
+    client.get('/api/orders?payment_status=pending&limit=200')
+    client.get('/api/orders?payment_status=verified&order_status=processing,prepared,out-for-delivery')
+    page = client.get('/api/orders?order_status=delivered,cancelled&limit=25').get_json()
+    client.get(f'/api/orders?order_status=delivered,cancelled&limit=25&before={page["next"]}')
+    client.get(f'/api/orders?customer={user["telegram_id"]}&from=2026-01-01&to=2026-01-31')
+    feed = bot.order_events.subscribe()  # an open dashboard stream: the watcher polls for changes
+    client.post(f'/api/orders/{order["id"]}/verify', json={'verified': True})
+    client.patch(f'/api/orders/{order["id"]}/status', json={'status': 'prepared'})
+    client.post(f'/api/orders/{order["id"]}/query', json={'message': 'plan check'})
+    feed.get(timeout=10)
+    bot.order_events.unsubscribe(feed)
+    client.patch(f'/api/menu/items/{menu_item["id"]}', json={'available': True})
+    client.get('/api/menu/items')
+    client.get('/metrics')
+
+def full_scans(db, sql):
+    """Tables the plan reads without an index (SCAN without USING ... INDEX)"""
+    tables = []
+    for row in db.execute(f'EXPLAIN QUERY PLAN {sql}'):
+        detail = row['detail']
+        if detail.startswith('SCAN ') and 'INDEX' not in detail:
+            tables.append(detail.split()[1])
+    return tables
+
+def check_query_plans(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+    seed_orders(bot, args.orders)
+
+    statements = trace_statements(bot)
+    exercise_hot_paths(bot)
+
+    db = bot.get_db()
+    db.conn.set_trace_callback(None)
+    checked, failures = set(), []
+    for sql in statements:
+        sql = ' '.join(sql.split())
+        shape = re.sub(r"'[^']*'|\b\d+\b", '?', sql)  # same statement with other values
+        if not sql.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')) or shape in checked:
+            continue
+        checked.add(shape)
+        for table in full_scans(db, sql):
+            if table not in ALLOWED_SCANS:
+                failures.append((table, sql))
+    db.close()
+
+    print(f'\n{len(checked)} distinct statements checked against {args.orders} seeded orders')
+    for table, sql in failures:
+        print(f'  ❌ SCAN {table}: {sql[:160]}')
+    if failures:
+        sys.exit(1)
+    print('  ✅ every hot query uses an index')
+
+# ============================================================================
+# BENCHMARK: image bytes served
+# ============================================================================
+
+def phone_photo(path, rng, size=(4032, 3024)):
+    """A camera-sized JPEG with rotation and GPS metadata, like a phone upload"""
+    from PIL import Image
+    img = Image.radial_gradient('L').resize(size).convert('RGB')
+    noise = Image.effect_noise(size, rng.randint(20, 60)).convert('RGB')
+    img = Image.blend(img, noise, 0.35)
+    exif = Image.Exif()
+    exif[0x0112] = 6                                   # Orientation: rotate 90° to display
+    exif[0x8825] = {1: 'N', 2: (6.0, 27.0, 0.0)}       # GPSInfo
+    img.save(path, 'JPEG', quality=92, exif=exif)
+
+def receipt_screenshot(seed, quality=85, scale=1.0):
+    """JPEG bytes of a banking-app style screenshot whose layout depends on seed"""
+    from io import BytesIO
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    img = Image.new('RGB', (720, 1280), (245, 245, 245))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((0, 0, 720, 160), fill=(rng.randint(0, 120), rng.randint(0, 120), rng.randint(80, 200)))
+    for _ in range(8):
+        x, y = rng.randint(0, 600), rng.randint(180, 1180)
+        draw.rectangle((x, y, x + rng.randint(60, 400), y + rng.randint(20, 200)), fill=(rng.randint(0, 200),) * 3)
+    if scale != 1.0:
+        img = img.resize((int(720 * scale), int(1280 * scale)))
+    out = BytesIO()
+    img.save(out, 'JPEG', quality=quality)
+    return out.getvalue()
+
+def dashboard_image_urls(client, variant):
+    """Image URLs the dashboard requests on load (menu thumbnails and receipt cards)"""
+    menu = client.get('/api/menu/items').get_json()
+    orders = client.get('/api/orders').get_json()
+    urls = [item['image_url'] for item in menu if item['image_url']]
+    urls += [order['receipt_url'] for order in orders if order['receipt_url']]
+    return [f'{url}.{variant}.webp' if variant else url for url in urls]
+
+def bytes_fetched(client, urls):
+    return sum(len(client.get(url).get_data()) for url in urls)
+
+def bench_images(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+    if bot.Image is None:
+        print('Pillow is not installed: uploads are served as-is, nothing to compare')
+        return
+    client = bot.create_app().test_client()
+    rng = random.Random(7)
+
+    os.makedirs('uploads/menu', exist_ok=True)
+    os.makedirs('uploads/receipts', exist_ok=True)
+    seed_orders(bot, args.receipts)
+    db = bot.get_db()
+    menu_ids = [row['id'] for row in db.execute('SELECT id FROM menu_items ORDER BY id')]
+    for menu_id in menu_ids:
+        phone_photo(f'uploads/menu/bench_{menu_id}.jpg', rng)
+        db.execute('UPDATE menu_items SET image_url = ? WHERE id = ?', (f'/uploads/menu/bench_{menu_id}.jpg', menu_id))
+    order_ids = [row['id'] for row in db.execute('SELECT id FROM orders ORDER BY id')]
+    for order_id in order_ids:
+        phone_photo(f'uploads/receipts/bench_{order_id}.jpg', rng, size=(1280, 960))
+        db.execute('INSERT INTO receipts (order_id, user_id, image_url) SELECT id, user_id, ? FROM orders WHERE id = ?',
+                   (f'/uploads/receipts/bench_{order_id}.jpg', order_id))
+    db.commit()
+    db.close()
+    bot.menu_cache.reload()
+    menu_paths = [f'uploads/menu/bench_{menu_id}.jpg' for menu_id in menu_ids]
+    receipt_paths = [f'uploads/receipts/bench_{order_id}.jpg' for order_id in order_ids]
+
+    before_dashboard = bytes_fetched(client, dashboard_image_urls(client, None))
+    before_menu = sum(os.path.getsize(path) for path in menu_paths)
+
+    started = time.perf_counter()
+    for path in menu_paths:
+        bot.ingest_image(path, bot.MENU_IMAGE_VARIANTS)
+    for path in receipt_paths:
+        bot.ingest_image(path, bot.RECEIPT_IMAGE_VARIANTS)
+    ingest_ms = (time.perf_counter() - started) * 1000 / (len(menu_paths) + len(receipt_paths))
+
+    after_dashboard = bytes_fetched(client, dashboard_image_urls(client, 'thumb'))
+    after_menu = sum(len(bot.menu_photo_bytes('/' + path)) for path in menu_paths)
+
+    from PIL import Image
+    leftover_exif = sum(1 for path in menu_paths + receipt_paths
+                        for variant in [None, 'thumb', 'large']
+                        if Image.open(bot.variant_path(path, variant) if variant else path).getexif())
+
+    print(f'\n{len(menu_paths)} menu photos, {len(receipt_paths)} receipts '
+          f'(ingest {ingest_ms:.0f} ms per image on one thread)')
+    print(f'{"":>24} {"originals":>12} {"variants":>12}')
+    print(f'{"dashboard load images":>24} {before_dashboard / 1024:>10.0f}KB {after_dashboard / 1024:>10.0f}KB')
+    print(f'{"menu view uploads":>24} {before_menu / 1024:>10.0f}KB {after_menu / 1024:>10.0f}KB')
+    print(f'files still carrying EXIF after ingest: {leftover_exif}')
+
+# ============================================================================
+# FAKE BOT API
+# ============================================================================
+
+BENCH_TOKEN = '123456:BENCH-TOKEN'
+BENCH_WEBHOOK_SECRET = 'bench-secret'
+
+# Methods that answer with the Message they sent or edited
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageMedia',
+                   'editMessageCaption', 'editMessageReplyMarkup'}
+
+def parse_bot_api_body(content_type, body):
+    """Bot API parameters from a JSON, urlencoded or multipart request body"""
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = email.message_from_bytes(b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+        raw = {}
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            raw[name] = payload if part.get_filename() else payload.decode()
+    else:
+        raw = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+    params = {}
+    for key, value in raw.items():
+        # python-telegram-bot JSON-encodes every non-string parameter
+        try:
+            params[key] = json.loads(value) if isinstance(value, str) else value
+        except ValueError:
+            params[key] = value
+    return params
+
+class FakeBotAPI:
+    """Offline stand-in for api.telegram.org that bot.py can be pointed at.
+
+    Answers the methods the bot calls with plausible results, records every
+    call with its arrival time, and serves getUpdates long-polls from updates
+    pushed with inject(). Start bot.py with TELEGRAM_API_URL=api.url.
+    latency (seconds) is added to every call but getUpdates, like the round
+    trip to Telegram; photo(file_id) returns the JPEG served for a downloaded file.
+    """
+
+    def __init__(self, latency=0.0, photo=None):
+        self.latency = latency
+        self.photo = photo
+        self.calls = []          # (perf_counter, method, params)
+        self.updates = []        # waiting for getUpdates
+        self.last_messages = {}  # chat_id -> last message the bot sent or edited there
+        self.webhook = None
+        self.cond = threading.Condition()
+        self.next_message_id = 1
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'   # keep-alive, like the real API
+            disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                method = self.path.rsplit('/', 1)[-1]
+                if api.latency and method != 'getUpdates':
+                    time.sleep(api.latency)
+                result = api.handle(method, parse_bot_api_body(self.headers.get('Content-Type', ''), body))
+                self.reply(json.dumps({'ok': True, 'result': result}).encode(), 'application/json')
+
+            def do_GET(self):
+                # /file/bot<token>/<file_path>: downloaded photos
+                time.sleep(api.latency)
+                self.reply(api.file_bytes(self.path.rsplit('/', 1)[-1]), 'application/octet-stream')
+
+            def reply(self, payload, content_type):
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024   # the bot opens many connections at once
+
+            def handle_error(self, request, client_address):
+                if not isinstance(sys.exc_info()[1], ConnectionError):  # the bot hung up on exit
+                    super().handle_error(request, client_address)
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, method, params):
+        with self.cond:
+            self.calls.append((time.perf_counter(), method, params))
+            self.cond.notify_all()
+
+        if method == 'getUpdates':
+            return self.get_updates(params.get('offset', 0), params.get('timeout', 0))
+        if method == 'getMe':
+            return {'id': int(BENCH_TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'SOCHOW Bench',
+                    'username': 'sochow_bench_bot'}
+        if method == 'setWebhook':
+            self.webhook = params
+        if method == 'getFile':
+            return {'file_id': params['file_id'], 'file_unique_id': f"u-{params['file_id']}",
+                    'file_size': len(self.file_bytes(params['file_id'])), 'file_path': f"photos/{params['file_id']}"}
+        if method in MESSAGE_METHODS:
+            return self.message(method, params)
+        return True
+
+    def message(self, method, params):
+        chat_id = params.get('chat_id', 0)
+        with self.cond:
+            previous = self.last_messages.get(chat_id)
+            if method.startswith('edit') and previous and previous['message_id'] == params.get('message_id'):
+                message = dict(previous, edit_date=int(time.time()))  # keeps what the edit doesn't replace
+            else:
+                message = {'message_id': params.get('message_id') or self.next_message_id,
+                           'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+                self.next_message_id += 1
+            if params.get('text'):
+                message['text'] = params['text']
+            if 'photo' in params or 'media' in params:
+                message.pop('text', None)
+                message['photo'] = [{'file_id': f"fake-photo-{message['message_id']}-{self.next_message_id}",
+                                     'file_unique_id': f"fake-{self.next_message_id}", 'width': 640, 'height': 480}]
+                self.next_message_id += 1
+            if params.get('caption'):
+                message['caption'] = params['caption']
+            self.last_messages[chat_id] = message
+        return message
+
+    def file_bytes(self, file_id):
+        return self.photo(file_id) if self.photo else b'\xff\xd8\xff\xe0' + file_id.encode() * 64
+
+    def get_updates(self, offset, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.cond.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+    def inject(self, update):
+        """Queue an update for the next getUpdates; returns when it was queued"""
+        with self.cond:
+            self.updates.append(update)
+            self.cond.notify_all()
+            return time.perf_counter()
+
+    def wait_for(self, predicate, timeout=30):
+        """Block until predicate(calls) is true; returns whether it became true"""
+        with self.cond:
+            return self.cond.wait_for(lambda: predicate(self.calls), timeout)
+
+    def first_reply_times(self, since=0):
+        """perf_counter of the first call addressed to each chat, from call index since"""
+        replies = {}
+        with self.cond:
+            for at, method, params in self.calls[since:]:
+                if 'chat_id' in params:
+                    replies.setdefault(params['chat_id'], at)
+        return replies
+
+def start_command(update_id, chat_id):
+    """A /start message from a distinct user, as Telegram would deliver it"""
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': '/start',
+                        'chat': {'id': chat_id, 'type': 'private'},
+                        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'Bench {chat_id}'},
+                        'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+def start_bot_process(workdir, api, port, **env):
+    """Run bot.py in a subprocess against the fake Bot API; returns the Popen"""
+    env = dict(os.environ, BOT_TOKEN=BENCH_TOKEN, ADMIN_CHAT_ID='1', TELEGRAM_API_URL=api.url,
+               DB_PATH=os.path.join(workdir, 'bench.db'), PORT=str(port), PYTHONUNBUFFERED='1', **env)
+    log = open(os.path.join(workdir, 'bot.log'), 'ab')
+    return subprocess.Popen([sys.executable, os.path.join(HERE, 'bot.py')], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+def stop_bot_process(process, timeout=60):
+    process.send_signal(signal.SIGTERM)
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return process.wait()
+
+# ============================================================================
+# BENCHMARK: webhook vs polling update latency
+# ============================================================================
+
+def post_webhook(port, update):
+    """Deliver one update the way Telegram does; returns when it was sent"""
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/telegram/webhook', data=json.dumps(update).encode(),
+                                     headers={'Content-Type': 'application/json',
+                                              'X-Telegram-Bot-Api-Secret-Token': BENCH_WEBHOOK_SECRET})
+    sent = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        assert response.status == 200, response.status
+    return sent
+
+def deliver(mode, api, port, updates, parallel):
+    """Send updates (parallel at a time); returns {chat_id: sent perf_counter}"""
+    if mode == 'polling':
+        send = api.inject
+    else:
+        send = lambda update: post_webhook(port, update)
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        sent = pool.map(send, updates)
+        return {update['message']['chat']['id']: at for update, at in zip(updates, sent)}
+
+def measure(mode, api, port, updates, parallel):
+    """Per-update latency (ms) from delivery to the bot's first reply, plus wall time
+
+    With parallel=1 each update waits for the previous one's reply (pure
+    latency); otherwise they are sent parallel at a time without waiting.
+    """
+    since = len(api.calls)
+    started = time.perf_counter()
+    if parallel == 1:
+        sent = {}
+        for update in updates:
+            chat_id = update['message']['chat']['id']
+            sent.update(deliver(mode, api, port, [update], 1))
+            api.wait_for(lambda calls: chat_id in api.first_reply_times(since), timeout=30)
+    else:
+        sent = deliver(mode, api, port, updates, parallel)
+    api.wait_for(lambda calls: len(api.first_reply_times(since)) >= len(updates), timeout=120)
+    replies = api.first_reply_times(since)
+    latencies = sorted((replies[chat] - at) * 1000 for chat, at in sent.items() if chat in replies)
+    return latencies, time.perf_counter() - started
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else float('nan')
+
+def bench_webhook(args):
+    print(f'\n{"mode":>8} {"load":>14} {"replied":>8} {"p50":>8} {"p99":>8} {"updates/s":>10}')
+    chat_ids = iter(range(10_000_000, 20_000_000))
+    update_ids = iter(range(1, 10_000_000))
+    
+    for mode in ('polling', 'webhook'):
+        workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+        api = FakeBotAPI()
+        port = free_port()
+        env = {'WEBHOOK_URL': 'https://bench.invalid', 'WEBHOOK_SECRET': BENCH_WEBHOOK_SECRET} if mode == 'webhook' else {}
+        process = start_bot_process(workdir, api, port, **env)
+        ready = 'setWebhook' if mode == 'webhook' else 'getUpdates'
+        if not (api.wait_for(lambda calls: any(method == ready for _, method, _ in calls), timeout=60)
+                and wait_for_port(port)):
+            process.kill()
+            sys.exit(f'{mode}: bot did not start, see {workdir}/bot.log')
+        
+        for label, count, parallel in (('sequential', args.sequential, 1), (f'burst x{args.burst}', args.burst, 32)):
+            updates = [start_command(next(update_ids), next(chat_ids)) for _ in range(count)]
+            latencies, seconds = measure(mode, api, port, updates, parallel)
+            print(f'{mode:>8} {label:>14} {len(latencies):>4}/{count:<3} {percentile(latencies, 0.5):>6.1f}ms '
+                  f'{percentile(latencies, 0.99):>6.1f}ms {count / seconds:>10.0f}', flush=True)
+        
+        if mode == 'webhook':
+            # Graceful drain: every acknowledged update is answered before the process exits
+            updates = [start_command(next(update_ids), next(chat_ids)) for _ in range(args.burst)]
+            since = len(api.calls)
+            deliver(mode, api, port, updates, 32)
+            code = stop_bot_process(process)
+            replied = len(api.first_reply_times(since))
+            print(f'   drain: SIGTERM right after {len(updates)} acknowledged updates -> '
+                  f'{replied}/{len(updates)} answered, exit code {code}')
+        else:
+            stop_bot_process(process)
+        api.server.shutdown()
+
+# ============================================================================
+# LOAD TEST: synthetic customers through the whole ordering flow
+# ============================================================================
+
+# One customer's session, in order: (label, what they send). Callback buttons
+# are pressed on the last message the bot showed that customer.
+def customer_steps(items):
+    return [
+        ('/start', lambda chat_id: {'text': '/start', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}),
+        ('view_menu', 'view_menu'),
+        ('menu_page', 'menu_page:1'),
+        ('add_to_cart', f"add_to_cart:{items[1]['id']}"),
+        ('menu_page', 'menu_page:2'),
+        ('add_to_cart', f"add_to_cart:{items[2]['id']}"),
+        ('view_cart', 'view_cart'),
+        ('checkout', 'checkout'),
+        ('address', lambda chat_id: {'text': f'{chat_id} Bench Street, Lekki'}),
+        ('phone', lambda chat_id: {'text': '08012345678'}),
+        ('receipt', lambda chat_id: {'photo': [{'file_id': f'receipt-{chat_id}', 'file_unique_id': f'r-{chat_id}',
+                                                'width': 720, 'height': 1280}]}),
+        # The same photo sent again, then a fresh screenshot of it: neither should reach the admin
+        ('resend', lambda chat_id: {'photo': [{'file_id': f'receipt-{chat_id}', 'file_unique_id': f'r-{chat_id}',
+                                               'width': 720, 'height': 1280}]}),
+        ('rescreenshot', lambda chat_id: {'photo': [{'file_id': f'rescreenshot-{chat_id}',
+                                                     'file_unique_id': f'rs-{chat_id}', 'width': 648, 'height': 1152}]}),
+    ]
+
+def customer_update(api, update_id, chat_id, action):
+    """The update Telegram would deliver for this step: a message, or a tap on a button"""
+    sender = {'id': chat_id, 'is_bot': False, 'first_name': f'Customer {chat_id}'}
+    if callable(action):
+        return {'update_id': update_id,
+                'message': {'message_id': update_id, 'date': int(time.time()), 'from': sender,
+                            'chat': {'id': chat_id, 'type': 'private'}, **action(chat_id)}}
+    return {'update_id': update_id,
+            'callback_query': {'id': str(update_id), 'from': sender, 'chat_instance': str(chat_id), 'data': action,
+                               'message': api.last_messages[chat_id]}}
+
+def time_handlers(application, finished):
+    """Record (started, finished, error) per update_id around every handler callback"""
+    for handler in application.handlers[0]:
+        async def timed(update, context, callback=handler.callback):
+            started, error = time.perf_counter(), None
+            try:
+                return await callback(update, context)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                finished[update.update_id] = (started, time.perf_counter(), error)
+        handler.callback = timed
+
+def start_polling_in_thread(application):
+    """Run the bot's Application on its own event loop thread; returns a stop() function"""
+    loop = asyncio.new_event_loop()
+
+    async def start():
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    async def shutdown():
+        await application.updater.stop()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    asyncio.run_coroutine_threadsafe(start(), loop).result(60)
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(60)
+        loop.call_soon_threadsafe(loop.stop)
+    return stop
+
+def receipt_file(file_id):
+    """Each customer's own receipt; 'rescreenshot-<chat>' is the same one re-captured smaller"""
+    kind, chat_id = file_id.rsplit('-', 1)
+    if kind == 'rescreenshot':
+        return receipt_screenshot(chat_id, quality=70, scale=0.9)
+    return receipt_screenshot(chat_id)
+
+def bench_load(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    os.chdir(workdir)
+    rng = random.Random(21)
+    try:
+        import PIL  # noqa: F401
+        receipt = receipt_file
+    except ImportError:
+        receipt = None  # no Pillow: uploads are stored as-is anyway
+    api = FakeBotAPI(latency=args.latency / 1000, photo=receipt)
+    os.environ.update(BOT_TOKEN=BENCH_TOKEN, ADMIN_CHAT_ID='1', TELEGRAM_API_URL=api.url)
+    bot = load_bot(workdir)
+
+    if receipt:
+        # Dishes with photos, as in production: the first view of each uploads it, later ones reuse its file_id
+        os.makedirs('uploads/menu', exist_ok=True)
+        db = bot.get_db()
+        for item in bot.menu_cache.get().items:
+            path = f"uploads/menu/bench_{item['id']}.jpg"
+            phone_photo(path, rng, size=(1600, 1200))
+            bot.ingest_image(path, bot.MENU_IMAGE_VARIANTS)
+            db.execute('UPDATE menu_items SET image_url = ?, image_hash = ? WHERE id = ?',
+                       (f'/{path}', bot.image_file_hash(f'/{path}'), item['id']))
+        db.commit()
+        db.close()
+        bot.menu_cache.reload()
+
+    # The bot's own log (one line per order...) goes to a file; the report to the terminal
+    out, bot_log = sys.stdout, open(os.path.join(workdir, 'bot.log'), 'w')
+    for handler in logging.getLogger().handlers:
+        handler.setStream(bot_log)
+    statements = trace_statements(bot)
+    application = bot.build_telegram_app()
+    finished = {}
+    time_handlers(application, finished)
+    stop = start_polling_in_thread(application)
+
+    steps = customer_steps(bot.menu_cache.get().available)
+    chat_ids = range(30_000_000, 30_000_000 + args.customers)
+    update_ids = iter(range(1, 10_000_000))
+    by_step = {}
+    total_updates, total_seconds, total_calls, total_statements, failures = 0, 0.0, 0, 0, []
+
+    print(f'\n{args.customers} customers, one step each at a time, Bot API latency {args.latency:.0f} ms, '
+          f'{bot.MENU_MODE} menu, photos {"on" if receipt else "off (no Pillow)"}', file=out)
+    print(f'{"step":>12} {"updates/s":>10} {"handler p50":>12} {"p99":>8} {"end-to-end p50":>15} {"p99":>8} '
+          f'{"statements":>11} {"API calls":>10}', file=out)
+    for label, action in steps:
+        sent = {}
+        calls_before, statements_before = len(api.calls), len(statements)
+        started = time.perf_counter()
+        for chat_id in chat_ids:
+            update = customer_update(api, next(update_ids), chat_id, action)
+            sent[update['update_id']] = api.inject(update)
+        deadline = time.monotonic() + 120
+        while any(update_id not in finished for update_id in sent) and time.monotonic() < deadline:
+            time.sleep(0.002)
+        seconds = time.perf_counter() - started
+
+        done = [finished[update_id] + (at,) for update_id, at in sent.items() if update_id in finished]
+        handler = sorted((end - begin) * 1000 for begin, end, error, at in done)
+        end_to_end = sorted((end - at) * 1000 for begin, end, error, at in done)
+        errors = [error for begin, end, error, at in done if error is not None]
+        calls = sum(1 for at, method, params in api.calls[calls_before:] if method != 'getUpdates')
+        executed = sum(1 for sql in statements[statements_before:] if not sql.startswith('--'))  # not trigger bodies
+        total_updates, total_seconds = total_updates + len(sent), total_seconds + seconds
+        total_calls, total_statements = total_calls + calls, total_statements + executed
+        by_step.setdefault(label, []).extend(end_to_end)
+        if len(done) < len(sent) or errors:
+            failures.append(f'{label}: {len(sent) - len(done)} unanswered, {len(errors)} errors '
+                            f'{repr(errors[0]) if errors else ""}')
+
+        print(f'{label:>12} {len(sent) / seconds:>10.0f} {percentile(handler, 0.5):>10.1f}ms '
+              f'{percentile(handler, 0.99):>6.1f}ms {percentile(end_to_end, 0.5):>13.1f}ms '
+              f'{percentile(end_to_end, 0.99):>6.1f}ms {executed / len(sent):>11.1f} {calls / len(sent):>10.1f}',
+              file=out, flush=True)
+
+    stop()
+    for handler in logging.getLogger().handlers:
+        handler.setStream(out)
+    bot_log.close()
+    db = bot.get_db()
+    orders = db.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+    notifications = db.execute('SELECT COUNT(*) FROM outbound_messages').fetchone()[0]
+    receipts = db.execute('SELECT image_url, duplicate_of FROM receipts').fetchall()
+    db.close()
+    fetched = sum(1 for receipt in receipts if os.path.exists(receipt['image_url'].lstrip('/')))
+    duplicates = sum(1 for receipt in receipts if receipt['duplicate_of'] is not None)
+    print(f'\n{total_updates} updates in {total_seconds:.1f}s: {total_updates / total_seconds:.0f} updates/s, '
+          f'{total_statements / total_updates:.1f} statements and {total_calls / total_updates:.2f} Bot API calls '
+          f'per update')
+    print(f'{orders} orders: {total_calls / max(orders, 1):.1f} Bot API calls per order '
+          f'(+{notifications} admin notifications queued for the outbound worker)')
+    print(f'{len(receipts)} receipts: {fetched} downloaded in the background after the customer was answered, '
+          f'{duplicates} re-screenshots flagged as duplicates (exact resends never stored)')
+
+    slow = [label for label, latencies in by_step.items()
+            if args.max_p99 and percentile(sorted(latencies), 0.99) > args.max_p99]
+    if slow:
+        failures.append(f'end-to-end p99 over {args.max_p99:.0f} ms: {", ".join(slow)}')
+    if orders < args.customers:
+        failures.append(f'only {orders} of {args.customers} customers placed an order')
+    if notifications != orders:
+        failures.append(f'{notifications} admin notifications for {orders} orders: duplicate receipts got through')
+    if receipt and duplicates < orders:
+        failures.append(f'only {duplicates} of {orders} re-screenshotted receipts recognized')
+    for failure in failures:
+        print(f'  ❌ {failure}')
+    if failures:
+        sys.exit(1)
+    print('  ✅ every customer ordered and paid')
+
+# ============================================================================
+# BENCHMARK: admin API throughput by WSGI worker count
+# ============================================================================
+
+API_ENDPOINTS = ('/api/orders?limit=50', '/api/menu/items')
+
+def start_api_workers(workdir, port, workers, threads):
+    """Run create_app() under gunicorn with this many worker processes"""
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, 'bench.db'), PYTHONPATH=HERE)
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'ab')
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gthread',
+                             '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'bot:create_app()'],
+                            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def hammer(port, path, seconds, connections):
+    """GET path over keep-alive connections for seconds; returns sorted latencies (ms)"""
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        latencies = []
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            latencies.append((time.perf_counter() - started) * 1000)
+        conn.close()
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=connections) as pool:
+        return sorted(sum(pool.map(lambda _: client(), range(connections)), []))
+
+def bench_api_workers(args):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        sys.exit('needs gunicorn: pip install gunicorn')
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    bot = load_bot(workdir)
+    seed_orders(bot, args.orders)
+
+    print(f'\n{args.orders} orders, {args.clients} keep-alive clients, {args.seconds}s per run, '
+          f'{os.cpu_count()} CPUs')
+    print(f'{"workers":>8} {"endpoint":>22} {"req/s":>8} {"p50":>8} {"p99":>8}')
+    for workers in args.workers:
+        port = free_port()
+        process = start_api_workers(workdir, port, workers, args.threads)
+        if not wait_for_port(port):
+            process.kill()
+            sys.exit(f'gunicorn did not start, see {workdir}/gunicorn.log')
+        for path in API_ENDPOINTS:
+            hammer(port, path, 1, args.clients)  # warm up every worker
+            latencies = hammer(port, path, args.seconds, args.clients)
+            print(f'{workers:>8} {path:>22} {len(latencies) / args.seconds:>8.0f} '
+                  f'{percentile(latencies, 0.5):>6.1f}ms {percentile(latencies, 0.99):>6.1f}ms', flush=True)
+        process.terminate()
+        process.wait()
+
+# ============================================================================
+# BENCHMARK: import time and cold start
+# ============================================================================
+
+IMPORT_SNIPPET = 'import time; started = time.perf_counter(); import bot; print(time.perf_counter() - started)'
+
+def time_import(workdir):
+    """Seconds to import bot.py in a new interpreter, and the files the import left in workdir"""
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, 'bench.db'), PYTHONPATH=HERE)
+    before = set(os.listdir(workdir))
+    result = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=workdir, env=env,
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1]), set(os.listdir(workdir)) - before
+
+def time_cold_start(workdir, chat_id):
+    """Seconds from launching bot.py to its reply to a /start already waiting in getUpdates"""
+    api = FakeBotAPI()
+    api.inject(start_command(chat_id, chat_id))
+    started = time.perf_counter()
+    process = start_bot_process(workdir, api, free_port())
+    replied = api.wait_for(lambda calls: chat_id in api.first_reply_times(), timeout=60)
+    seconds = api.first_reply_times()[chat_id] - started if replied else float('nan')
+    stop_bot_process(process)
+    api.server.shutdown()
+    return seconds
+
+def time_bootstrap(workdir):
+    env = dict(os.environ, DB_PATH=os.path.join(workdir, 'bench.db'))
+    started = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(HERE, 'bot.py'), 'bootstrap'], cwd=workdir, env=env,
+                   stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+def bench_startup(args):
+    workdir = tempfile.mkdtemp(prefix='sochow-bench-')
+    chat_ids = iter(range(40_000_000, 50_000_000))
+
+    imports = [time_import(workdir) for _ in range(args.repeat)]
+    seconds = sorted(seconds for seconds, created in imports)
+    created = sorted(set().union(*(created for seconds, created in imports)))
+    print(f'\n{"":>28} {"median":>8} {"min":>8}')
+    print(f'{"import bot":>28} {statistics.median(seconds) * 1000:>6.0f}ms {seconds[0] * 1000:>6.0f}ms'
+          f'   files created: {", ".join(created) or "none"}')
+
+    # The first start finds no database and bootstraps it; later ones find it ready
+    first = time_cold_start(workdir, next(chat_ids))
+    print(f'{"first start -> reply":>28} {first * 1000:>6.0f}ms {"":>8}   (new database)', flush=True)
+    starts = sorted(time_cold_start(workdir, next(chat_ids)) for _ in range(args.repeat))
+    print(f'{"cold start -> first reply":>28} {statistics.median(starts) * 1000:>6.0f}ms {starts[0] * 1000:>6.0f}ms')
+    runs = sorted(time_bootstrap(workdir) for _ in range(args.repeat))
+    print(f'{"bootstrap, already done":>28} {statistics.median(runs) * 1000:>6.0f}ms {runs[0] * 1000:>6.0f}ms')
+
+# ============================================================================
+# ENTRY POINT
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='SOCHOW offline benchmarks')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    orders_api = sub.add_parser('orders-api', help='GET /api/orders latency by order history size')
+    orders_api.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    orders_api.add_argument('--repeat', type=int, default=5)
+    orders_api.add_argument('--legacy-max', type=int, default=10000,
+                            help='largest history to time the old N+1 query on (it is quadratic)')
+    orders_api.set_defaults(func=bench_orders_api)
+
+    stats = sub.add_parser('stats', help='GET /api/stats latency by order history size; rollups vs rebuild')
+    stats.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    stats.add_argument('--repeat', type=int, default=20)
+    stats.add_argument('--legacy-max', type=int, default=10000,
+                       help='largest history to time the old download-everything approach on')
+    stats.set_defaults(func=bench_stats)
+
+    order_ids = sub.add_parser('order-ids', help='concurrent checkouts: order ID collisions and throughput')
+    order_ids.add_argument('--checkouts', type=int, default=500)
+    order_ids.add_argument('--threads', type=int, default=100)
+    order_ids.add_argument('--legacy', action='store_true',
+                           help='first run the old COUNT(*) allocator under the same load')
+    order_ids.set_defaults(func=bench_order_ids)
+
+    query_plans = sub.add_parser('query-plans', help='fail if a hot query does a full table scan')
+    query_plans.add_argument('--orders', type=int, default=2000, help='orders to seed before planning')
+    query_plans.set_defaults(func=check_query_plans)
+
+    webhook = sub.add_parser('webhook', help='update latency, webhook vs polling, against a fake Bot API')
+    webhook.add_argument('--sequential', type=int, default=50, help='updates sent one at a time')
+    webhook.add_argument('--burst', type=int, default=300, help='updates sent 32 at a time')
+    webhook.set_defaults(func=bench_webhook)
+
+    load = sub.add_parser('load', help='synthetic customers through the full ordering flow against a fake Bot API')
+    load.add_argument('--customers', type=int, default=100, help='concurrent customers')
+    load.add_argument('--latency', type=float, default=0, help='ms added to every Bot API call')
+    load.add_argument('--max-p99', type=float, default=None,
+                      help='fail (exit 1) if any step\'s end-to-end p99 exceeds this many ms')
+    load.set_defaults(func=bench_load)
+
+    api_workers = sub.add_parser('api-workers', help='admin API requests/s at 1, 4 and 8 WSGI workers (needs gunicorn)')
+    api_workers.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    api_workers.add_argument('--threads', type=int, default=4, help='threads per worker')
+    api_workers.add_argument('--clients', type=int, default=16, help='concurrent keep-alive connections')
+    api_workers.add_argument('--seconds', type=float, default=10)
+    api_workers.add_argument('--orders', type=int, default=10000, help='orders to seed first')
+    api_workers.set_defaults(func=bench_api_workers)
+
+    startup = sub.add_parser('startup', help='import time, and cold start to the first reply to an update')
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=bench_startup)
+
+    images = sub.add_parser('images', help='image bytes per dashboard load and menu view (needs Pillow)')
+    images.add_argument('--receipts', type=int, default=30)
+    images.set_defaults(func=bench_images)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -14,21 +14,384 @@ Environment variables (.env file):
 """
 
 import os
+import sys
+import json
+import logging
+import queue
+import re
+import gzip
+import hashlib
+import hmac
+import shutil
 import sqlite3
-from datetime import datetime
-from flask import Flask, request, jsonify, send_from_directory
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from urllib.parse import urlencode
+from urllib.request import urlopen
+from flask import Blueprint, Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+from telegram.ext import Application, BaseUpdateProcessor, ExtBot, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 import asyncio
-from threading import Thread
+import time
+import weakref
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock, Event
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
+from werkzeug.security import safe_join
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional: without Pillow uploads are stored and served as uploaded
+    Image = None
+try:
+    import brotli
+except ImportError:  # optional: the dashboard is still served gzipped
+    brotli = None
+try:
+    import uvicorn
+    from asgiref.sync import ThreadSensitiveContext
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:  # optional: only webhook mode (WEBHOOK_URL) needs them
+    uvicorn = None
 
 # Load environment variables
 load_dotenv()
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID', 'YOUR_ADMIN_ID')
 PORT = int(os.getenv('PORT', 3000))
+DB_PATH = os.getenv('DB_PATH', 'sochow.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+BOT_API_CONNECTIONS = int(os.getenv('BOT_API_CONNECTIONS', 16))  # keep-alive connections to the Bot API
+ORDER_STREAM_KEEPALIVE = 15  # seconds between SSE keepalive comments
+ORDER_FEED_INTERVAL = 1.0    # seconds between checks for order changes made by other processes
+MENU_REFRESH_INTERVAL = 5    # seconds before the bot sees menu edits made by API workers
+RECEIPT_RECHECK_INTERVAL = 300  # seconds between sweeps for receipts the bot never checked (restarted mid-way)
+# 'browser': menu and cart live in one message edited in place; 'classic': one message per dish
+MENU_MODE = os.getenv('MENU_MODE', 'browser')
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))   # parallel image conversions (CPU bound)
+RECEIPT_DOWNLOADS = int(os.getenv('RECEIPT_DOWNLOADS', 4))  # receipts the bot fetches from Telegram at once
+RECEIPT_CACHE_MB = int(os.getenv('RECEIPT_CACHE_MB', 500))  # local copies of Telegram receipts, oldest dropped first
+RECEIPT_PHASH_DISTANCE = int(os.getenv('RECEIPT_PHASH_DISTANCE', 3))  # differing bits (of 64) that still count as the same photo
+RECEIPT_DUPLICATE_DAYS = int(os.getenv('RECEIPT_DUPLICATE_DAYS', 90))  # how far back a customer's receipts are compared
+CART_EXPIRY_DAYS = int(os.getenv('CART_EXPIRY_DAYS', 7))                    # untouched active carts
+UNPAID_ORDER_EXPIRY_HOURS = int(os.getenv('UNPAID_ORDER_EXPIRY_HOURS', 48))  # pending orders with no receipt
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))    # telegram users kept resolved in memory
+CHECKOUT_STATE_CACHE = int(os.getenv('CHECKOUT_STATE_CACHE', 2000))    # checkouts kept in memory
+CHECKOUT_STATE_TTL = int(os.getenv('CHECKOUT_STATE_TTL', 6 * 3600))   # seconds before an abandoned checkout expires
+# Bot API server; point at a local Bot API server or a test stand-in (see bench.py webhook)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+# Public https base URL of this server. When set, updates arrive by webhook instead of polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')      # defaults to one derived from BOT_TOKEN
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # parallel deliveries Telegram may make
+SHUTDOWN_GRACE = int(os.getenv('SHUTDOWN_GRACE', 30))  # seconds to let in-flight requests finish on SIGTERM
+METRICS = os.getenv('METRICS', 'on').lower() not in ('off', '0', 'false', 'no')  # off: no timing at all, no /metrics
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))  # also serve /metrics here, e.g. for 'python bot.py bot'
+LOG_FORMAT = os.getenv('LOG_FORMAT', '')   # 'json' or 'text'; default text on a terminal, JSON otherwise
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+# Every message goes through the 'sochow' logger. As JSON each line is one
+# object, so logs can be shipped and filtered by level or field; extra={...}
+# adds fields (order_id, chat_id, ...) to the object.
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                 'level': record.levelname.lower(), 'logger': record.name, 'msg': record.getMessage()}
+        entry.update((key, value) for key, value in vars(record).items() if key not in self.RESERVED)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def setup_logging():
+    """Log to stdout; libraries (telegram, httpx, werkzeug) only from WARNING up"""
+    handler = logging.StreamHandler(sys.stdout)
+    as_json = LOG_FORMAT == 'json' or (LOG_FORMAT != 'text' and not sys.stdout.isatty())
+    handler.setFormatter(JsonFormatter() if as_json else logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.WARNING, handlers=[handler])
+    log.setLevel(LOG_LEVEL)
+
+log = logging.getLogger('sochow')
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# Seconds; Prometheus histogram bucket bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    """In-process registry of counters, histograms and summaries, served as
+    Prometheus text at /metrics.
+
+    Recording is a dict update under one lock. Gauges and counters kept
+    elsewhere (pool stats, queue depths) are read by collectors at scrape time
+    only. With METRICS off every record call returns at once. Each process
+    has its own registry: with several API workers a scrape sees one of them.
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.lock = Lock()
+        self.meta = {}         # name -> (type, help, buckets)
+        self.values = {}       # (name, labels) -> number, or [count per bucket..., sum]
+        self.collectors = []   # functions yielding (name, labels dict, value) at scrape time
+
+    def define(self, name, kind, help, buckets=LATENCY_BUCKETS):
+        """Declare a metric: kind is counter, gauge, histogram or summary (count and sum only)"""
+        self.meta[name] = (kind, help, buckets if kind == 'histogram' else ())
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        buckets = self.meta[name][2]
+        index = bisect_left(buckets, seconds)   # first bound >= seconds; len(buckets) is +Inf
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 2)
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self):
+        with self.lock:
+            values = [(key, list(value) if isinstance(value, list) else value) for key, value in self.values.items()]
+        samples = defaultdict(list)
+        for (name, labels), value in values:
+            samples[name].append((dict(labels), value))
+        for collect in self.collectors:
+            try:
+                for name, labels, value in collect():
+                    samples[name].append((labels, value))
+            except Exception as e:
+                log.warning(f'⚠️  Metrics collector {collect.__name__} failed: {e}')
+        
+        lines = []
+        for name in sorted(samples):
+            kind, help, buckets = self.meta[name]
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            for labels, value in samples[name]:
+                if kind not in ('histogram', 'summary'):
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                counts, total = value[:-1], value[-1]
+                cumulative = 0
+                for bound, count in zip(buckets, counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+                if kind == 'histogram':
+                    lines.append(f'{name}_bucket{format_labels(labels, le="+Inf")} {sum(counts)}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {sum(counts)}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+metrics = Metrics(METRICS)
+metrics.define('sochow_update_seconds', 'histogram', 'Time to handle one Telegram update, by update type')
+metrics.define('sochow_callback_seconds', 'histogram', 'button_handler time per callback action')
+metrics.define('sochow_http_request_seconds', 'histogram', 'Flask time to response headers, by route')
+metrics.define('sochow_http_requests_total', 'counter', 'Flask responses by route and status')
+metrics.define('sochow_db_statement_seconds', 'summary', 'SQL statements run and their time to first row, by kind')
+metrics.define('sochow_bot_api_seconds', 'histogram', 'Bot API request time by method')
+metrics.define('sochow_bot_api_errors_total', 'counter', 'Failed Bot API requests by method and error')
+metrics.define('sochow_bot_api_retry_after_total', 'counter', 'Flood control (RetryAfter) responses by method')
+metrics.define('sochow_cache_requests_total', 'counter', 'Cache lookups by cache and result (hit/miss)')
+
+def serve_metrics(port):
+    """Serve /metrics on its own port from a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode() if self.path == '/metrics' else b''
+            self.send_response(200 if body else 404)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+
+# ============================================================================
+# DATABASE CONNECTIONS
+# ============================================================================
+
+# Applied to every new connection. WAL lets the Flask thread read while the bot
+# writes; synchronous=NORMAL is durable enough under WAL and skips an fsync per commit.
+DB_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',        # 16 MB page cache per connection
+    'PRAGMA mmap_size = 134217728',      # 128 MB memory-mapped reads
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}',
+)
+DB_STATEMENT_CACHE = 256
+# Millisecond timestamp for orders.updated_at, which doubles as the dashboard sync cursor
+SQL_NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+STATEMENT_KINDS = {'select', 'insert', 'update', 'delete', 'with', 'begin', 'create', 'pragma'}
+
+def statement_kind(sql):
+    kind = sql.split(None, 1)[0].lower()
+    return kind if kind in STATEMENT_KINDS else 'other'
+
+class PooledConnection:
+    """SQLite connection borrowed from the pool.
+
+    Runs in autocommit mode and opens a BEGIN IMMEDIATE transaction on the first
+    write, so the write lock is taken up front (no deadlocking read->write upgrades)
+    and the time spent waiting for it can be measured. close() hands the
+    connection back to the pool instead of closing it.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = sqlite3.connect(DB_PATH,
+                                    timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                                    isolation_level=None,
+                                    check_same_thread=False,
+                                    cached_statements=DB_STATEMENT_CACHE)
+        self.conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS:
+            self.conn.execute(pragma)
+
+    def execute(self, sql, params=()):
+        if not self.conn.in_transaction and sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            self.begin()
+        if not metrics.enabled:
+            return self.conn.execute(sql, params)
+        started = time.perf_counter()
+        try:
+            return self.conn.execute(sql, params)
+        finally:
+            metrics.observe('sochow_db_statement_seconds', time.perf_counter() - started, kind=statement_kind(sql))
+
+    def executemany(self, sql, seq_of_params):
+        if not self.conn.in_transaction:
+            self.begin()
+        if not metrics.enabled:
+            return self.conn.executemany(sql, seq_of_params)
+        started = time.perf_counter()
+        try:
+            return self.conn.executemany(sql, seq_of_params)
+        finally:
+            metrics.observe('sochow_db_statement_seconds', time.perf_counter() - started, kind=statement_kind(sql))
+
+    def begin(self):
+        """Start a write transaction, recording how long the write lock took"""
+        started = time.perf_counter()
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.pool.record_lock_wait(time.perf_counter() - started)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        """Return to the pool; uncommitted work is discarded like a real close"""
+        if self.conn.in_transaction:
+            self.conn.rollback()
+        self.pool.release(self)
+
+class ConnectionPool:
+    """Small LIFO pool of SQLite connections shared by the bot and Flask threads"""
+
+    # BEGIN IMMEDIATE slower than this counts as having waited on another writer
+    LOCK_WAIT_THRESHOLD = 0.001
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.lock = Lock()
+        self.stats = {
+            'connections_opened': 0,
+            'connections_reused': 0,
+            'write_transactions': 0,
+            'lock_waits': 0,
+            'lock_wait_seconds': 0.0,
+        }
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                self.stats['connections_reused'] += 1
+                return self.idle.pop()
+            self.stats['connections_opened'] += 1
+        return PooledConnection(self)
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.conn.close()
+
+    def record_lock_wait(self, seconds):
+        with self.lock:
+            self.stats['write_transactions'] += 1
+            if seconds >= self.LOCK_WAIT_THRESHOLD:
+                self.stats['lock_waits'] += 1
+                self.stats['lock_wait_seconds'] += seconds
+
+    def snapshot(self):
+        """Copy of the counters plus current pool occupancy"""
+        with self.lock:
+            return dict(self.stats, idle_connections=len(self.idle), pool_size=self.size)
+
+db_pool = ConnectionPool(DB_POOL_SIZE)
+
+def collect_db_pool():
+    stats = db_pool.snapshot()
+    for key in ('connections_opened', 'connections_reused', 'write_transactions', 'lock_waits', 'lock_wait_seconds'):
+        yield f'sochow_db_{key}_total', {}, stats[key]
+    yield 'sochow_db_idle_connections', {}, stats['idle_connections']
+
+metrics.define('sochow_db_connections_opened_total', 'counter', 'SQLite connections opened by the pool')
+metrics.define('sochow_db_connections_reused_total', 'counter', 'Connections handed out again from the pool')
+metrics.define('sochow_db_write_transactions_total', 'counter', 'BEGIN IMMEDIATE write transactions')
+metrics.define('sochow_db_lock_waits_total', 'counter', 'Write transactions that waited for another writer')
+metrics.define('sochow_db_lock_wait_seconds_total', 'counter', 'Time spent waiting for the write lock')
+metrics.define('sochow_db_idle_connections', 'gauge', 'Connections idle in the pool')
+metrics.collectors.append(collect_db_pool)
+
+def get_db():
+    """Get a pooled database connection (call close() to return it)"""
+    return db_pool.acquire()
 
 # ============================================================================
 # DATABASE SETUP
@@ -36,11 +399,19 @@ PORT = int(os.getenv('PORT', 3000))
 
 def init_db():
     """Initialize SQLite database with all tables"""
-    conn = sqlite3.connect('sochow.db')
-    c = conn.cursor()
+    if not os.path.exists(DB_PATH):
+        # Lets the maintenance jobs shrink the file in small steps. SQLite only
+        # accepts this before the database is first written (WAL counts), so
+        # existing databases keep auto_vacuum off until a full VACUUM.
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.close()
+    
+    db = get_db()
     
     # Users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
+    db.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         telegram_id TEXT UNIQUE NOT NULL,
         name TEXT,
@@ -49,18 +420,21 @@ def init_db():
     )''')
     
     # Menu items
-    c.execute('''CREATE TABLE IF NOT EXISTS menu_items (
+    db.execute('''CREATE TABLE IF NOT EXISTS menu_items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
         price_naira INTEGER NOT NULL,
         available INTEGER DEFAULT 1,
         image_url TEXT,
         description TEXT,
+        image_hash TEXT,
+        telegram_file_id TEXT,
+        telegram_file_hash TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     
     # Carts
-    c.execute('''CREATE TABLE IF NOT EXISTS carts (
+    db.execute('''CREATE TABLE IF NOT EXISTS carts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         status TEXT DEFAULT 'active',
@@ -70,7 +444,7 @@ def init_db():
     )''')
     
     # Cart items
-    c.execute('''CREATE TABLE IF NOT EXISTS cart_items (
+    db.execute('''CREATE TABLE IF NOT EXISTS cart_items (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         cart_id INTEGER NOT NULL,
         menu_item_id INTEGER NOT NULL,
@@ -81,7 +455,7 @@ def init_db():
     )''')
     
     # Orders
-    c.execute('''CREATE TABLE IF NOT EXISTS orders (
+    db.execute('''CREATE TABLE IF NOT EXISTS orders (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER NOT NULL,
         cart_id INTEGER NOT NULL,
@@ -99,11 +473,17 @@ def init_db():
     )''')
     
     # Receipts
-    c.execute('''CREATE TABLE IF NOT EXISTS receipts (
+    db.execute('''CREATE TABLE IF NOT EXISTS receipts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         order_id INTEGER NOT NULL,
         user_id INTEGER NOT NULL,
         image_url TEXT NOT NULL,
+        telegram_file_id TEXT,
+        telegram_file_unique_id TEXT,
+        content_hash TEXT,
+        phash INTEGER,
+        duplicate_of INTEGER,
+        checked_at TIMESTAMP,
         admin_verified INTEGER DEFAULT 0,
         verified_at TIMESTAMP,
         admin_notes TEXT,
@@ -113,14 +493,14 @@ def init_db():
     )''')
     
     # Menu config (single row for menu image)
-    c.execute('''CREATE TABLE IF NOT EXISTS menu_config (
+    db.execute('''CREATE TABLE IF NOT EXISTS menu_config (
         id INTEGER PRIMARY KEY CHECK (id = 1),
         menu_image_url TEXT,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     
     # Admin actions log
-    c.execute('''CREATE TABLE IF NOT EXISTS admin_actions_log (
+    db.execute('''CREATE TABLE IF NOT EXISTS admin_actions_log (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         admin_id TEXT,
         order_id INTEGER,
@@ -129,42 +509,405 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
     
-    conn.commit()
-    conn.close()
-    print('✅ Database initialized')
+    # Outbound Telegram messages, drained by the bot's OutboundWorker
+    db.execute('''CREATE TABLE IF NOT EXISTS outbound_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL,
+        text TEXT,
+        photo TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    )''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_outbound_due ON outbound_messages(status, next_attempt_at)')
+    
+    # In-flight checkout conversations (see ConversationStates); state is JSON
+    db.execute('''CREATE TABLE IF NOT EXISTS conversation_states (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_conversation_states_expires ON conversation_states(expires_at)')
+    
+    # One row per maintenance job run (see MAINTENANCE JOBS)
+    db.execute('''CREATE TABLE IF NOT EXISTS maintenance_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job TEXT NOT NULL,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        duration_ms REAL,
+        rows_affected INTEGER,
+        error TEXT
+    )''')
+    
+    # Per-day order number counters (see generate_order_id)
+    db.execute('''CREATE TABLE IF NOT EXISTS order_sequences (
+        day TEXT PRIMARY KEY,
+        last_value INTEGER NOT NULL
+    )''')
+    
+    # Sales rollups, kept current by the orders triggers (see SALES_STATS_TRIGGERS).
+    # Days and hours are local time, like the dates in order IDs.
+    db.execute('''CREATE TABLE IF NOT EXISTS daily_stats (
+        day TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        items_sold INTEGER NOT NULL DEFAULT 0,
+        gross_naira INTEGER NOT NULL DEFAULT 0,
+        verified_orders INTEGER NOT NULL DEFAULT 0,
+        revenue_naira INTEGER NOT NULL DEFAULT 0,
+        delivered_orders INTEGER NOT NULL DEFAULT 0,
+        cancelled_orders INTEGER NOT NULL DEFAULT 0
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS hourly_stats (
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        revenue_naira INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, hour)
+    )''')
+    db.execute('''CREATE TABLE IF NOT EXISTS item_daily_stats (
+        day TEXT NOT NULL,
+        menu_item_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL DEFAULT 0,
+        gross_naira INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, menu_item_id)
+    )''')
+    # Current number of orders in each payment_status / order_status
+    db.execute('''CREATE TABLE IF NOT EXISTS order_status_counts (
+        kind TEXT NOT NULL,
+        status TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (kind, status)
+    )''')
+
+    # Change counters other processes poll instead of sharing memory (see MenuCache)
+    db.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )''')
+
+    # Dashboard delta sync reads orders by updated_at
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_updated_at ON orders(updated_at)')
+    
+    db.close()
+    log.info('✅ Database initialized')
     
     # Run migrations for existing databases
     migrate_database()
 
+def add_column(db, table, column, definition):
+    """ALTER TABLE ADD COLUMN unless a fresh CREATE TABLE already has it"""
+    columns = [col[1] for col in db.execute(f"PRAGMA table_info({table})").fetchall()]
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        log.info(f'✅ Added {column} column to {table} table')
+
+def migrate_receipts_verified_at(db):
+    add_column(db, 'receipts', 'verified_at', 'TIMESTAMP')
+
+def migrate_menu_photo_cache(db):
+    # Telegram file_id cache for menu photos
+    for column in ('image_hash', 'telegram_file_id', 'telegram_file_hash'):
+        add_column(db, 'menu_items', column, 'TEXT')
+
+def migrate_seed_order_sequences(db):
+    # Start order_sequences where the existing SOCHOW-YYYYMMDD-NNNN ids left off
+    db.execute('''INSERT OR IGNORE INTO order_sequences (day, last_value)
+                  SELECT substr(order_id, 8, 8), MAX(CAST(substr(order_id, 17) AS INTEGER))
+                  FROM orders WHERE order_id LIKE 'SOCHOW-________-%'
+                  GROUP BY substr(order_id, 8, 8)''')
+
+def migrate_hot_path_indexes(db):
+    # One per lookup the bot and dashboard make on every update; bench.py query-plans checks them
+    db.execute('CREATE INDEX IF NOT EXISTS idx_carts_user_status ON carts(user_id, status)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_cart_items_cart ON cart_items(cart_id, menu_item_id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_payment ON orders(user_id, payment_status, created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_receipts_order ON receipts(order_id)')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_receipts_cleanup ON receipts(verified_at)
+                  WHERE admin_verified = 1 AND image_url IS NOT NULL''')
+    # users(telegram_id) is already indexed by its UNIQUE constraint
+
+def migrate_cart_uniqueness(db):
+    # At most one active cart per user (older racy code could open two: keep the first)
+    db.execute('''UPDATE carts SET status = 'abandoned'
+                  WHERE status = 'active' AND id NOT IN
+                      (SELECT MIN(id) FROM carts WHERE status = 'active' GROUP BY user_id)''')
+    db.execute('DROP INDEX IF EXISTS idx_carts_user_status')
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_carts_one_active ON carts(user_id) WHERE status = 'active'")
+    
+    # One line per dish per cart: merge duplicate lines into the oldest
+    db.execute('''UPDATE cart_items SET qty =
+                      (SELECT SUM(qty) FROM cart_items dup
+                       WHERE dup.cart_id = cart_items.cart_id AND dup.menu_item_id = cart_items.menu_item_id)
+                  WHERE id IN (SELECT MIN(id) FROM cart_items GROUP BY cart_id, menu_item_id HAVING COUNT(*) > 1)''')
+    db.execute('DELETE FROM cart_items WHERE id NOT IN (SELECT MIN(id) FROM cart_items GROUP BY cart_id, menu_item_id)')
+    db.execute('DROP INDEX IF EXISTS idx_cart_items_cart')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_items_line ON cart_items(cart_id, menu_item_id)')
+
+def migrate_maintenance_indexes(db):
+    # Keep carts.updated_at current so the maintenance jobs can tell which carts are stale
+    for event, row in (('INSERT', 'NEW'), ('UPDATE OF qty', 'NEW'), ('DELETE', 'OLD')):
+        name = event.split()[0].lower()
+        db.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_cart_items_touch_{name} AFTER {event} ON cart_items
+                       BEGIN UPDATE carts SET updated_at = CURRENT_TIMESTAMP WHERE id = {row}.cart_id; END''')
+    db.execute("CREATE INDEX IF NOT EXISTS idx_carts_active_updated ON carts(updated_at) WHERE status = 'active'")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_orders_pending ON orders(created_at) WHERE payment_status = 'pending'")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_maintenance_runs_started ON maintenance_runs(started_at)')
+    # Cleaned receipts keep their row with image_url = '' (the column is NOT NULL)
+    db.execute('DROP INDEX IF EXISTS idx_receipts_cleanup')
+    db.execute("""CREATE INDEX IF NOT EXISTS idx_receipts_files ON receipts(verified_at)
+                  WHERE admin_verified = 1 AND image_url != ''""")
+
+def migrate_receipt_file_ids(db):
+    # Receipts are recorded by Telegram file and downloaded afterwards (see fetch_receipt)
+    for column in ('telegram_file_id', 'telegram_file_unique_id'):
+        add_column(db, 'receipts', column, 'TEXT')
+
+def migrate_receipt_duplicates(db):
+    # Hashes are filled in by check_receipt once the file is downloaded
+    for column, definition in (('content_hash', 'TEXT'), ('phash', 'INTEGER'),
+                               ('duplicate_of', 'INTEGER'), ('checked_at', 'TIMESTAMP')):
+        add_column(db, 'receipts', column, definition)
+    # Existing receipts already notified the admin when they arrived
+    db.execute('UPDATE receipts SET checked_at = created_at WHERE checked_at IS NULL')
+    # The same Telegram file sent twice so far: later copies point at the first
+    db.execute('''UPDATE receipts SET duplicate_of =
+                      (SELECT MIN(id) FROM receipts first
+                       WHERE first.telegram_file_unique_id = receipts.telegram_file_unique_id)
+                  WHERE telegram_file_unique_id IS NOT NULL AND id NOT IN
+                      (SELECT MIN(id) FROM receipts WHERE telegram_file_unique_id IS NOT NULL
+                       GROUP BY telegram_file_unique_id)''')
+    db.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_receipts_file_unique ON receipts(telegram_file_unique_id)
+                  WHERE duplicate_of IS NULL''')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_receipts_content ON receipts(content_hash) WHERE duplicate_of IS NULL')
+    db.execute('''CREATE INDEX IF NOT EXISTS idx_receipts_user_phash ON receipts(user_id, created_at)
+                  WHERE phash IS NOT NULL AND duplicate_of IS NULL''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_receipts_unchecked ON receipts(created_at) WHERE checked_at IS NULL')
+
+def migrate_receipt_similarity(db):
+    # Near-identical receipts only count as duplicates within one order. Step 12
+    # also matched other orders' receipts, which hid genuine repeat payments
+    # from the admin. Those matching a receipt on record exactly point at it;
+    # the rest become look-alikes. Receipts still awaiting payment review have
+    # their hashes cleared so check_unchecked_receipts checks and announces
+    # them; settled ones are only flagged, never announced again.
+    add_column(db, 'receipts', 'similar_to', 'INTEGER')
+    near = db.execute('''SELECT r.id, r.duplicate_of, r.content_hash, r.telegram_file_unique_id,
+                                 r.admin_verified = 0 AND r.image_url != '' AND r.telegram_file_id IS NOT NULL
+                                 AND o.payment_status = 'pending' AS awaiting_review
+                          FROM receipts r
+                          JOIN receipts first ON first.id = r.duplicate_of
+                          JOIN orders o ON o.id = r.order_id
+                          WHERE first.order_id != r.order_id
+                            AND r.content_hash IS NOT first.content_hash
+                            AND r.telegram_file_unique_id IS NOT first.telegram_file_unique_id
+                          ORDER BY r.id''').fetchall()
+    for receipt in near:
+        same = db.execute('''SELECT id FROM receipts WHERE duplicate_of IS NULL AND id != ?
+                              AND (content_hash = ? OR telegram_file_unique_id = ?)''',
+                          (receipt['id'], receipt['content_hash'], receipt['telegram_file_unique_id'])).fetchone()
+        if same:
+            db.execute('UPDATE receipts SET duplicate_of = ? WHERE id = ?', (same['id'], receipt['id']))
+        elif receipt['awaiting_review']:
+            db.execute('''UPDATE receipts SET duplicate_of = NULL, similar_to = ?, content_hash = NULL, phash = NULL,
+                                             checked_at = NULL WHERE id = ?''', (receipt['duplicate_of'], receipt['id']))
+        else:
+            db.execute('UPDATE receipts SET duplicate_of = NULL, similar_to = ? WHERE id = ?',
+                       (receipt['duplicate_of'], receipt['id']))
+
+def migrate_outbound_pending_indexes(db):
+    # The queue sends pending rows in id order, each chat's oldest first. Sent
+    # and failed rows are kept, so both indexes cover pending rows only.
+    db.execute("CREATE INDEX IF NOT EXISTS idx_outbound_pending ON outbound_messages(id) WHERE status = 'pending'")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_outbound_chat_pending ON outbound_messages(chat_id, id) "
+               "WHERE status = 'pending'")
+
+def migrate_receipt_image_index(db):
+    # Content-addressed receipt files can be shared; cleanup checks who still uses one
+    db.execute('CREATE INDEX IF NOT EXISTS idx_receipts_image_url ON receipts(image_url)')
+
+# Local calendar day / hour an order counts towards in the sales rollups
+def stats_day(row):
+    return f"date({row}.created_at, 'localtime')"
+
+def stats_hour(row):
+    return f"CAST(strftime('%H', {row}.created_at, 'localtime') AS INTEGER)"
+
+# Revenue is verified payments only, booked to the day the order was placed
+# (what the dashboard always showed). Orders are never deleted, and total_naira
+# and created_at never change after insert, so these three cover every write.
+SALES_STATS_TRIGGERS = {
+    'trg_orders_stats_insert': f'''AFTER INSERT ON orders BEGIN
+        INSERT INTO daily_stats (day, orders, items_sold, gross_naira, verified_orders, revenue_naira,
+                                 delivered_orders, cancelled_orders)
+        VALUES ({stats_day('NEW')}, 1,
+                (SELECT COALESCE(SUM(qty), 0) FROM cart_items WHERE cart_id = NEW.cart_id),
+                NEW.total_naira, NEW.payment_status = 'verified',
+                IIF(NEW.payment_status = 'verified', NEW.total_naira, 0),
+                NEW.order_status = 'delivered', NEW.order_status = 'cancelled')
+        ON CONFLICT (day) DO UPDATE SET
+            orders = orders + 1,
+            items_sold = items_sold + excluded.items_sold,
+            gross_naira = gross_naira + excluded.gross_naira,
+            verified_orders = verified_orders + excluded.verified_orders,
+            revenue_naira = revenue_naira + excluded.revenue_naira,
+            delivered_orders = delivered_orders + excluded.delivered_orders,
+            cancelled_orders = cancelled_orders + excluded.cancelled_orders;
+        INSERT INTO hourly_stats (day, hour, orders, revenue_naira)
+        VALUES ({stats_day('NEW')}, {stats_hour('NEW')}, 1, IIF(NEW.payment_status = 'verified', NEW.total_naira, 0))
+        ON CONFLICT (day, hour) DO UPDATE SET
+            orders = orders + 1, revenue_naira = revenue_naira + excluded.revenue_naira;
+        INSERT INTO item_daily_stats (day, menu_item_id, qty, gross_naira)
+        SELECT {stats_day('NEW')}, menu_item_id, qty, qty * unit_price FROM cart_items WHERE cart_id = NEW.cart_id
+        ON CONFLICT (day, menu_item_id) DO UPDATE SET
+            qty = qty + excluded.qty, gross_naira = gross_naira + excluded.gross_naira;
+        INSERT INTO order_status_counts (kind, status, orders)
+        VALUES ('payment', NEW.payment_status, 1), ('order', NEW.order_status, 1)
+        ON CONFLICT (kind, status) DO UPDATE SET orders = orders + 1;
+    END''',
+    'trg_orders_stats_payment': f'''AFTER UPDATE OF payment_status ON orders
+        WHEN OLD.payment_status IS NOT NEW.payment_status BEGIN
+        UPDATE daily_stats SET
+            verified_orders = verified_orders + (NEW.payment_status = 'verified') - (OLD.payment_status = 'verified'),
+            revenue_naira = revenue_naira + NEW.total_naira *
+                ((NEW.payment_status = 'verified') - (OLD.payment_status = 'verified'))
+        WHERE day = {stats_day('NEW')};
+        UPDATE hourly_stats SET revenue_naira = revenue_naira + NEW.total_naira *
+                ((NEW.payment_status = 'verified') - (OLD.payment_status = 'verified'))
+        WHERE day = {stats_day('NEW')} AND hour = {stats_hour('NEW')};
+        UPDATE order_status_counts SET orders = orders - 1 WHERE kind = 'payment' AND status = OLD.payment_status;
+        INSERT INTO order_status_counts (kind, status, orders) VALUES ('payment', NEW.payment_status, 1)
+        ON CONFLICT (kind, status) DO UPDATE SET orders = orders + 1;
+    END''',
+    'trg_orders_stats_status': f'''AFTER UPDATE OF order_status ON orders
+        WHEN OLD.order_status IS NOT NEW.order_status BEGIN
+        UPDATE daily_stats SET
+            delivered_orders = delivered_orders + (NEW.order_status = 'delivered') - (OLD.order_status = 'delivered'),
+            cancelled_orders = cancelled_orders + (NEW.order_status = 'cancelled') - (OLD.order_status = 'cancelled')
+        WHERE day = {stats_day('NEW')};
+        UPDATE order_status_counts SET orders = orders - 1 WHERE kind = 'order' AND status = OLD.order_status;
+        INSERT INTO order_status_counts (kind, status, orders) VALUES ('order', NEW.order_status, 1)
+        ON CONFLICT (kind, status) DO UPDATE SET orders = orders + 1;
+    END''',
+}
+
+def rebuild_sales_stats(db):
+    """Recompute every sales rollup from the orders table; returns the number of days"""
+    for table in ('daily_stats', 'hourly_stats', 'item_daily_stats', 'order_status_counts'):
+        db.execute(f'DELETE FROM {table}')
+    db.execute(f'''INSERT INTO item_daily_stats (day, menu_item_id, qty, gross_naira)
+                   SELECT {stats_day('o')}, ci.menu_item_id, SUM(ci.qty), SUM(ci.qty * ci.unit_price)
+                   FROM orders o JOIN cart_items ci ON ci.cart_id = o.cart_id
+                   GROUP BY 1, 2''')
+    db.execute(f'''INSERT INTO daily_stats (day, orders, items_sold, gross_naira, verified_orders, revenue_naira,
+                                            delivered_orders, cancelled_orders)
+                   SELECT {stats_day('o')}, COUNT(*),
+                          (SELECT COALESCE(SUM(qty), 0) FROM item_daily_stats i WHERE i.day = {stats_day('o')}),
+                          SUM(total_naira), SUM(payment_status = 'verified'),
+                          SUM(IIF(payment_status = 'verified', total_naira, 0)),
+                          SUM(order_status = 'delivered'), SUM(order_status = 'cancelled')
+                   FROM orders o GROUP BY 1''')
+    db.execute(f'''INSERT INTO hourly_stats (day, hour, orders, revenue_naira)
+                   SELECT {stats_day('o')}, {stats_hour('o')}, COUNT(*),
+                          SUM(IIF(payment_status = 'verified', total_naira, 0))
+                   FROM orders o GROUP BY 1, 2''')
+    db.execute('''INSERT INTO order_status_counts (kind, status, orders)
+                  SELECT 'payment', payment_status, COUNT(*) FROM orders GROUP BY payment_status
+                  UNION ALL
+                  SELECT 'order', order_status, COUNT(*) FROM orders GROUP BY order_status''')
+    return db.execute('SELECT COUNT(*) FROM daily_stats').fetchone()[0]
+
+def migrate_order_filter_indexes(db):
+    # /api/orders filters and pages by (created_at, id) within a status; the rowid
+    # rides along in every index, so (status, created_at) serves the keyset order.
+    # The dashboard's active queue is payment_status = 'verified' AND order_status
+    # IN (...): with both in one index it reads only active orders, not every
+    # verified one in history.
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_payment_status ON orders(payment_status, order_status, created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders(order_status, created_at)')
+
+# Any write to the menu bumps data_versions 'menu', whichever process made it
+def bump_version(name):
+    return f'''INSERT INTO data_versions (name, version) VALUES ('{name}', 1)
+               ON CONFLICT (name) DO UPDATE SET version = version + 1;'''
+
+MENU_VERSION_TRIGGERS = {
+    f'trg_{table}_version_{event.lower()}': f"AFTER {event} ON {table} BEGIN {bump_version('menu')} END"
+    for table, events in (('menu_items', ('INSERT', 'UPDATE', 'DELETE')), ('menu_config', ('INSERT', 'UPDATE')))
+    for event in events
+}
+
+def migrate_menu_version(db):
+    for name, body in MENU_VERSION_TRIGGERS.items():
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+def migrate_sales_stats(db):
+    for name, body in SALES_STATS_TRIGGERS.items():
+        db.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    days = rebuild_sales_stats(db)
+    log.info(f'✅ Backfilled sales stats for {days} days')
+
+# Applied in order, each once, recorded in schema_version. Never edit or
+# renumber a shipped step: append a new one instead.
+MIGRATIONS = [
+    (1, 'receipts.verified_at', migrate_receipts_verified_at),
+    (2, 'menu photo file_id cache', migrate_menu_photo_cache),
+    (3, 'seed order_sequences from existing orders', migrate_seed_order_sequences),
+    (4, 'hot path indexes', migrate_hot_path_indexes),
+    (5, 'one active cart per user, one line per dish', migrate_cart_uniqueness),
+    (6, 'cart activity triggers and maintenance indexes', migrate_maintenance_indexes),
+    (7, 'receipts by image_url', migrate_receipt_image_index),
+    (8, 'sales stats rollups', migrate_sales_stats),
+    (9, 'orders filter indexes', migrate_order_filter_indexes),
+    (10, 'menu version triggers', migrate_menu_version),
+    (11, 'receipts by Telegram file_id', migrate_receipt_file_ids),
+    (12, 'receipt duplicate detection', migrate_receipt_duplicates),
+    (13, 'outbound queue in id order per chat', migrate_outbound_pending_indexes),
+    (14, 'near-identical receipts on other orders', migrate_receipt_similarity),
+]
+
 def migrate_database():
-    """Add new columns to existing tables"""
-    conn = sqlite3.connect('sochow.db')
-    c = conn.cursor()
-    
-    try:
-        # Check if verified_at column exists in receipts table
-        c.execute("PRAGMA table_info(receipts)")
-        columns = [col[1] for col in c.fetchall()]
-        
-        if 'verified_at' not in columns:
-            c.execute("ALTER TABLE receipts ADD COLUMN verified_at TIMESTAMP")
-            print('✅ Added verified_at column to receipts table')
-    except Exception as e:
-        print(f'⚠️  Migration note: {e}')
+    """Apply pending MIGRATIONS, each in its own transaction"""
+    db = get_db()
+    db.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    current = db.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+    
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        db.begin()
+        try:
+            # Another process may have applied it while we waited for the write lock
+            if not db.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                step(db)
+                db.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+                log.info(f'✅ Schema migration {version}: {name}', extra={'version': version})
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            db.close()
+            log.error(f'❌ Schema migration {version} ({name}) failed: {e}', extra={'version': version})
+            raise
     
-    conn.commit()
-    conn.close()
-
-# Initialize database on startup
-init_db()
+    db.close()
 
 def seed_menu_items():
     """Populate database with SOCHOW menu items if empty"""
     db = get_db()
+    db.begin()  # count under the write lock: API workers may start at the same time
     existing = db.execute('SELECT COUNT(*) as count FROM menu_items').fetchone()
     
     if existing['count'] == 0:
-        print('📝 Seeding menu items...')
+        log.info('📝 Seeding menu items...')
         menu_data = [
             ('Assorted Pepper Sauce', 15000, 'Spicy mixed-protein pepper sauce with onions & herbs'),
             ('Egusi Soup (Family Bowl)', 37000, 'Rich melon seed soup with assorted meat & vegetables'),
@@ -183,10 +926,11 @@ def seed_menu_items():
                           VALUES (?, ?, ?, 1)''', (name, price, description))
         
         db.commit()
-        db.close()
-        print('✅ Menu items seeded successfully')
+        log.info('✅ Menu items seeded successfully')
     else:
-        print(f'✅ Menu already has {existing["count"]} items')
+        log.info(f'✅ Menu already has {existing["count"]} items')
+    
+    db.close()
 
 def link_menu_photos():
     """Link uploaded food photos to menu items in database - Using exact filenames"""
@@ -213,122 +957,1667 @@ def link_menu_photos():
         
         # Check if file exists before updating database
         if os.path.exists(filepath):
-            db.execute('UPDATE menu_items SET image_url = ? WHERE id = ?', 
-                      (f'/uploads/menu/{filename}', item_id))
+            # A changed hash makes show_menu upload the photo again instead of reusing its file_id.
+            # Unchanged rows are left alone: a write bumps the menu version in every process
+            image_url = f'/uploads/menu/{filename}'
+            image_hash = image_file_hash(image_url)
+            db.execute('''UPDATE menu_items SET image_url = ?, image_hash = ?
+                          WHERE id = ? AND (image_url IS NOT ? OR image_hash IS NOT ?)''',
+                       (image_url, image_hash, item_id, image_url, image_hash))
             updated_count += 1
-            print(f'✅ Item {item_id} → {filename}')
+            log.info(f'✅ Item {item_id} → {filename}')
         else:
-            print(f'⚠️  Item {item_id} → File not found: {filename}')
+            log.warning(f'⚠️  Item {item_id} → File not found: {filename}')
     
     db.commit()
     db.close()
     
     if updated_count > 0:
-        print(f'✅ Linked {updated_count}/10 photos to menu items')
+        log.info(f'✅ Linked {updated_count}/10 photos to menu items')
     else:
-        print('❌ No photos were linked - check uploads folder!')
+        log.error('❌ No photos were linked - check uploads folder!')
+
+# ============================================================================
+# HELPER FUNCTIONS
+# ============================================================================
+
+def read_upload(image_url):
+    """Bytes of a file under uploads/ given its /uploads/... URL, or None if missing"""
+    path = image_url.lstrip('/')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+def image_file_hash(image_url):
+    """Content hash of an uploaded image; keys the Telegram file_id cache"""
+    data = read_upload(image_url) if image_url else None
+    return hashlib.sha1(data).hexdigest() if data is not None else None
+
+class IdentityCache:
+    """Bounded LRU of telegram_id -> user row and user id -> active cart id.
+
+    Users never change once created, and a user's active cart only changes at
+    checkout (place_order calls forget_cart), so most taps resolve both without
+    touching the database.
+    """
+
+    def __init__(self, capacity=IDENTITY_CACHE_SIZE):
+        self.capacity = capacity
+        self.users = OrderedDict()
+        self.carts = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, mapping, key):
+        with self.lock:
+            value = mapping.get(key)
+            if value is not None:
+                mapping.move_to_end(key)
+            return value
+
+    def put(self, mapping, key, value):
+        with self.lock:
+            mapping[key] = value
+            mapping.move_to_end(key)
+            if len(mapping) > self.capacity:
+                mapping.popitem(last=False)
+
+    def user(self, telegram_id):
+        user = self.get(self.users, str(telegram_id))
+        return dict(user) if user is not None else None
+
+    def cart_id(self, user_id):
+        return self.get(self.carts, user_id)
+
+    def forget_cart(self, user_id):
+        with self.lock:
+            self.carts.pop(user_id, None)
+
+identity_cache = IdentityCache()
+
+def get_or_create_user(telegram_id, name):
+    """Get or create user from Telegram data"""
+    user = identity_cache.user(telegram_id)
+    if user is not None:
+        return user
+    
+    db = get_db()
+    user = db.execute('SELECT * FROM users WHERE telegram_id = ?', (str(telegram_id),)).fetchone()
+    
+    if not user:
+        user = db.execute('''INSERT INTO users (telegram_id, name) VALUES (?, ?)
+                             ON CONFLICT(telegram_id) DO NOTHING RETURNING *''',
+                          (str(telegram_id), name)).fetchone()
+        db.commit()
+        if user:
+            log.info(f'📝 New user: {name} ({telegram_id})', extra={'telegram_id': telegram_id})
+        else:
+            # Created by a concurrent update between our SELECT and INSERT
+            user = db.execute('SELECT * FROM users WHERE telegram_id = ?', (str(telegram_id),)).fetchone()
+    
+    db.close()
+    identity_cache.put(identity_cache.users, str(telegram_id), dict(user))
+    return dict(user)
+
+def active_cart_id(db, user_id):
+    """Id of the user's active cart, creating it if needed (on the caller's connection)"""
+    cart_id = identity_cache.cart_id(user_id)
+    metrics.inc('sochow_cache_requests_total', cache='carts', result='miss' if cart_id is None else 'hit')
+    if cart_id is not None:
+        return cart_id
+    
+    cart = db.execute("SELECT id FROM carts WHERE user_id = ? AND status = 'active'", (user_id,)).fetchone()
+    if not cart:
+        # idx_carts_one_active makes this race-free: a concurrent creator's cart is returned instead
+        cart = db.execute('''INSERT INTO carts (user_id, status) VALUES (?, 'active')
+                             ON CONFLICT(user_id) WHERE status = 'active' DO UPDATE SET status = 'active'
+                             RETURNING id''', (user_id,)).fetchone()
+        db.commit()
+    
+    identity_cache.put(identity_cache.carts, user_id, cart['id'])
+    return cart['id']
+
+def cart_total(items):
+    """Subtotal of cart lines in naira"""
+    return sum(item['qty'] * item['unit_price'] for item in items)
+
+def generate_order_id(db):
+    """Allocate the next order ID for today: SOCHOW-YYYYMMDD-XXXX
+
+    Bumps today's row in order_sequences, so call it inside the transaction
+    that inserts the order: the write lock makes concurrent checkouts take
+    turns and a rolled-back order gives its number back. The day is the
+    server's local date, the same one printed in the ID.
+    """
+    date_str = datetime.now().strftime('%Y%m%d')
+    sequence = db.execute('''INSERT INTO order_sequences (day, last_value) VALUES (?, 1)
+                             ON CONFLICT(day) DO UPDATE SET last_value = last_value + 1
+                             RETURNING last_value''', (date_str,)).fetchone()['last_value']
+    return f'SOCHOW-{date_str}-{str(sequence).zfill(4)}'
+
+def iter_order_payloads(db, where='', params=(), limit=None):
+    """Yield dashboard order dicts (with items and customer) for orders matching where.
+
+    Items for every matching order come from one batched query and are grouped
+    by cart in Python, instead of one query per order. Orders come newest first
+    by (created_at, id); with limit only the first limit orders are loaded.
+    """
+    order_by = 'ORDER BY o.created_at DESC, o.id DESC'
+    if limit is not None:
+        where = f'WHERE o.id IN (SELECT o.id FROM orders o {where} {order_by} LIMIT {int(limit)})'
+    
+    items_by_cart = defaultdict(list)
+    for item in db.execute(f'''SELECT ci.cart_id, ci.qty, mi.name, mi.price_naira
+                               FROM cart_items ci
+                               JOIN menu_items mi ON ci.menu_item_id = mi.id
+                               WHERE ci.cart_id IN (SELECT o.cart_id FROM orders o {where})''', params):
+        items_by_cart[item['cart_id']].append({'qty': item['qty'], 'name': item['name'],
+                                               'price_naira': item['price_naira']})
+    
+    # One receipt per order: the newest that isn't a duplicate, else the newest.
+    # A duplicate of, or look-alike of, another order's receipt names that order
+    # for the dashboard to flag
+    orders = db.execute(f'''SELECT o.*, u.name as customer_name, u.telegram_id as customer_telegram,
+                                   r.image_url as receipt_url, dup_order.order_id as receipt_duplicate_of,
+                                   similar_order.order_id as receipt_similar_to
+                            FROM orders o
+                            JOIN users u ON o.user_id = u.id
+                            LEFT JOIN receipts r ON r.id =
+                                (SELECT id FROM receipts WHERE order_id = o.id
+                                 ORDER BY duplicate_of IS NOT NULL, id DESC LIMIT 1)
+                            LEFT JOIN receipts first ON first.id = r.duplicate_of
+                            LEFT JOIN orders dup_order ON dup_order.id = first.order_id AND dup_order.id != o.id
+                            LEFT JOIN receipts similar ON similar.id = r.similar_to
+                            LEFT JOIN orders similar_order ON similar_order.id = similar.order_id
+                            {where}
+                            {order_by}''', params)
+    
+    for order in orders:
+        order_dict = dict(order)
+        order_dict['items'] = items_by_cart.get(order['cart_id'], [])
+        order_dict['customer'] = {'name': order['customer_name'], 'telegram_id': order['customer_telegram']}
+        yield order_dict
+
+def local_day_start_utc(day, days=0):
+    """Local midnight of a YYYY-MM-DD day (plus days) as a UTC created_at string"""
+    start = datetime.strptime(day, '%Y-%m-%d') + timedelta(days=days)
+    return start.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def order_page_cursor(order):
+    """Keyset cursor for the orders after this one: created_at|id"""
+    return f"{order['created_at']}|{order['id']}"
+
+# Statuses orders pass through and leave, so they stay a small share of history
+# however long it grows. Without STAT4 the planner can't see that skew and would
+# rather walk idx_orders_created until the page fills; unlikely() tells it.
+TRANSIENT_STATUSES = {
+    'payment_status': {'pending'},
+    'order_status': {'processing', 'prepared', 'out-for-delivery'},
+}
+
+def order_filters(args):
+    """WHERE clause and params for the /api/orders filters; ValueError if one is malformed
+
+    payment_status and order_status take comma-separated lists, from/to are
+    local YYYY-MM-DD days (inclusive), customer a Telegram ID and before a
+    cursor from a previous page.
+    """
+    clauses, params = [], []
+    for column in ('payment_status', 'order_status'):
+        if args.get(column):
+            values = args[column].split(',')
+            clause = f"o.{column} IN ({', '.join('?' * len(values))})"
+            clauses.append(f'unlikely({clause})' if set(values) <= TRANSIENT_STATUSES[column] else clause)
+            params += values
+    if args.get('from'):
+        clauses.append('o.created_at >= ?')
+        params.append(local_day_start_utc(args['from']))
+    if args.get('to'):
+        clauses.append('o.created_at < ?')
+        params.append(local_day_start_utc(args['to'], days=1))
+    if args.get('customer'):
+        clauses.append('o.user_id = (SELECT id FROM users WHERE telegram_id = ?)')
+        params.append(args['customer'])
+    if args.get('before'):
+        created_at, _, order_id = args['before'].rpartition('|')
+        if not created_at:
+            raise ValueError('bad cursor')
+        clauses.append('(o.created_at, o.id) < (?, ?)')
+        params += [created_at, int(order_id)]
+    return clauses, params
+
+class OrderEventBus:
+    """Fan-out of order changes to every open dashboard stream in this process.
+
+    Changes are read back from the database by one watcher thread, polling
+    orders.updated_at every ORDER_FEED_INTERVAL while anyone is subscribed, so
+    orders written by the bot process or another API worker reach every
+    worker's streams. Each change is loaded and serialized once and the same
+    SSE frame goes to each subscriber, so several tablets cost one query, not N.
+    """
+
+    def __init__(self, backlog=256, interval=ORDER_FEED_INTERVAL):
+        self.backlog = backlog
+        self.interval = interval
+        self.subscribers = set()
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.watcher = None
+        self.cursor = None     # updated_at of the newest change sent
+        self.sent = set()      # (id, updated_at) already sent at exactly the cursor
+
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=self.backlog)
+        with self.lock:
+            if self.watcher is None:
+                # Streams start from now; the dashboard resyncs when one opens
+                db = get_db()
+                self.cursor = db.execute('SELECT MAX(updated_at) FROM orders').fetchone()[0] or ''
+                db.close()
+                self.sent = set()
+                self.watcher = Thread(target=self.watch, name='sochow-order-feed', daemon=True)
+                self.watcher.start()
+            self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    def publish(self, order_id):
+        """Send a change made in this process now instead of on the next poll"""
+        self.wakeup.set()
+
+    def watch(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.watcher = None
+                    return
+            self.wakeup.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                log.warning(f'⚠️  Order feed error: {e}')
+            self.wakeup.wait(self.interval)
+
+    def poll(self):
+        """Broadcast the current state of every order changed since the cursor"""
+        db = get_db()
+        try:
+            changed = [(row['id'], row['updated_at']) for row in
+                       db.execute('SELECT id, updated_at FROM orders WHERE updated_at >= ? ORDER BY updated_at',
+                                  (self.cursor,))]
+            changed = [change for change in changed if change not in self.sent]
+            if not changed:
+                return
+            self.cursor = changed[-1][1]
+            self.sent = {change for change in changed if change[1] == self.cursor} | \
+                        {change for change in self.sent if change[1] == self.cursor}
+            if len(changed) > self.backlog:
+                self.close()  # bulk change (e.g. maintenance): cheaper for dashboards to resync
+                return
+            
+            ids = [order_id for order_id, _ in changed]
+            payloads = {order['id']: order for order in
+                        iter_order_payloads(db, f"WHERE o.id IN ({','.join('?' * len(ids))})", ids)}
+        finally:
+            db.close()
+        
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for order_id in ids:
+            if order_id not in payloads:
+                continue
+            frame = f"event: order\ndata: {json.dumps(payloads[order_id])}\n\n"
+            for subscription in subscribers:
+                try:
+                    subscription.put_nowait(frame)
+                except queue.Full:
+                    # Stalled client: end its stream so it reconnects and resyncs
+                    self.end(subscription)
+
+    def end(self, subscription):
+        """Finish one stream: the dashboard reconnects and resyncs"""
+        self.unsubscribe(subscription)
+        with subscription.mutex:
+            subscription.queue.clear()
+        subscription.put_nowait(None)
+
+    def close(self):
+        """Finish every open stream, e.g. so a shutting down server isn't held open by them"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            self.end(subscription)
+        self.wakeup.set()  # let the watcher see it has nobody left
+
+order_events = OrderEventBus()
+
+class MenuSnapshot:
+    """One immutable version of the menu: never modified after it is published"""
+
+    def __init__(self, version, items, menu_image_url):
+        self.version = version
+        self.items = tuple(items)                      # every item, by id
+        self.available = tuple(item for item in self.items if item['available'])
+        self.by_id = MappingProxyType({item['id']: item for item in self.items})
+        self.menu_image_url = menu_image_url
+        digest = hashlib.sha1(json.dumps([dict(item) for item in self.items], default=str).encode())
+        digest.update((menu_image_url or '').encode())
+        self.etag = f'menu-{version}-{digest.hexdigest()[:12]}'
+
+class MenuCache:
+    """Versioned in-memory menu shared by the Flask threads and the bot loop.
+
+    Readers call get() and keep the snapshot they got; there is no lock on the
+    read path because publishing a new snapshot is a single attribute swap.
+    The version is data_versions 'menu', which triggers bump on every write to
+    menu_items or menu_config: the writer calls reload() after commit, and
+    other processes pick the change up with refresh().
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.lock = Lock()  # serializes reloads only
+
+    def get(self):
+        snapshot = self.snapshot
+        return snapshot if snapshot is not None else self.reload()
+
+    def refresh(self):
+        """Snapshot that is current as of now: one primary key read, plus a reload if the menu changed"""
+        db = get_db()
+        row = db.execute("SELECT version FROM data_versions WHERE name = 'menu'").fetchone()
+        db.close()
+        snapshot = self.snapshot
+        stale = snapshot is None or snapshot.version != (row['version'] if row else 0)
+        metrics.inc('sochow_cache_requests_total', cache='menu', result='miss' if stale else 'hit')
+        return self.reload() if stale else snapshot
+
+    def reload(self):
+        with self.lock:
+            db = get_db()
+            db.execute('BEGIN')  # version and rows from the same snapshot of the database
+            row = db.execute("SELECT version FROM data_versions WHERE name = 'menu'").fetchone()
+            items = db.execute('SELECT * FROM menu_items ORDER BY id').fetchall()
+            config = db.execute('SELECT menu_image_url FROM menu_config WHERE id = 1').fetchone()
+            db.close()
+            self.snapshot = MenuSnapshot(row['version'] if row else 0, items,
+                                         config['menu_image_url'] if config else None)
+            return self.snapshot
+
+menu_cache = MenuCache()
+
+# ============================================================================
+# STARTUP
+# ============================================================================
+
+# Importing this module touches nothing: no database, no files, no logging
+# setup. 'python bot.py bootstrap' prepares the database once per deploy, and
+# every entry point calls ensure_started() before its first use of it.
+
+def bootstrap():
+    """Create or migrate the database, seed the menu and link its photos; safe to re-run"""
+    init_db()
+    seed_menu_items()
+    link_menu_photos()
+
+def schema_is_current():
+    """True when the database exists and has every migration applied"""
+    if not os.path.exists(DB_PATH):  # checked first: opening it would create an empty file
+        return False
+    db = get_db()
+    try:
+        version = db.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    except sqlite3.OperationalError:  # no schema_version table yet
+        version = None
+    finally:
+        db.close()
+    return version == MIGRATIONS[-1][0]
+
+ready = False
+ready_lock = Lock()
+
+def ensure_started():
+    """Once per process: bootstrap a new or older database, then load the menu.
+
+    With the database already bootstrapped this is one primary key read; after
+    the first call it returns at once. Safe from any thread.
+    """
+    global ready
+    if ready:
+        return
+    with ready_lock:
+        if not ready:
+            if not schema_is_current():
+                bootstrap()
+            menu_cache.reload()
+            ready = True
+
+# ============================================================================
+# IMAGE PIPELINE
+# ============================================================================
+
+# Receipts are rotated upright, stripped of EXIF/GPS metadata and capped at
+# IMAGE_MASTER_SIZE in place before they are published; menu uploads keep the
+# bytes they were uploaded with. Resized, metadata-free copies are written
+# next to either as <original>.<variant>.<ext>, e.g. /uploads/menu/item_1.jpg.thumb.webp.
+IMAGE_MASTER_SIZE = 2048
+# variant -> (longest side in px, format, extension, quality)
+IMAGE_VARIANTS = {
+    'thumb': (400, 'WEBP', 'webp', 75),      # dashboard menu list and order cards
+    'large': (1600, 'WEBP', 'webp', 82),     # dashboard receipt viewer
+    'telegram': (1280, 'JPEG', 'jpg', 85),   # menu photos sent to Telegram, which caps photos at 1280 anyway
+}
+IMAGE_EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+MENU_IMAGE_VARIANTS = ('thumb', 'large', 'telegram')
+RECEIPT_IMAGE_VARIANTS = ('thumb', 'large')
+VARIANT_FILENAME = re.compile(r'^(.+)\.(%s)\.(webp|jpg)$' % '|'.join(IMAGE_VARIANTS))
+# Named by content hash (see store_upload) or by Telegram's file_unique_id, so safe to cache forever
+CONTENT_ADDRESSED = re.compile(r'^(menu|receipts)/[0-9a-f]{32}\.|^receipts/tg-[A-Za-z0-9_-]+\.')
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='sochow-img')
+
+# Bytes sent by /uploads, split by original vs resized variant
+upload_stats = Counter()
+
+def variant_path(path, variant):
+    """Where a resized copy of an upload lives; works on paths and /uploads URLs alike"""
+    return f'{path}.{variant}.{IMAGE_VARIANTS[variant][2]}'
+
+def open_upright(path):
+    """Decode an image with its EXIF rotation applied; returns (image, format)"""
+    with Image.open(path) as img:
+        fmt = img.format
+        img = ImageOps.exif_transpose(img)
+        img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+    return img, fmt
+
+def save_image(img, path, fmt, quality):
+    """Encode without copying any metadata from the source"""
+    if fmt == 'JPEG' and img.mode == 'RGBA':
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    img.save(path, fmt, quality=quality, optimize=True)
+
+def write_variant(img, path, variant):
+    size, fmt, _, quality = IMAGE_VARIANTS[variant]
+    resized = img.copy()
+    resized.thumbnail((size, size), Image.LANCZOS)
+    # Written aside and renamed: /uploads may be serving this path right now
+    target = variant_path(path, variant)
+    temp_path = f'{target}.incoming_{os.urandom(4).hex()}'
+    save_image(resized, temp_path, fmt, quality)
+    os.replace(temp_path, target)
+
+def ingest_image(path, variants):
+    """Normalize an uploaded image in place and write its variants (blocking, CPU bound).
+
+    Returns the format it was saved in, or None when Pillow is not installed
+    so the upload stays untouched.
+    """
+    if Image is None:
+        return None
+    img, fmt = open_upright(path)
+    fmt = fmt if fmt in IMAGE_EXTENSIONS else 'JPEG'
+    master = img.copy()
+    master.thumbnail((IMAGE_MASTER_SIZE, IMAGE_MASTER_SIZE), Image.LANCZOS)
+    save_image(master, path, fmt, 90)
+    for variant in variants:
+        write_variant(img, path, variant)
+    return fmt
+
+def store_upload(temp_path, directory, ext, variants):
+    """Move a freshly saved upload to its content-addressed name and queue its variants.
+
+    Files are named by the hash of their bytes, so a URL always means the same
+    image and can be cached forever. Only hashing and a rename happen here; the
+    variants are written on the image pool, and until they exist serve_upload
+    creates them on demand or serves the original. Returns the /uploads/... URL.
+    """
+    with open(temp_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:32]
+    final_path = f'{directory}/{digest}.{ext}'
+    if os.path.exists(final_path):
+        os.remove(temp_path)  # the same image was uploaded before
+    else:
+        os.replace(temp_path, final_path)
+        image_executor.submit(write_variants, final_path, variants)
+    return f'/{final_path}'
+
+def write_variants(path, variants):
+    """Write an upload's resized variants (blocking, CPU bound)"""
+    if Image is None:
+        return
+    try:
+        img, _ = open_upright(path)
+        for variant in variants:
+            write_variant(img, path, variant)
+    except Exception as e:
+        # Unreadable as an image: it is served as uploaded
+        log.warning(f'⚠️  Could not create variants of {path}: {e}')
+
+def move_upload(temp_path, final_path):
+    """Rename an upload and its variants; the original last, so its variants exist once it does"""
+    for variant in IMAGE_VARIANTS:
+        if os.path.exists(variant_path(temp_path, variant)):
+            os.replace(variant_path(temp_path, variant), variant_path(final_path, variant))
+    os.replace(temp_path, final_path)
+
+def incoming_path(directory, ext):
+    """Temporary name for an upload until store_upload knows its hash"""
+    os.makedirs(directory, exist_ok=True)
+    return f'{directory}/incoming_{os.urandom(8).hex()}.{ext}'
+
+def upload_extension(filename, default='jpg'):
+    ext = filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+    return ext if ext.isalnum() and len(ext) <= 5 else default
+
+def ensure_variant(path, variant):
+    """Create one missing variant of an existing upload (e.g. from before the pipeline)"""
+    if Image is None or not os.path.exists(path):
+        return False
+    try:
+        img, _ = open_upright(path)
+        write_variant(img, path, variant)
+        return True
+    except Exception as e:
+        log.warning(f'⚠️  Could not create {variant} of {path}: {e}')
+        return False
+
+def remove_image_files(path):
+    """Delete an upload and all of its variants; returns True if the original existed"""
+    for variant in IMAGE_VARIANTS:
+        try:
+            os.remove(variant_path(path, variant))
+        except FileNotFoundError:
+            pass
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def menu_photo_bytes(image_url):
+    """Bytes to send Telegram for a menu photo: the telegram variant, else the original"""
+    path = image_url.lstrip('/')
+    if not os.path.exists(variant_path(path, 'telegram')):
+        ensure_variant(path, 'telegram')
+    return read_upload(variant_path(image_url, 'telegram')) or read_upload(image_url)
+
+# Receipt photos are recorded by Telegram file_id the moment they arrive, under
+# /uploads/receipts/tg-<file_unique_id>.jpg. The file itself is fetched later:
+# by the bot right after it has answered the customer, or by whichever API
+# worker the dashboard asks first. Telegram keeps the original, so these copies
+# are a cache, trimmed to RECEIPT_CACHE_MB by a maintenance job.
+TELEGRAM_RECEIPT = re.compile(r'^receipts/tg-[A-Za-z0-9_-]+\.jpg$')
+
+def telegram_receipt_url(file_unique_id):
+    return f'/uploads/receipts/tg-{file_unique_id}.jpg'
+
+def finish_receipt(temp_path, image_url):
+    """Normalize a downloaded receipt, write its variants and move it to image_url (blocking)"""
+    try:
+        ingest_image(temp_path, RECEIPT_IMAGE_VARIANTS)
+    except Exception as e:
+        log.warning(f'⚠️  Could not process image {temp_path}: {e}')
+    move_upload(temp_path, image_url.lstrip('/'))
+
+def remove_incoming(temp_path):
+    """Drop a partial download and any variants written for it"""
+    try:
+        remove_image_files(temp_path)
+    except OSError:
+        pass
+
+# Created on first use, inside the bot's event loop
+receipt_downloads = None
+
+async def prefetch_receipt(bot, file_id, image_url):
+    """Download a receipt in the background after the customer has been answered"""
+    global receipt_downloads
+    if receipt_downloads is None:
+        receipt_downloads = asyncio.Semaphore(RECEIPT_DOWNLOADS)
+    async with receipt_downloads:
+        if os.path.exists(image_url.lstrip('/')):
+            return
+        temp_path = incoming_path('uploads/receipts', 'jpg')
+        try:
+            file = await bot.get_file(file_id)
+            await file.download_to_drive(temp_path)
+            await asyncio.get_running_loop().run_in_executor(image_executor, finish_receipt, temp_path, image_url)
+        except (TelegramError, OSError) as e:
+            # Not lost: the API fetches it when the dashboard asks for it
+            remove_incoming(temp_path)
+            log.warning(f'⚠️  Could not fetch receipt {image_url}: {e}')
+
+def perceptual_hash(path):
+    """64-bit difference hash: one bit per pair of neighbouring pixels in a 9x8
+    grayscale thumbnail. Survives re-encoding and resizing; signed to fit SQLite."""
+    with Image.open(path) as img:
+        pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = bits << 1 | (pixels[row * 9 + col] < pixels[row * 9 + col + 1])
+    return bits - (1 << 64) if bits >> 63 else bits
+
+def hash_distance(a, b):
+    return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count('1')
+
+def receipt_hashes(image_url):
+    """(content hash, perceptual hash) of a downloaded receipt (blocking, CPU bound).
+
+    Either is None when it can't be worked out: not downloaded, no Pillow, not an image.
+    """
+    data = read_upload(image_url)
+    if data is None:
+        return None, None
+    phash = None
+    if Image is not None:
+        try:
+            phash = perceptual_hash(image_url.lstrip('/'))
+        except Exception as e:
+            log.warning(f'⚠️  Could not hash receipt {image_url}: {e}')
+    return hashlib.sha256(data).hexdigest(), phash
+
+def fetch_receipt(filename):
+    """Download a receipt the bot hasn't fetched yet, or the cache has dropped (blocking).
+
+    Only files a receipt still points at are fetched: cleaned receipts stay gone.
+    Returns whether the file is on disk now.
+    """
+    path = safe_join('uploads', filename)
+    if path is None or os.path.exists(path):
+        return path is not None
+    db = get_db()
+    row = db.execute('''SELECT telegram_file_id FROM receipts
+                        WHERE image_url = ? AND telegram_file_id IS NOT NULL LIMIT 1''',
+                     (f'/uploads/{filename}',)).fetchone()
+    db.close()
+    if row is None:
+        return False
+    
+    temp_path = incoming_path('uploads/receipts', 'jpg')
+    try:
+        request_body = urlencode({'file_id': row['telegram_file_id']}).encode()
+        with urlopen(f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/getFile', request_body, timeout=30) as response:
+            file_path = json.load(response)['result']['file_path']
+        with urlopen(f'{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}/{file_path}', timeout=60) as response, \
+                open(temp_path, 'wb') as f:
+            shutil.copyfileobj(response, f)
+        image_executor.submit(finish_receipt, temp_path, f'/{path}').result()
+        return True
+    except (OSError, ValueError, KeyError) as e:
+        remove_incoming(temp_path)
+        log.warning(f'⚠️  Could not fetch receipt {filename} from Telegram: {e}')
+        return False
+
+# ============================================================================
+# BOT DATA ACCESS (blocking, run on the DB executor)
+# ============================================================================
+
+# Handlers never touch sqlite directly: every query below runs on this pool via
+# run_db(), so a slow write in one chat doesn't stall updates for the others.
+DB_WORKERS = int(os.getenv('DB_WORKERS', 4))
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='sochow-db')
+
+async def run_db(func, *args):
+    """Run a blocking database function on the DB executor and await the result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, func, *args)
+
+def save_menu_file_id(menu_item_id, file_id, image_url, read_hash):
+    """Remember the file_id Telegram assigned to the item's photo.
+
+    It is filed under the hash of the original upload, which cached_file_id and
+    link_menu_photos compare against (the bytes sent are a resized variant).
+    read_hash and image_url are the item's when the bytes were read: if the
+    image was replaced meanwhile the row no longer matches and the stale
+    file_id is dropped.
+    """
+    file_hash = read_hash or image_file_hash(image_url)
+    if file_hash is None:
+        return
+    db = get_db()
+    db.execute('''UPDATE menu_items SET telegram_file_id = ?, telegram_file_hash = ?,
+                         image_hash = COALESCE(image_hash, ?)
+                  WHERE id = ? AND image_hash IS ? AND image_url IS ?''',
+               (file_id, file_hash, file_hash, menu_item_id, read_hash, image_url))
+    db.commit()
+    db.close()
+    menu_cache.reload()
+
+def cart_lines(db, cart_id):
+    """Cart lines joined with their menu item names"""
+    return db.execute('''SELECT ci.*, mi.name, mi.price_naira 
+                         FROM cart_items ci 
+                         JOIN menu_items mi ON ci.menu_item_id = mi.id 
+                         WHERE ci.cart_id = ?''', (cart_id,)).fetchall()
+
+def fetch_active_cart(user_id):
+    """Return (cart, items, subtotal) for the user's active cart"""
+    db = get_db()
+    cart_id = active_cart_id(db, user_id)
+    items = cart_lines(db, cart_id)
+    db.close()
+    return {'id': cart_id, 'user_id': user_id, 'status': 'active'}, items, cart_total(items)
+
+def add_item_to_cart(user_id, menu_item_id):
+    """Add one of a menu item to the user's active cart.
+
+    Returns (menu item, items in cart, subtotal) so the caller can confirm
+    without reading the cart again.
+    """
+    menu_item = menu_cache.get().by_id[menu_item_id]
+    db = get_db()
+    cart_id = active_cart_id(db, user_id)
+    
+    db.execute('''INSERT INTO cart_items (cart_id, menu_item_id, qty, unit_price) VALUES (?, ?, 1, ?)
+                  ON CONFLICT(cart_id, menu_item_id) DO UPDATE SET qty = qty + 1''',
+               (cart_id, menu_item_id, menu_item['price_naira']))
+    count, total = db.execute('''SELECT COALESCE(SUM(qty), 0), COALESCE(SUM(qty * unit_price), 0)
+                                 FROM cart_items WHERE cart_id = ?''', (cart_id,)).fetchone()
+    db.commit()
+    db.close()
+    return menu_item, count, total
+
+def change_cart_item_qty(cart_item_id, delta):
+    """Apply delta to a cart line; returns True if the line was removed"""
+    db = get_db()
+    item = db.execute('SELECT * FROM cart_items WHERE id = ?', (cart_item_id,)).fetchone()
+    
+    if not item:
+        # Stale button from an old cart message
+        db.close()
+        return False
+    
+    new_qty = item['qty'] + delta
+    
+    if new_qty <= 0:
+        db.execute('DELETE FROM cart_items WHERE id = ?', (cart_item_id,))
+    else:
+        db.execute('UPDATE cart_items SET qty = ? WHERE id = ?', (new_qty, cart_item_id))
+    
+    db.commit()
+    db.close()
+    return new_qty <= 0
+
+def empty_cart(user_id):
+    """Remove every line from the user's active cart"""
+    db = get_db()
+    db.execute('DELETE FROM cart_items WHERE cart_id = ?', (active_cart_id(db, user_id),))
+    db.commit()
+    db.close()
+
+def place_order(user, state):
+    """Turn the checkout cart into an order; returns (order_id, items, total, is_admin)"""
+    
+    # Check if this is an admin order
+    is_admin = str(user['telegram_id']) == str(ADMIN_CHAT_ID)
+    initial_payment_status = 'verified' if is_admin else 'pending'
+    initial_order_status = 'processing' if is_admin else 'processing'
+    
+    db = get_db()
+    items = cart_lines(db, state['cart_id'])
+    total = cart_total(items)
+    order_id = generate_order_id(db)
+    cursor = db.execute(f'''INSERT INTO orders (user_id, cart_id, order_id, total_naira, delivery_address, contact_number, payment_status, order_status, updated_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, {SQL_NOW})''',
+                        (user['id'], state['cart_id'], order_id, total, state['address'], state['phone'], initial_payment_status, initial_order_status))
+    
+    db.execute('UPDATE carts SET status = ? WHERE id = ?', ('checked_out', state['cart_id']))
+    # Finish the checkout conversation in the same transaction so a restart can't resume it
+    db.execute('DELETE FROM conversation_states WHERE user_id = ?', (user['id'],))
+    db.commit()
+    db.close()
+    identity_cache.forget_cart(user['id'])
+    order_events.publish(cursor.lastrowid)
+    return order_id, items, total, is_admin
+
+def find_pending_order(user_id):
+    """Most recent order still waiting for payment"""
+    db = get_db()
+    order = db.execute('''SELECT * FROM orders 
+                          WHERE user_id = ? AND payment_status = 'pending' 
+                          ORDER BY created_at DESC LIMIT 1''', (user_id,)).fetchone()
+    db.close()
+    return order
+
+def save_receipt(order, user_id, photo_file_id, photo_unique_id):
+    """Record a payment receipt by its Telegram file. The admin hears about it
+    from check_receipt, once the file is downloaded and found to be new.
+
+    Returns (receipt id, image_url, None), or (None, image_url, order_id) when
+    this exact file is already the receipt for order_id.
+    """
+    image_url = telegram_receipt_url(photo_unique_id)
+    db = get_db()
+    cursor = db.execute('''INSERT OR IGNORE INTO receipts
+                               (order_id, user_id, image_url, telegram_file_id, telegram_file_unique_id)
+                           VALUES (?, ?, ?, ?, ?)''', (order['id'], user_id, image_url, photo_file_id, photo_unique_id))
+    if cursor.rowcount == 0:
+        # Ignored by idx_receipts_file_unique: Telegram says it is the very same file
+        first = db.execute('''SELECT o.order_id FROM receipts r JOIN orders o ON o.id = r.order_id
+                              WHERE r.telegram_file_unique_id = ? AND r.duplicate_of IS NULL''',
+                           (photo_unique_id,)).fetchone()
+        db.commit()
+        db.close()
+        return None, image_url, first['order_id']
+    # Bump the order so the dashboard's delta sync picks up the new receipt
+    db.execute(f'UPDATE orders SET updated_at = {SQL_NOW} WHERE id = ?', (order['id'],))
+    db.commit()
+    db.close()
+    order_events.publish(order['id'])
+    return cursor.lastrowid, image_url, None
+
+def check_receipt(receipt_id, content_hash, phash):
+    """Compare a downloaded receipt with earlier ones and notify the admin only if it is new.
+
+    The same bytes as any receipt, or a perceptual hash within
+    RECEIPT_PHASH_DISTANCE bits of an earlier receipt for the same order, make
+    it a duplicate: it stays on its order, where the dashboard flags it, but
+    the admin isn't asked to verify it again. A near match with the customer's
+    receipt for another order may be a genuine repeat payment from the same
+    app, so the admin is notified with a note naming that receipt. Without
+    hashes (the download failed) it counts as new. Returns the id of the
+    receipt it duplicates, or None.
+    """
+    db = get_db()
+    db.begin()
+    receipt = db.execute('''SELECT r.*, o.order_id AS order_code, o.total_naira FROM receipts r
+                            JOIN orders o ON o.id = r.order_id WHERE r.id = ?''', (receipt_id,)).fetchone()
+    if receipt is None or receipt['checked_at'] is not None:
+        db.rollback()  # already checked: check_unchecked_receipts got there first
+        db.close()
+        return None
+    
+    duplicate_of, similar = None, None
+    if content_hash is not None:
+        first = db.execute('SELECT id FROM receipts WHERE content_hash = ? AND duplicate_of IS NULL',
+                           (content_hash,)).fetchone()
+        duplicate_of = first['id'] if first else None
+    if duplicate_of is None and phash is not None:
+        for row in db.execute('''SELECT r.id, r.order_id, r.phash, o.order_id AS order_code
+                                 FROM receipts r JOIN orders o ON o.id = r.order_id
+                                 WHERE r.user_id = ? AND r.created_at > datetime('now', ?)
+                                 AND r.phash IS NOT NULL AND r.duplicate_of IS NULL
+                                 ORDER BY r.order_id = ? DESC, r.created_at DESC''',
+                              (receipt['user_id'], f'-{RECEIPT_DUPLICATE_DAYS} days', receipt['order_id'])):
+            if hash_distance(row['phash'], phash) <= RECEIPT_PHASH_DISTANCE:
+                similar = row
+                break
+        if similar is not None and similar['order_id'] == receipt['order_id']:
+            duplicate_of, similar = similar['id'], None  # the same payment captured again
+    
+    db.execute(f'''UPDATE receipts SET content_hash = ?, phash = ?, duplicate_of = ?, similar_to = ?,
+                                      checked_at = {SQL_NOW}
+                   WHERE id = ?''', (content_hash, phash, duplicate_of, similar['id'] if similar else None, receipt_id))
+    if duplicate_of is None:
+        text = f"💳 Payment receipt for {receipt['order_code']}\nAmount: ₦{receipt['total_naira']:,}"
+        if similar is not None:
+            text += f"\n⚠️ Looks like receipt {similar['id']} for {similar['order_code']}: check it is a new payment"
+        queue_message(db, ADMIN_CHAT_ID, text, photo=receipt['telegram_file_id'])
+    flagged = duplicate_of is not None or similar is not None
+    if flagged:
+        # The dashboard's delta sync and stream pick up the flag through updated_at
+        db.execute(f'UPDATE orders SET updated_at = {SQL_NOW} WHERE id = ?', (receipt['order_id'],))
+    db.commit()
+    db.close()
+    if duplicate_of is None:
+        outbound.wake()
+    if flagged:
+        order_events.publish(receipt['order_id'])
+    if duplicate_of is not None:
+        log.info(f"🔁 Receipt {receipt_id} for {receipt['order_code']} duplicates receipt {duplicate_of}",
+                 extra={'receipt_id': receipt_id, 'duplicate_of': duplicate_of})
+    return duplicate_of
+
+def fetch_recent_orders(user_id, limit=5):
+    """Latest orders for the tracking screen"""
+    db = get_db()
+    orders = db.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?', 
+                        (user_id, limit)).fetchall()
+    db.close()
+    return orders
+
+# ============================================================================
+# OUTBOUND TELEGRAM QUEUE
+# ============================================================================
+
+# Notifications go through outbound_messages instead of being sent inline, so
+# admin API calls return immediately and nothing is lost during flood control.
+OUTBOUND_GLOBAL_RATE = 25        # messages/second across all chats (Telegram allows ~30)
+OUTBOUND_CHAT_INTERVAL = 1.0     # seconds between messages to the same chat
+OUTBOUND_MAX_ATTEMPTS = 8
+OUTBOUND_MAX_BACKOFF = 300       # seconds
+OUTBOUND_POLL_INTERVAL = 2       # seconds; also picks up rows queued by other processes
+OUTBOUND_BATCH = 50
+OUTBOUND_IN_FLIGHT = 16          # sends awaiting Telegram at once, each to a different chat
+
+def queue_message(db, chat_id, text=None, photo=None):
+    """Queue a Telegram message inside the caller's transaction.
+
+    The message is durable once the caller commits; call outbound.wake()
+    afterwards so the worker sends it right away instead of on its next poll.
+    photo is a Telegram file_id, sent with text as its caption.
+    """
+    db.execute('INSERT INTO outbound_messages (chat_id, text, photo) VALUES (?, ?, ?)',
+               (str(chat_id), text, photo))
+
+def fetch_due_messages(limit):
+    db = get_db()
+    # Only each chat's oldest pending message: one waiting out a retry backoff
+    # holds back the newer ones behind it instead of being overtaken
+    rows = db.execute('''SELECT * FROM outbound_messages m
+                          WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                            AND NOT EXISTS (SELECT 1 FROM outbound_messages p
+                                            WHERE p.chat_id = m.chat_id AND p.status = 'pending' AND p.id < m.id)
+                          ORDER BY id LIMIT ?''', (limit,)).fetchall()
+    db.close()
+    return rows
+
+def finish_message(message_id, status, error=None):
+    """Mark a queued message as sent or permanently failed"""
+    db = get_db()
+    db.execute('''UPDATE outbound_messages SET status = ?, last_error = ?, attempts = attempts + 1,
+                  sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP END
+                  WHERE id = ?''', (status, error, status, message_id))
+    db.commit()
+    db.close()
+
+def retry_message_later(message_id, delay, error):
+    db = get_db()
+    db.execute('''UPDATE outbound_messages SET attempts = attempts + 1, last_error = ?,
+                  next_attempt_at = datetime('now', ?)
+                  WHERE id = ?''', (error, f'+{int(delay)} seconds', message_id))
+    db.commit()
+    db.close()
+
+class OutboundWorker:
+    """Drains outbound_messages on the bot's event loop.
+
+    Sends at most OUTBOUND_GLOBAL_RATE messages per second overall and one per
+    OUTBOUND_CHAT_INTERVAL per chat, keeps each chat's messages in order,
+    pauses everything for RetryAfter, and retries network errors with
+    exponential backoff before giving up.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.loop = None
+        self.wakeup = None
+        self.task = None
+        self.chat_ready_at = {}    # chat_id -> monotonic time it may receive again
+        self.next_send_at = 0.0    # global pacing
+        self.paused_until = 0.0    # flood control from RetryAfter
+
+    async def start(self, bot):
+        self.bot = bot
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def wake(self):
+        """Nudge the worker after queueing; safe from any thread, no-op without a running bot"""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        while True:
+            try:
+                sent, wait = await self.drain_once()
+            except Exception as e:
+                log.warning(f'⚠️  Outbound queue error: {e}')
+                sent, wait = 0, OUTBOUND_POLL_INTERVAL
+            if sent:
+                continue  # the next message of each chat just served may be waiting
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=wait or OUTBOUND_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self):
+        """Send the oldest due message of every chat that may receive now.
+
+        Returns (messages that left the queue, seconds until a skipped chat is
+        ready or None).
+        """
+        rows = await run_db(fetch_due_messages, OUTBOUND_BATCH)
+        wait = None
+        # Rows are one per chat, so sends overlap across chats only: throughput
+        # follows OUTBOUND_GLOBAL_RATE instead of the Bot API round trip
+        slots = asyncio.Semaphore(OUTBOUND_IN_FLIGHT)
+        sends = []
+        
+        for row in rows:
+            chat_id = row['chat_id']
+            await slots.acquire()
+            if self.next_send_at > time.monotonic():
+                await asyncio.sleep(self.next_send_at - time.monotonic())
+            now = time.monotonic()
+            ready_at = max(self.chat_ready_at.get(chat_id, 0.0), self.paused_until)
+            if ready_at > now:
+                slots.release()
+                wait = ready_at - now if wait is None else min(wait, ready_at - now)
+                continue
+            
+            self.next_send_at = now + 1 / OUTBOUND_GLOBAL_RATE
+            self.chat_ready_at[chat_id] = now + OUTBOUND_CHAT_INTERVAL
+            sends.append(asyncio.create_task(self.send(row, slots)))
+        
+        sent = 0
+        for result in await asyncio.gather(*sends, return_exceptions=True):
+            if isinstance(result, Exception):
+                log.warning(f'⚠️  Outbound queue error: {result}')
+            elif result:
+                sent += 1
+
+        if len(self.chat_ready_at) > 1000:
+            now = time.monotonic()
+            self.chat_ready_at = {chat: t for chat, t in self.chat_ready_at.items() if t > now}
+        return sent, wait
+
+    async def send(self, row, slots):
+        try:
+            return await self.deliver(row)
+        finally:
+            slots.release()
+
+    async def deliver(self, row):
+        """Send one queued message; returns True if it left the queue"""
+        try:
+            if row['photo']:
+                await self.bot.send_photo(row['chat_id'], row['photo'], caption=row['text'])
+            else:
+                await self.bot.send_message(row['chat_id'], row['text'])
+        except RetryAfter as e:
+            # Flood control applies to the whole bot: pause all sends, don't count an attempt
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+            self.paused_until = time.monotonic() + retry_after
+            log.info(f'⏳ Telegram flood control: pausing outbound messages for {retry_after}s')
+            return False
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot or bad chat id: retrying won't help
+            await run_db(finish_message, row['id'], 'failed', str(e))
+            log.warning(f'⚠️  Dropped message {row["id"]} to {row["chat_id"]}: {e}',
+                        extra={'message_id': row['id'], 'chat_id': row['chat_id']})
+            return True
+        except TelegramError as e:
+            attempts = row['attempts'] + 1
+            if attempts >= OUTBOUND_MAX_ATTEMPTS:
+                await run_db(finish_message, row['id'], 'failed', str(e))
+                log.warning(f'⚠️  Giving up on message {row["id"]} after {attempts} attempts: {e}',
+                            extra={'message_id': row['id'], 'chat_id': row['chat_id']})
+            else:
+                await run_db(retry_message_later, row['id'], min(2 ** attempts, OUTBOUND_MAX_BACKOFF), str(e))
+            return False
+        
+        await run_db(finish_message, row['id'], 'sent')
+        return True
+
+outbound = OutboundWorker()
+
+# ============================================================================
+# CONVERSATION STATE
+# ============================================================================
+
+class StateStore:
+    """Durable backend for ConversationStates. Methods block; call them off the event loop."""
+
+    def get(self, user_id):
+        """Return (state, expires_at) or None"""
+        raise NotImplementedError
+
+    def write(self, changes):
+        """Apply {user_id: (state, expires_at) or None to delete} in one go"""
+        raise NotImplementedError
+
+    def purge_expired(self, now):
+        """Drop expired states; returns how many were removed"""
+        raise NotImplementedError
+
+class SQLiteStateStore(StateStore):
+    """Keeps states in the conversation_states table so they survive restarts"""
+
+    def get(self, user_id):
+        db = get_db()
+        row = db.execute('SELECT state, expires_at FROM conversation_states WHERE user_id = ?',
+                         (user_id,)).fetchone()
+        db.close()
+        return (json.loads(row['state']), row['expires_at']) if row else None
+
+    def write(self, changes):
+        db = get_db()
+        db.executemany('''INSERT INTO conversation_states (user_id, state, expires_at) VALUES (?, ?, ?)
+                          ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at''',
+                       [(user_id, json.dumps(entry[0]), entry[1])
+                        for user_id, entry in changes.items() if entry is not None])
+        db.executemany('DELETE FROM conversation_states WHERE user_id = ?',
+                       [(user_id,) for user_id, entry in changes.items() if entry is None])
+        db.commit()
+        db.close()
+
+    def purge_expired(self, now):
+        db = get_db()
+        removed = db.execute('DELETE FROM conversation_states WHERE expires_at <= ?', (now,)).rowcount
+        db.commit()
+        db.close()
+        return removed
+
+class ConversationStates:
+    """Checkout state per user: an LRU in memory in front of a write-behind StateStore.
+
+    Handlers read and write memory only; changes are batched to the store by a
+    flush task on the bot loop (and on shutdown), so a restart loses at most
+    the last flush interval. Memory holds at most `capacity` recent states plus
+    unflushed changes; older ones are reloaded from the store on demand.
+    States expire `ttl` seconds after their last write.
+    """
+
+    def __init__(self, store, capacity=CHECKOUT_STATE_CACHE, ttl=CHECKOUT_STATE_TTL,
+                 flush_interval=1.0, purge_interval=600):
+        self.store = store
+        self.capacity = capacity
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self.cache = OrderedDict()   # user_id -> (state, expires_at), most recent last
+        self.dirty = {}              # user_id -> (state, expires_at) or None, not yet in the store
+        self.lock = Lock()
+        self.task = None
+        self.wakeup = None
+
+    async def get(self, user_id):
+        """Current state for a user (a dict you may modify and set() back) or None"""
+        with self.lock:
+            if user_id in self.dirty:
+                entry = self.dirty[user_id]
+            else:
+                entry = self.cache.get(user_id)
+                if entry is not None:
+                    self.cache.move_to_end(user_id)
+        
+        if entry is None and user_id not in self.dirty:
+            metrics.inc('sochow_cache_requests_total', cache='checkout_states', result='miss')
+            entry = await run_db(self.store.get, user_id)
+            if entry is not None:
+                self.remember(user_id, entry)
+        else:
+            metrics.inc('sochow_cache_requests_total', cache='checkout_states', result='hit')
+        
+        if entry is None or entry[1] <= time.time():
+            return None
+        return dict(entry[0])
+
+    def set(self, user_id, state):
+        entry = (dict(state), time.time() + self.ttl)
+        with self.lock:
+            self.dirty[user_id] = entry
+        self.remember(user_id, entry)
+        self.nudge()
+
+    def delete(self, user_id):
+        with self.lock:
+            self.dirty[user_id] = None
+            self.cache.pop(user_id, None)
+        self.nudge()
+
+    def remember(self, user_id, entry):
+        with self.lock:
+            self.cache[user_id] = entry
+            self.cache.move_to_end(user_id)
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)  # still in dirty until flushed, so nothing is lost
+
+    def nudge(self):
+        # Flush early if unflushed changes pile up past the cache size
+        if self.wakeup is not None and len(self.dirty) >= self.capacity:
+            self.wakeup.set()
+
+    def flush(self):
+        """Write pending changes to the store (blocking)"""
+        with self.lock:
+            changes, self.dirty = self.dirty, {}
+        if not changes:
+            return
+        try:
+            self.store.write(changes)
+        except Exception:
+            with self.lock:
+                # Keep anything written again since; retry the rest next time
+                for user_id, entry in changes.items():
+                    self.dirty.setdefault(user_id, entry)
+            raise
+
+    async def start(self):
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await run_db(self.flush)
+
+    async def run(self):
+        next_purge = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await run_db(self.flush)
+                if time.monotonic() >= next_purge:
+                    next_purge = time.monotonic() + self.purge_interval
+                    removed = await run_db(self.store.purge_expired, time.time())
+                    if removed:
+                        log.info(f'🧹 Expired {removed} abandoned checkout(s)')
+            except Exception as e:
+                log.warning(f'⚠️  Checkout state flush failed: {e}')
+
+checkout_states = ConversationStates(SQLiteStateStore())
 
 # ============================================================================
-# HELPER FUNCTIONS
+# MAINTENANCE JOBS
 # ============================================================================
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('sochow.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# Each job is blocking, returns the number of rows it changed, and works in
+# bounded batches so it never holds the write lock for long.
+MAINTENANCE_BATCH = 200
+MAINTENANCE_MAX_BATCHES = 25     # per run; the rest waits for the next run
+MAINTENANCE_HISTORY_DAYS = 30
 
-def get_or_create_user(telegram_id, name):
-    """Get or create user from Telegram data"""
+def cleanup_old_receipts():
+    """Delete receipt files 7+ days after verification, keeping the receipt rows"""
+    total = 0
+    for _ in range(MAINTENANCE_MAX_BATCHES):
+        db = get_db()
+        receipts = db.execute('''SELECT id, image_url FROM receipts 
+                                  WHERE admin_verified = 1 
+                                  AND verified_at < datetime('now', '-7 days')
+                                  AND image_url != ''
+                                  LIMIT ?''', (MAINTENANCE_BATCH,)).fetchall()
+        db.close()
+        if not receipts:
+            break
+        
+        # Keep the records but mark their files as deleted (image_url is NOT NULL)
+        urls = {receipt['image_url'] for receipt in receipts}
+        db = get_db()
+        try:
+            db.executemany("UPDATE receipts SET image_url = '' WHERE id = ?",
+                           [(receipt['id'],) for receipt in receipts])
+            # Content-addressed files can be shared by receipts that are still needed
+            placeholders = ','.join('?' * len(urls))
+            urls -= {row['image_url'] for row in db.execute(
+                f'SELECT DISTINCT image_url FROM receipts WHERE image_url IN ({placeholders})', tuple(urls))}
+            db.commit()
+        finally:
+            db.close()
+        
+        # Delete the physical files outside any transaction
+        for image_url in urls:
+            file_path = image_url.lstrip('/')
+            try:
+                remove_image_files(file_path)
+            except OSError as e:
+                log.warning(f'⚠️  Could not delete {file_path}: {e}')
+        total += len(receipts)
+        if len(receipts) < MAINTENANCE_BATCH:
+            break
+    return total
+
+def unchecked_receipts():
+    """Receipts the bot answered but never checked (it restarted in between)"""
     db = get_db()
-    user = db.execute('SELECT * FROM users WHERE telegram_id = ?', (str(telegram_id),)).fetchone()
-    
-    if not user:
-        db.execute('INSERT INTO users (telegram_id, name) VALUES (?, ?)', (str(telegram_id), name))
-        db.commit()
-        user = db.execute('SELECT * FROM users WHERE telegram_id = ?', (str(telegram_id),)).fetchone()
-        print(f'📝 New user: {name} ({telegram_id})')
-    
+    receipts = db.execute('''SELECT id, telegram_file_id, image_url FROM receipts
+                             WHERE checked_at IS NULL AND created_at < datetime('now', '-5 minutes')
+                             AND image_url != '' LIMIT ?''', (MAINTENANCE_BATCH,)).fetchall()
     db.close()
-    return dict(user)
+    return receipts
+
+def trim_receipt_cache():
+    """Delete the oldest downloaded Telegram receipts beyond RECEIPT_CACHE_MB; they are fetched again if needed"""
+    sizes, modified = defaultdict(int), {}
+    try:
+        entries = list(os.scandir('uploads/receipts'))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        variant = VARIANT_FILENAME.match(entry.name)
+        original = variant.group(1) if variant else entry.name
+        if TELEGRAM_RECEIPT.match(f'receipts/{original}'):
+            stat = entry.stat()
+            sizes[original] += stat.st_size
+            if not variant:
+                modified[original] = stat.st_mtime
+    
+    excess = sum(sizes.values()) - RECEIPT_CACHE_MB * 1024 * 1024
+    removed = 0
+    # Oldest download first; variants whose original is already gone go first of all
+    for original in sorted(sizes, key=lambda name: modified.get(name, 0)):
+        if excess <= 0:
+            break
+        remove_image_files(f'uploads/receipts/{original}')
+        excess -= sizes[original]
+        removed += 1
+    return removed
+
+def expire_stale_carts():
+    """Retire active carts nobody has touched for CART_EXPIRY_DAYS"""
+    total = 0
+    for _ in range(MAINTENANCE_MAX_BATCHES):
+        db = get_db()
+        try:
+            expired = db.execute('''UPDATE carts SET status = 'expired', updated_at = CURRENT_TIMESTAMP
+                                     WHERE id IN (SELECT id FROM carts
+                                                  WHERE status = 'active' AND updated_at < datetime('now', ?)
+                                                  LIMIT ?)
+                                     RETURNING user_id''', (f'-{CART_EXPIRY_DAYS} days', MAINTENANCE_BATCH)).fetchall()
+            db.commit()
+        finally:
+            db.close()
+        for cart in expired:
+            identity_cache.forget_cart(cart['user_id'])
+        total += len(expired)
+        if len(expired) < MAINTENANCE_BATCH:
+            break
+    return total
+
+def expire_unpaid_orders():
+    """Cancel pending orders that got no receipt within UNPAID_ORDER_EXPIRY_HOURS and tell the customer"""
+    total = 0
+    for _ in range(MAINTENANCE_MAX_BATCHES):
+        db = get_db()
+        try:
+            expired = db.execute(f'''UPDATE orders SET payment_status = 'expired', order_status = 'cancelled',
+                                         updated_at = {SQL_NOW}
+                                      WHERE id IN (SELECT o.id FROM orders o
+                                                   WHERE o.payment_status = 'pending'
+                                                   AND o.created_at < datetime('now', ?)
+                                                   AND NOT EXISTS (SELECT 1 FROM receipts r WHERE r.order_id = o.id)
+                                                   LIMIT ?)
+                                      RETURNING id, order_id, user_id''',
+                                 (f'-{UNPAID_ORDER_EXPIRY_HOURS} hours', MAINTENANCE_BATCH)).fetchall()
+            for order in expired:
+                user = db.execute('SELECT telegram_id FROM users WHERE id = ?', (order['user_id'],)).fetchone()
+                queue_message(db, user['telegram_id'],
+                              f"⌛ Order {order['order_id']} was cancelled because no payment was received. "
+                              f"Send /start to order again.")
+            db.commit()
+        finally:
+            db.close()
+        if expired:
+            outbound.wake()
+        for order in expired:
+            order_events.publish(order['id'])
+        total += len(expired)
+        if len(expired) < MAINTENANCE_BATCH:
+            break
+    return total
 
-def get_or_create_cart(user_id):
-    """Get or create active cart for user"""
+def optimize_database():
+    """Refresh planner statistics and prune old maintenance history"""
     db = get_db()
-    cart = db.execute('SELECT * FROM carts WHERE user_id = ? AND status = ?', (user_id, 'active')).fetchone()
-    
-    if not cart:
-        db.execute('INSERT INTO carts (user_id, status) VALUES (?, ?)', (user_id, 'active'))
+    try:
+        db.execute('PRAGMA optimize')
+        pruned = db.execute("DELETE FROM maintenance_runs WHERE started_at < datetime('now', ?)",
+                            (f'-{MAINTENANCE_HISTORY_DAYS} days',)).rowcount
         db.commit()
-        cart = db.execute('SELECT * FROM carts WHERE user_id = ? AND status = ?', (user_id, 'active')).fetchone()
-    
-    db.close()
-    return dict(cart)
+    finally:
+        db.close()
+    return pruned
 
-def calc_cart_total(cart_id):
-    """Calculate cart total"""
-    db = get_db()
-    result = db.execute('SELECT SUM(qty * unit_price) as total FROM cart_items WHERE cart_id = ?', (cart_id,)).fetchone()
-    db.close()
-    return result['total'] or 0
+def incremental_vacuum():
+    """Return free pages to the filesystem; returns pages freed.
 
-def generate_order_id():
-    """Generate unique order ID: SOCHOW-YYYYMMDD-XXXX"""
-    date_str = datetime.now().strftime('%Y%m%d')
+    Needs auto_vacuum = INCREMENTAL, which SQLite only applies to databases
+    created with it (or after a full VACUUM); otherwise this does nothing.
+    """
     db = get_db()
-    count = db.execute("SELECT COUNT(*) as cnt FROM orders WHERE DATE(created_at) = DATE('now')").fetchone()['cnt']
-    db.close()
-    sequence = str(count + 1).zfill(4)
-    return f'SOCHOW-{date_str}-{sequence}'
+    try:
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        before = db.execute('PRAGMA freelist_count').fetchone()[0]
+        db.execute('PRAGMA incremental_vacuum(2000)').fetchall()
+        return before - db.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        db.close()
 
-def cleanup_old_receipts():
-    """Delete receipt files older than 7 days after verification"""
-    db = get_db()
-    # Find receipts verified more than 7 days ago
-    old_receipts = db.execute('''SELECT id, image_url FROM receipts 
-                                 WHERE admin_verified = 1 
-                                 AND verified_at IS NOT NULL
-                                 AND julianday('now') - julianday(verified_at) > 7
-                                 AND image_url IS NOT NULL''').fetchall()
-    
-    deleted_count = 0
-    for receipt in old_receipts:
-        # Delete the physical file
-        file_path = receipt['image_url'].lstrip('/')
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                deleted_count += 1
-            except Exception as e:
-                print(f'⚠️  Could not delete {file_path}: {e}')
-        
-        # Clear the image_url in database (keep record but mark file as deleted)
-        db.execute('UPDATE receipts SET image_url = NULL WHERE id = ?', (receipt['id'],))
+# (name, function, interval seconds, first run after startup in seconds)
+MAINTENANCE_JOBS = [
+    ('cleanup_old_receipts', cleanup_old_receipts, 3600, 30),
+    ('trim_receipt_cache', trim_receipt_cache, 3600, 45),
+    ('expire_stale_carts', expire_stale_carts, 3600, 60),
+    ('expire_unpaid_orders', expire_unpaid_orders, 900, 90),
+    ('optimize_database', optimize_database, 24 * 3600, 600),
+    ('incremental_vacuum', incremental_vacuum, 24 * 3600, 900),
+]
+
+def run_maintenance(name, func):
+    """Run one job and record its duration, rows affected and any error in maintenance_runs"""
+    started = time.perf_counter()
+    rows, error = 0, None
+    try:
+        rows = func()
+    except Exception as e:
+        error = str(e)
+        log.warning(f'⚠️  Maintenance job {name} failed: {e}', extra={'job': name})
+    duration_ms = (time.perf_counter() - started) * 1000
     
+    db = get_db()
+    db.execute('INSERT INTO maintenance_runs (job, duration_ms, rows_affected, error) VALUES (?, ?, ?, ?)',
+               (name, duration_ms, rows, error))
     db.commit()
     db.close()
+    if rows:
+        log.info(f'🧹 {name}: {rows} rows in {duration_ms:.0f} ms',
+                 extra={'job': name, 'rows': rows, 'duration_ms': round(duration_ms, 1)})
+    return rows
+
+def schedule_maintenance(job_queue):
+    """Register MAINTENANCE_JOBS on the bot's JobQueue"""
+    if job_queue is None:
+        log.warning('⚠️  JobQueue unavailable (pip install "python-telegram-bot[job-queue]"): maintenance jobs disabled')
+        return
     
-    if deleted_count > 0:
-        print(f'🧹 Cleaned up {deleted_count} old receipt files (7+ days)')
+    for name, func, interval, first in MAINTENANCE_JOBS:
+        async def callback(context, name=name, func=func):
+            await run_db(run_maintenance, name, func)
+        job_queue.run_repeating(callback, interval=interval, first=first, name=name)
+
+def backfill_stats():
+    """Rebuild the sales rollups from the orders table (python bot.py backfill-stats)"""
+    db = get_db()
+    try:
+        db.begin()
+        days = rebuild_sales_stats(db)
+        db.commit()
+    finally:
+        db.close()
+    log.info(f'✅ Rebuilt sales stats for {days} days')
+
+async def refresh_menu(context):
+    """Pick up menu edits made by API workers running in other processes"""
+    await run_db(menu_cache.refresh)
 
-# Call seeding functions
-seed_menu_items()
-link_menu_photos()
-cleanup_old_receipts()  # Run cleanup on startup
+async def check_unchecked_receipts(context):
+    """Fetch, check and announce unchecked_receipts() the way handle_photo does.
 
-print('✅ SOCHOW Bot Ready')
+    Runs on the loop rather than as a maintenance job: the downloads can wait on
+    Telegram for a long time and must not hold a DB worker meanwhile.
+    """
+    for receipt in await run_db(unchecked_receipts):
+        await process_receipt(context.bot, receipt['id'], receipt['telegram_file_id'], receipt['image_url'])
+
+async def on_startup(application):
+    """Start background workers once the bot's event loop is running"""
+    await outbound.start(application.bot)
+    await checkout_states.start()
+    schedule_maintenance(application.job_queue)
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(refresh_menu, interval=MENU_REFRESH_INTERVAL, name='refresh_menu')
+        application.job_queue.run_repeating(check_unchecked_receipts, interval=RECEIPT_RECHECK_INTERVAL, first=20,
+                                            name='check_unchecked_receipts')
+
+async def on_shutdown(application):
+    await outbound.stop()
+    await checkout_states.stop()
 
 # ============================================================================
 # TELEGRAM BOT HANDLERS
 # ============================================================================
 
-# Store user states for checkout flow
-user_states = {}
+async def resolve_user(tg_user):
+    """User row for a Telegram user; skips the DB executor when it is already cached"""
+    user = identity_cache.user(tg_user.id)
+    metrics.inc('sochow_cache_requests_total', cache='users', result='miss' if user is None else 'hit')
+    return user or await run_db(get_or_create_user, tg_user.id, tg_user.first_name)
+
+# Chat whose update is being handled; lets Bot API calls be attributed to a session
+current_chat = contextvars.ContextVar('current_chat', default=None)
+
+class BotApiStats:
+    """Counts Bot API calls overall, per method, and per chat ordering session.
+
+    A session is every call made for a chat since its last order, so
+    calls-per-order compares the browser and classic menu flows directly.
+    """
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self.lock = Lock()
+        self.calls = 0
+        self.by_method = Counter()
+        self.sessions = OrderedDict()
+        self.orders = 0
+        self.order_calls = 0
+
+    def record(self, method):
+        chat_id = current_chat.get()
+        with self.lock:
+            self.calls += 1
+            self.by_method[method] += 1
+            if chat_id is not None:
+                self.sessions[chat_id] = self.sessions.pop(chat_id, 0) + 1
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+
+    def end_session(self, chat_id):
+        """Close a chat's session when it places an order; returns its call count"""
+        with self.lock:
+            calls = self.sessions.pop(chat_id, 0)
+            self.orders += 1
+            self.order_calls += calls
+            return calls
+
+    def snapshot(self):
+        with self.lock:
+            return {'calls': self.calls,
+                    'by_method': dict(self.by_method),
+                    'orders': self.orders,
+                    'calls_per_order': self.order_calls / self.orders if self.orders else None}
+
+bot_api_stats = BotApiStats()
+
+class CountingBot(ExtBot):
+    """ExtBot that records every Bot API request in bot_api_stats and metrics"""
+
+    async def _do_post(self, endpoint, *args, **kwargs):
+        bot_api_stats.record(endpoint)
+        if not metrics.enabled:
+            return await super()._do_post(endpoint, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super()._do_post(endpoint, *args, **kwargs)
+        except RetryAfter:
+            metrics.inc('sochow_bot_api_retry_after_total', method=endpoint)
+            raise
+        except Exception as e:
+            metrics.inc('sochow_bot_api_errors_total', method=endpoint, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe('sochow_bot_api_seconds', time.perf_counter() - started, method=endpoint)
+
+def update_type(update):
+    """Metrics label for an update: callback_query, photo, message or other"""
+    if update.callback_query:
+        return 'callback_query'
+    if update.message:
+        return 'photo' if update.message.photo else 'message'
+    return 'other'
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently across chats, but one at a time within a chat.
+
+    Keeps a customer's own taps in order (no double carts from a double tap)
+    while a slow update in one chat never blocks the others.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.chat_locks = weakref.WeakValueDictionary()
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        
+        lock = self.chat_locks.get(chat.id)
+        if lock is None:
+            lock = self.chat_locks[chat.id] = asyncio.Lock()
+        # process_update took a CONCURRENT_UPDATES slot before calling us: hand it
+        # back while queued behind this chat, so a burst from one chat can't hold
+        # every slot and starve the others
+        queued = lock.locked()
+        if queued:
+            self._semaphore.release()
+        try:
+            async with lock:
+                if queued:
+                    await self._semaphore.acquire()
+                    queued = False
+                current_chat.set(chat.id)
+                started = time.perf_counter()
+                try:
+                    await coroutine
+                finally:
+                    metrics.observe('sochow_update_seconds', time.perf_counter() - started, type=update_type(update))
+        finally:
+            if queued:
+                await self._semaphore.acquire()  # cancelled while queued: process_update releases one
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
-    user = update.effective_user
-    get_or_create_user(user.id, user.first_name)
+    await resolve_user(update.effective_user)
     
     keyboard = [
         [InlineKeyboardButton("🍽️ View Menu", callback_data="view_menu"),
@@ -343,16 +2632,36 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks"""
+    """Handle button callbacks, timed per action"""
     query = update.callback_query
-    await query.answer()
-    
-    user = get_or_create_user(query.from_user.id, query.from_user.first_name)
     data = query.data.split(':')
+    started = time.perf_counter()
+    try:
+        await dispatch_button(query, data)
+    finally:
+        # callback_data comes from the client: anything unknown shares one series
+        action = data[0] if data[0] in BUTTON_ACTIONS else 'other'
+        metrics.observe('sochow_callback_seconds', time.perf_counter() - started, action=action)
+
+BUTTON_ACTIONS = {'view_menu', 'menu_page', 'view_cart', 'add_to_cart', 'increase_qty', 'decrease_qty',
+                  'clear_cart', 'checkout', 'track_order', 'help'}
+
+async def dispatch_button(query, data):
     action = data[0]
     
+    # In browser mode cart actions answer with their own toast instead of a new message
+    if not (MENU_MODE == 'browser' and action in ('add_to_cart', 'increase_qty', 'decrease_qty')):
+        await query.answer()
+    
+    user = await resolve_user(query.from_user)
+    
     if action == 'view_menu':
-        await show_menu(query, user['id'])
+        if MENU_MODE == 'browser':
+            await show_menu_page(query, 0)
+        else:
+            await show_menu(query, user['id'])
+    elif action == 'menu_page':
+        await show_menu_page(query, int(data[1]))
     elif action == 'view_cart':
         await show_cart(query, user['id'])
     elif action == 'add_to_cart':
@@ -370,11 +2679,39 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif action == 'help':
         await show_help(query)
 
+# Running totals for menu photo sends (file_id cache effectiveness)
+menu_view_stats = {'views': 0, 'photos_uploaded': 0, 'photos_cached': 0, 'upload_bytes': 0, 'send_seconds': 0.0}
+
+async def send_menu_photo(query, item, caption, reply_markup, view):
+    """Send a menu item's photo, reusing Telegram's file_id while the image is unchanged.
+
+    Returns False if the image file is missing so the caller can fall back to text.
+    """
+    file_id = cached_file_id(item)
+    if file_id:
+        try:
+            await query.message.reply_photo(photo=file_id, caption=caption,
+                                            parse_mode='Markdown', reply_markup=reply_markup)
+            view['photos_cached'] += 1
+            return True
+        except BadRequest as e:
+            # file_id no longer valid (e.g. bot token changed): upload the bytes again
+            log.warning(f'⚠️  Cached photo rejected for {item["name"]}: {e}')
+    
+    photo_bytes = await asyncio.get_running_loop().run_in_executor(image_executor, menu_photo_bytes, item['image_url'])
+    if photo_bytes is None:
+        return False
+    
+    message = await query.message.reply_photo(photo=photo_bytes, caption=caption,
+                                              parse_mode='Markdown', reply_markup=reply_markup)
+    view['photos_uploaded'] += 1
+    view['upload_bytes'] += len(photo_bytes)
+    await run_db(save_menu_file_id, item['id'], message.photo[-1].file_id, item['image_url'], item['image_hash'])
+    return True
+
 async def show_menu(query, user_id):
     """Show menu with items and photos"""
-    db = get_db()
-    items = db.execute('SELECT * FROM menu_items WHERE available = 1 ORDER BY id').fetchall()
-    db.close()
+    items = menu_cache.get().available
     
     if not items:
         await query.edit_message_text('❌ Menu is currently empty.')
@@ -383,146 +2720,196 @@ async def show_menu(query, user_id):
     await query.message.reply_text('🍽️ *SOCHOW Menu*\n\nBrowse our delicious dishes below:', 
                                    parse_mode='Markdown')
     
+    view = {'photos_uploaded': 0, 'photos_cached': 0, 'upload_bytes': 0}
+    started = time.perf_counter()
+    
     for item in items:
-        caption = f"*{item['name']}* — ₦{item['price_naira']:,}\n\n"
-        if item['description']:
-            caption += f"_{item['description']}_"
-        
+        caption = menu_caption(item)
         keyboard = [[InlineKeyboardButton(f"➕ Add to Cart", 
                                           callback_data=f"add_to_cart:{item['id']}")]]
         
+        photo_sent = False
         if item['image_url']:
             try:
-                # image_url already has /uploads/menu/ prefix
-                photo_path = item['image_url'].lstrip('/')
-                if os.path.exists(photo_path):
-                    with open(photo_path, 'rb') as photo_file:
-                        await query.message.reply_photo(
-                            photo=photo_file,
-                            caption=caption,
-                            parse_mode='Markdown',
-                            reply_markup=InlineKeyboardMarkup(keyboard)
-                        )
-                else:
-                    await query.message.reply_text(caption, parse_mode='Markdown', 
-                                                  reply_markup=InlineKeyboardMarkup(keyboard))
+                photo_sent = await send_menu_photo(query, item, caption, InlineKeyboardMarkup(keyboard), view)
             except Exception as e:
-                print(f'⚠️  Error sending photo for {item["name"]}: {e}')
-                await query.message.reply_text(caption, parse_mode='Markdown', 
-                                              reply_markup=InlineKeyboardMarkup(keyboard))
-        else:
+                log.warning(f'⚠️  Error sending photo for {item["name"]}: {e}')
+        
+        if not photo_sent:
             await query.message.reply_text(caption, parse_mode='Markdown', 
                                           reply_markup=InlineKeyboardMarkup(keyboard))
     
+    elapsed = time.perf_counter() - started
+    menu_view_stats['views'] += 1
+    menu_view_stats['send_seconds'] += elapsed
+    for key, value in view.items():
+        menu_view_stats[key] += value
+    log.info(f"📊 Menu view: {view['photos_uploaded']} photos uploaded ({view['upload_bytes'] / 1024:.0f} KB), "
+          f"{view['photos_cached']} from file_id cache, {elapsed * 1000:.0f} ms")
+    
     footer_keyboard = [[InlineKeyboardButton("🛒 View Cart", callback_data="view_cart")]]
     await query.message.reply_text("👆 Add items to cart, then checkout when ready!",
                                    reply_markup=InlineKeyboardMarkup(footer_keyboard))
 
-async def add_to_cart(query, user_id, menu_item_id):
-    """Add item to cart"""
-    cart = get_or_create_cart(user_id)
-    db = get_db()
+def menu_caption(item):
+    caption = f"*{item['name']}* — ₦{item['price_naira']:,}\n\n"
+    if item['description']:
+        caption += f"_{item['description']}_"
+    return caption
+
+def cached_file_id(item):
+    """Telegram file_id for the item's photo if it still matches the image on disk"""
+    cached = item['telegram_file_id'] and item['telegram_file_hash'] == item['image_hash']
+    metrics.inc('sochow_cache_requests_total', cache='menu_photo_file_id', result='hit' if cached else 'miss')
+    return item['telegram_file_id'] if cached else None
+
+async def put_photo(query, photo, caption, reply_markup):
+    """Show a photo in the tapped message, or in a new message if it is text-only"""
+    if query.message.photo:
+        return await query.edit_message_media(InputMediaPhoto(photo, caption=caption, parse_mode='Markdown'),
+                                              reply_markup=reply_markup)
+    return await query.message.reply_photo(photo=photo, caption=caption, parse_mode='Markdown',
+                                           reply_markup=reply_markup)
+
+async def render_in_place(query, text, reply_markup, item=None):
+    """Browser mode: replace the tapped message's content instead of sending a new message.
+
+    A dish (item) is shown as a photo with caption, anything else as text, or as a
+    caption when the message is already a photo. Telegram cannot turn a text
+    message into a photo, so that case sends one new message which later taps edit.
+    """
+    loop = asyncio.get_running_loop()
+    photo = None
+    if item is not None and item['image_url']:
+        photo = cached_file_id(item) or await loop.run_in_executor(image_executor, menu_photo_bytes, item['image_url'])
     
-    menu_item = db.execute('SELECT * FROM menu_items WHERE id = ?', (menu_item_id,)).fetchone()
-    existing = db.execute('SELECT * FROM cart_items WHERE cart_id = ? AND menu_item_id = ?', 
-                          (cart['id'], menu_item_id)).fetchone()
+    try:
+        if photo is not None:
+            try:
+                message = await put_photo(query, photo, text, reply_markup)
+            except BadRequest as e:
+                if isinstance(photo, bytes) or 'not modified' in str(e).lower():
+                    raise
+                # Cached file_id rejected (e.g. bot token changed): upload the bytes instead
+                photo = await loop.run_in_executor(image_executor, menu_photo_bytes, item['image_url'])
+                if photo is None:
+                    raise
+                message = await put_photo(query, photo, text, reply_markup)
+            if isinstance(photo, bytes) and isinstance(message, Message) and message.photo:
+                await run_db(save_menu_file_id, item['id'], message.photo[-1].file_id,
+                             item['image_url'], item['image_hash'])
+        elif not query.message.photo:
+            await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        elif item is None:
+            await query.edit_message_caption(caption=text, parse_mode='Markdown', reply_markup=reply_markup)
+        else:
+            # Dish without a photo while the browser shows one: a caption edit would mislabel the image
+            await query.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Re-tapping a button that renders identical content is harmless
+        if 'not modified' not in str(e).lower():
+            raise
+
+async def show_menu_page(query, index):
+    """Browser mode: one dish per page with prev/next paging, edited in place"""
+    items = menu_cache.get().available
     
-    if existing:
-        db.execute('UPDATE cart_items SET qty = qty + 1 WHERE id = ?', (existing['id'],))
-    else:
-        db.execute('INSERT INTO cart_items (cart_id, menu_item_id, qty, unit_price) VALUES (?, ?, 1, ?)',
-                   (cart['id'], menu_item_id, menu_item['price_naira']))
+    if not items:
+        await render_in_place(query, '❌ Menu is currently empty.', None)
+        return
     
-    db.commit()
-    db.close()
+    index %= len(items)
+    item = items[index]
+    keyboard = [
+        [InlineKeyboardButton("➕ Add to Cart", callback_data=f"add_to_cart:{item['id']}")],
+        [InlineKeyboardButton("⬅️ Prev", callback_data=f"menu_page:{(index - 1) % len(items)}"),
+         InlineKeyboardButton(f"{index + 1}/{len(items)}", callback_data="noop"),
+         InlineKeyboardButton("Next ➡️", callback_data=f"menu_page:{(index + 1) % len(items)}")],
+        [InlineKeyboardButton("🛒 View Cart", callback_data="view_cart")]
+    ]
+    
+    await render_in_place(query, menu_caption(item), InlineKeyboardMarkup(keyboard), item)
+
+async def add_to_cart(query, user_id, menu_item_id):
+    """Add item to cart"""
+    menu_item, count, total = await run_db(add_item_to_cart, user_id, menu_item_id)
+    
+    if MENU_MODE == 'browser':
+        # Stay on the dish; a toast confirms and shows the running total
+        await query.answer(f"✅ {menu_item['name']} added — {count} in cart, ₦{total:,}")
+        return
     
     await query.message.reply_text(f"✅ {menu_item['name']} added to cart!")
     await show_cart(query, user_id)
 
 async def show_cart(query, user_id):
     """Show cart contents"""
-    cart = get_or_create_cart(user_id)
-    db = get_db()
-    
-    items = db.execute('''SELECT ci.*, mi.name, mi.price_naira 
-                          FROM cart_items ci 
-                          JOIN menu_items mi ON ci.menu_item_id = mi.id 
-                          WHERE ci.cart_id = ?''', (cart['id'],)).fetchall()
-    db.close()
+    cart, items, total = await run_db(fetch_active_cart, user_id)
     
     if not items:
         keyboard = [[InlineKeyboardButton("🍽️ View Menu", callback_data="view_menu")]]
-        await query.message.reply_text('🛒 Your cart is empty.', reply_markup=InlineKeyboardMarkup(keyboard))
-        return
-    
-    text = '🛒 *Your Cart*\n\n'
-    keyboard = []
-    
-    for item in items:
-        total = item['qty'] * item['unit_price']
-        text += f"{item['qty']}x {item['name']} — ₦{total:,}\n"
-        keyboard.append([
-            InlineKeyboardButton(f"➖ {item['name']}", callback_data=f"decrease_qty:{item['id']}"),
-            InlineKeyboardButton(f"➕ {item['name']}", callback_data=f"increase_qty:{item['id']}")
+        text = '🛒 Your cart is empty.'
+    else:
+        text = '🛒 *Your Cart*\n\n'
+        keyboard = []
+        
+        for item in items:
+            line_total = item['qty'] * item['unit_price']
+            text += f"{item['qty']}x {item['name']} — ₦{line_total:,}\n"
+            keyboard.append([
+                InlineKeyboardButton(f"➖ {item['name']}", callback_data=f"decrease_qty:{item['id']}"),
+                InlineKeyboardButton(f"➕ {item['name']}", callback_data=f"increase_qty:{item['id']}")
+            ])
+        
+        text += f"\n*Subtotal:* ₦{total:,}"
+        
+        keyboard.extend([
+            [InlineKeyboardButton("🧹 Clear Cart", callback_data="clear_cart"),
+             InlineKeyboardButton("🍽️ Add More", callback_data="view_menu")],
+            [InlineKeyboardButton("✅ Checkout", callback_data="checkout")]
         ])
     
-    total = calc_cart_total(cart['id'])
-    text += f"\n*Subtotal:* ₦{total:,}"
-    
-    keyboard.extend([
-        [InlineKeyboardButton("🧹 Clear Cart", callback_data="clear_cart"),
-         InlineKeyboardButton("🍽️ Add More", callback_data="view_menu")],
-        [InlineKeyboardButton("✅ Checkout", callback_data="checkout")]
-    ])
-    
-    await query.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+    if MENU_MODE == 'browser':
+        await render_in_place(query, text, InlineKeyboardMarkup(keyboard))
+    else:
+        await query.message.reply_text(text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def update_qty(query, user_id, cart_item_id, delta):
     """Update item quantity"""
-    db = get_db()
-    item = db.execute('SELECT * FROM cart_items WHERE id = ?', (cart_item_id,)).fetchone()
+    removed = await run_db(change_cart_item_qty, cart_item_id, delta)
     
-    new_qty = item['qty'] + delta
-    
-    if new_qty <= 0:
-        db.execute('DELETE FROM cart_items WHERE id = ?', (cart_item_id,))
+    if MENU_MODE == 'browser':
+        await query.answer('🗑️ Item removed from cart.' if removed else None)
+    elif removed:
         await query.message.reply_text('🗑️ Item removed from cart.')
-    else:
-        db.execute('UPDATE cart_items SET qty = ? WHERE id = ?', (new_qty, cart_item_id))
     
-    db.commit()
-    db.close()
     await show_cart(query, user_id)
 
 async def clear_cart(query, user_id):
     """Clear cart"""
-    cart = get_or_create_cart(user_id)
-    db = get_db()
-    db.execute('DELETE FROM cart_items WHERE cart_id = ?', (cart['id'],))
-    db.commit()
-    db.close()
+    await run_db(empty_cart, user_id)
     
     keyboard = [[InlineKeyboardButton("🍽️ View Menu", callback_data="view_menu")]]
-    await query.message.reply_text('🧹 Cart cleared.', reply_markup=InlineKeyboardMarkup(keyboard))
+    if MENU_MODE == 'browser':
+        await render_in_place(query, '🧹 Cart cleared.', InlineKeyboardMarkup(keyboard))
+    else:
+        await query.message.reply_text('🧹 Cart cleared.', reply_markup=InlineKeyboardMarkup(keyboard))
 
 async def start_checkout(query, user_id):
     """Start checkout process"""
-    cart = get_or_create_cart(user_id)
-    db = get_db()
-    items = db.execute('SELECT * FROM cart_items WHERE cart_id = ?', (cart['id'],)).fetchall()
-    db.close()
+    cart, items, total = await run_db(fetch_active_cart, user_id)
     
     if not items:
         await query.message.reply_text('❌ Your cart is empty.')
         return
     
-    user_states[user_id] = {'step': 'awaiting_address', 'cart_id': cart['id']}
+    checkout_states.set(user_id, {'step': 'awaiting_address', 'cart_id': cart['id']})
     await query.message.reply_text('✅ *Checkout*\n\n🏠 Please enter your delivery address:', parse_mode='Markdown')
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages during checkout"""
-    user = get_or_create_user(update.effective_user.id, update.effective_user.first_name)
-    state = user_states.get(user['id'])
+    user = await resolve_user(update.effective_user)
+    state = await checkout_states.get(user['id'])
     
     if not state:
         return
@@ -530,37 +2917,17 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if state['step'] == 'awaiting_address':
         state['address'] = update.message.text
         state['step'] = 'awaiting_phone'
-        user_states[user['id']] = state
+        checkout_states.set(user['id'], state)
         await update.message.reply_text('📞 Please enter your contact number:')
     
     elif state['step'] == 'awaiting_phone':
         state['phone'] = update.message.text
         await create_order(update, user, state)
-        del user_states[user['id']]
+        checkout_states.delete(user['id'])
 
 async def create_order(update, user, state):
     """Create order and show summary"""
-    db = get_db()
-    
-    items = db.execute('''SELECT ci.*, mi.name FROM cart_items ci 
-                          JOIN menu_items mi ON ci.menu_item_id = mi.id 
-                          WHERE ci.cart_id = ?''', (state['cart_id'],)).fetchall()
-    
-    total = calc_cart_total(state['cart_id'])
-    order_id = generate_order_id()
-    
-    # Check if this is an admin order
-    is_admin = str(user['telegram_id']) == str(ADMIN_CHAT_ID)
-    initial_payment_status = 'verified' if is_admin else 'pending'
-    initial_order_status = 'processing' if is_admin else 'processing'
-    
-    db.execute('''INSERT INTO orders (user_id, cart_id, order_id, total_naira, delivery_address, contact_number, payment_status, order_status)
-                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-               (user['id'], state['cart_id'], order_id, total, state['address'], state['phone'], initial_payment_status, initial_order_status))
-    
-    db.execute('UPDATE carts SET status = ? WHERE id = ?', ('checked_out', state['cart_id']))
-    db.commit()
-    db.close()
+    order_id, items, total, is_admin = await run_db(place_order, user, state)
     
     text = f'✅ *Order Summary*\n\n*Order ID:* {order_id}\n\n*Items:*\n'
     
@@ -582,48 +2949,45 @@ async def create_order(update, user, state):
         text += "📤 After payment, send your receipt image to this chat."
     
     await update.message.reply_text(text, parse_mode='Markdown')
+    
+    api_calls = bot_api_stats.end_session(update.effective_chat.id)
+    log.info(f'📊 Order {order_id}: {api_calls} Bot API calls this ordering session ({MENU_MODE} menu)',
+             extra={'order_id': order_id, 'api_calls': api_calls, 'menu_mode': MENU_MODE})
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle receipt photo uploads"""
-    user = get_or_create_user(update.effective_user.id, update.effective_user.first_name)
-    
-    db = get_db()
-    order = db.execute('''SELECT * FROM orders 
-                          WHERE user_id = ? AND payment_status = 'pending' 
-                          ORDER BY created_at DESC LIMIT 1''', (user['id'],)).fetchone()
-    db.close()
+    user = await resolve_user(update.effective_user)
+    order = await run_db(find_pending_order, user['id'])
     
     if not order:
         await update.message.reply_text('❌ No pending order found.')
         return
     
+    # Recorded by file_id: the admin's copy is sent by file_id too, and the
+    # bytes are only downloaded once the customer has their answer
     photo = update.message.photo[-1]
-    file = await context.bot.get_file(photo.file_id)
-    file_path = f"receipt_{order['id']}_{datetime.now().timestamp()}.jpg"
-    
-    await file.download_to_drive(f"uploads/receipts/{file_path}")
+    receipt_id, image_url, sent_for = await run_db(save_receipt, order, user['id'], photo.file_id, photo.file_unique_id)
     
-    db = get_db()
-    db.execute('INSERT INTO receipts (order_id, user_id, image_url) VALUES (?, ?, ?)',
-               (order['id'], user['id'], f'/uploads/receipts/{file_path}'))
-    db.commit()
-    db.close()
+    if receipt_id is None:
+        if sent_for == order['order_id']:
+            await update.message.reply_text('✅ We already have this receipt. The admin will verify it shortly.')
+        else:
+            await update.message.reply_text(f'⚠️ This receipt was already sent for order {sent_for}. '
+                                            f'Please send the receipt for this payment.')
+        return
     
     await update.message.reply_text('✅ Receipt received. Forwarding to admin for verification…')
-    
-    try:
-        await context.bot.send_message(ADMIN_CHAT_ID, 
-                                       f"💳 Payment receipt for {order['order_id']}\nAmount: ₦{order['total_naira']:,}")
-        await context.bot.send_photo(ADMIN_CHAT_ID, photo.file_id)
-    except:
-        pass
+    context.application.create_task(process_receipt(context.bot, receipt_id, photo.file_id, image_url))
+
+async def process_receipt(bot, receipt_id, file_id, image_url):
+    """After the customer has their answer: download the receipt, hash it off the loop, notify the admin if it is new"""
+    await prefetch_receipt(bot, file_id, image_url)
+    hashes = await asyncio.get_running_loop().run_in_executor(image_executor, receipt_hashes, image_url)
+    await run_db(check_receipt, receipt_id, *hashes)
 
 async def track_order(query, user_id):
     """Show order tracking"""
-    db = get_db()
-    orders = db.execute('SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT 5', 
-                        (user_id,)).fetchall()
-    db.close()
+    orders = await run_db(fetch_recent_orders, user_id)
     
     if not orders:
         keyboard = [[InlineKeyboardButton("🍽️ View Menu", callback_data="view_menu")]]
@@ -662,127 +3026,391 @@ async def show_help(query):
 # FLASK API (for admin dashboard)
 # ============================================================================
 
-app = Flask(__name__)
-CORS(app)
+# Request handlers keep nothing between requests that another process could
+# change: orders, menu and outbound messages all go through the database, so the
+# API can run as several WSGI workers next to a separate bot process (see create_app).
+api = Blueprint('api', __name__)
+
+def create_app():
+    """The admin API and dashboard as a WSGI app.
+
+    Run several workers with e.g.
+    gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:3000 'bot:create_app()'
+    Workers need threads: every open order stream holds one.
+    """
+    setup_logging()
+    app = Flask(__name__)
+    CORS(app, expose_headers=['ETag'])
+    app.register_blueprint(api)
+    app.before_request(ensure_started)  # workers start fast; the first request checks the database
+    if metrics.enabled:
+        app.before_request(start_request_timer)
+        app.after_request(record_request)
+    return app
+
+def start_request_timer():
+    g.started = time.perf_counter()
+
+HTTP_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+def record_request(response):
+    # Route template, not the path, so /api/orders/<int:order_id>/... stays one series;
+    # the method is whatever the client sent, so unknown ones share one too
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method if request.method in HTTP_METHODS else 'other'
+    metrics.observe('sochow_http_request_seconds', time.perf_counter() - g.started, route=route, method=method)
+    metrics.inc('sochow_http_requests_total', route=route, method=method, status=response.status_code)
+    return response
+
+def collect_queues():
+    """Queue depths and per-process counters kept outside the registry, read at scrape time"""
+    db = get_db()
+    pending = db.execute("SELECT COUNT(*) FROM outbound_messages WHERE status = 'pending'").fetchone()[0]
+    db.close()
+    yield 'sochow_outbound_pending', {}, pending
+    if telegram_app is not None:
+        yield 'sochow_update_queue_depth', {}, telegram_app.update_queue.qsize()
+    for name, pool in (('db', db_executor), ('image', image_executor)):
+        yield 'sochow_executor_queue_depth', {'pool': name}, pool._work_queue.qsize()
+    yield 'sochow_order_stream_subscribers', {}, len(order_events.subscribers)
+    yield 'sochow_checkout_states_unflushed', {}, len(checkout_states.dirty)
+    for kind in ('original', *IMAGE_VARIANTS):
+        yield 'sochow_upload_bytes_total', {'variant': kind}, upload_stats[f'{kind}_bytes']
+
+metrics.define('sochow_outbound_pending', 'gauge', 'Messages waiting in the outbound queue (all processes)')
+metrics.define('sochow_update_queue_depth', 'gauge', 'Telegram updates received but not yet picked up')
+metrics.define('sochow_executor_queue_depth', 'gauge', 'Jobs waiting for a DB / image worker thread')
+metrics.define('sochow_order_stream_subscribers', 'gauge', 'Open dashboard order streams in this process')
+metrics.define('sochow_checkout_states_unflushed', 'gauge', 'Checkout state changes not yet written to SQLite')
+metrics.define('sochow_upload_bytes_total', 'counter', 'Bytes served from /uploads by variant')
+metrics.collectors.append(collect_queues)
+
+@api.route('/metrics')
+def get_metrics():
+    """Prometheus text format; 404 with METRICS=off"""
+    if not metrics.enabled:
+        return jsonify({'error': 'Metrics are off'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# index.html compressed once per version of the file: mtime -> {encoding: (body, etag)}
+dashboard_cache = {}
 
-@app.route('/')
+def dashboard_bodies():
+    path = os.path.join(api.root_path, 'index.html')
+    mtime = os.path.getmtime(path)
+    if mtime not in dashboard_cache:
+        with open(path, 'rb') as f:
+            raw = f.read()
+        tag = hashlib.sha1(raw).hexdigest()[:16]
+        bodies = {'identity': (raw, tag), 'gzip': (gzip.compress(raw, 9), f'{tag}-gz')}
+        if brotli is not None:
+            bodies['br'] = (brotli.compress(raw, quality=11), f'{tag}-br')
+        dashboard_cache.clear()
+        dashboard_cache[mtime] = bodies
+    return dashboard_cache[mtime]
+
+@api.route('/')
 def index():
-    """Serve admin dashboard"""
-    return send_from_directory('.', 'index.html')
+    """Serve admin dashboard, precompressed, revalidated with an ETag on every load"""
+    bodies = dashboard_bodies()
+    encoding = next((name for name in ('br', 'gzip') if name in bodies and name in request.accept_encodings),
+                    'identity')
+    body, etag = bodies[encoding]
+    
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
 
-@app.route('/uploads/<path:filename>')
+@api.route('/uploads/<path:filename>')
 def serve_upload(filename):
-    """Serve uploaded files from uploads/, uploads/menu/, or uploads/receipts/"""
-    return send_from_directory('uploads', filename)
+    """Serve uploaded files from uploads/, uploads/menu/, or uploads/receipts/
+
+    A resized variant that doesn't exist yet is created on the image pool, or
+    the original is served instead if that isn't possible. A Telegram receipt
+    not downloaded yet is fetched first.
+    """
+    kind = 'original'
+    immutable = CONTENT_ADDRESSED.match(filename) is not None
+    variant = VARIANT_FILENAME.match(filename)
+    original = variant.group(1) if variant else filename
+    if TELEGRAM_RECEIPT.match(original):
+        fetch_receipt(original)  # returns at once when it is on disk
+    if variant:
+        kind = variant.group(2)
+        path = safe_join('uploads', filename)
+        if path and not os.path.exists(path):
+            source = safe_join('uploads', variant.group(1))
+            if not (source and image_executor.submit(ensure_variant, source, kind).result()):
+                # Don't let the stand-in be cached forever under the variant's URL
+                filename, kind, immutable = variant.group(1), 'original', False
+    
+    # Relative to the working directory like every writer of uploads/, not the app's root_path.
+    # Other files (legacy names, logos) revalidate with ETag / Last-Modified.
+    response = send_from_directory(os.path.abspath('uploads'), filename,
+                                   max_age=31536000 if immutable else None)
+    if immutable and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    upload_stats[f'{kind}_requests'] += 1
+    upload_stats[f'{kind}_bytes'] += response.content_length or 0
+    return response
+
+@api.route('/api/uploads/stats', methods=['GET'])
+def get_upload_stats():
+    """Requests and bytes served from /uploads by this process, per original and variant"""
+    return jsonify(dict(upload_stats, pillow=Image is not None))
 
-@app.route('/api/menu/items', methods=['GET'])
+@api.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    """This process's connection pool counters: connections opened/reused, write-lock waits"""
+    return jsonify(db_pool.snapshot())
+
+@api.route('/api/menu/items', methods=['GET'])
 def get_menu_items():
-    db = get_db()
-    items = db.execute('SELECT * FROM menu_items ORDER BY id').fetchall()
-    db.close()
-    return jsonify([dict(item) for item in items])
+    """Full menu from the in-memory snapshot; its version is the ETag"""
+    snapshot = menu_cache.refresh()
+    if request.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = jsonify([dict(item) for item in snapshot.items])
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-@app.route('/api/menu/items', methods=['POST'])
+@api.route('/api/menu/items', methods=['POST'])
 def add_menu_item():
     data = request.json
     db = get_db()
-    cursor = db.execute('''INSERT INTO menu_items (name, price_naira, description, image_url, available) 
-                           VALUES (?, ?, ?, ?, ?)''',
+    cursor = db.execute('''INSERT INTO menu_items (name, price_naira, description, image_url, image_hash, available) 
+                           VALUES (?, ?, ?, ?, ?, ?)''',
                         (data['name'], data['price_naira'], data.get('description'), 
-                         data.get('image_url'), 1 if data.get('available', True) else 0))
+                         data.get('image_url'), image_file_hash(data.get('image_url')),
+                         1 if data.get('available', True) else 0))
     db.commit()
-    item = db.execute('SELECT * FROM menu_items WHERE id = ?', (cursor.lastrowid,)).fetchone()
     db.close()
+    item = menu_cache.reload().by_id[cursor.lastrowid]
     return jsonify(dict(item))
 
-@app.route('/api/menu/items/<int:item_id>', methods=['PATCH'])
+@api.route('/api/menu/items/<int:item_id>', methods=['PATCH'])
 def update_menu_item(item_id):
     data = request.json
     db = get_db()
     if 'available' in data:
         db.execute('UPDATE menu_items SET available = ? WHERE id = ?', 
                    (1 if data['available'] else 0, item_id))
+    if 'image_url' in data:
+        # New photo (from /api/menu/upload-item): new hash invalidates the cached file_id
+        db.execute('UPDATE menu_items SET image_url = ?, image_hash = ? WHERE id = ?',
+                   (data['image_url'], image_file_hash(data['image_url']), item_id))
     
     db.commit()
-    item = db.execute('SELECT * FROM menu_items WHERE id = ?', (item_id,)).fetchone()
     db.close()
+    item = menu_cache.reload().by_id.get(item_id)
+    if item is None:
+        return jsonify({'error': 'Not found'}), 404
     return jsonify(dict(item))
 
-@app.route('/api/menu/items/<int:item_id>', methods=['DELETE'])
+@api.route('/api/menu/items/<int:item_id>', methods=['DELETE'])
 def delete_menu_item(item_id):
     db = get_db()
     db.execute('DELETE FROM menu_items WHERE id = ?', (item_id,))
     db.commit()
+    db.close()
+    menu_cache.reload()
     return jsonify({'success': True})
 
-@app.route('/api/menu/upload', methods=['POST'])
+@api.route('/api/menu/upload', methods=['POST'])
 def upload_menu():
     if 'menu_image' not in request.files:
         return jsonify({'error': 'No file'}), 400
     
     file = request.files['menu_image']
-    filename = f"menu_{datetime.now().timestamp()}.jpg"
-    file.save(f"uploads/menu/{filename}")
+    ext = upload_extension(file.filename)
+    temp_path = incoming_path('uploads/menu', ext)
+    file.save(temp_path)
+    image_url = store_upload(temp_path, 'uploads/menu', ext, MENU_IMAGE_VARIANTS)
     
-    image_url = f"/uploads/menu/{filename}"
     db = get_db()
     db.execute('''INSERT OR REPLACE INTO menu_config (id, menu_image_url, updated_at) 
                   VALUES (1, ?, CURRENT_TIMESTAMP)''', (image_url,))
     db.commit()
     db.close()
+    menu_cache.reload()
     
     return jsonify({'imageUrl': image_url})
 
-@app.route('/api/menu/upload-item', methods=['POST'])
+@api.route('/api/menu/upload-item', methods=['POST'])
 def upload_menu_item_image():
     if 'item_image' not in request.files:
         return jsonify({'error': 'No file'}), 400
     
     file = request.files['item_image']
-    # Use sanitized filename
-    original_name = file.filename
-    ext = original_name.rsplit('.', 1)[1] if '.' in original_name else 'jpg'
-    filename = f"item_{datetime.now().timestamp()}.{ext}"
-    
-    os.makedirs('uploads/menu', exist_ok=True)
-    filepath = f"uploads/menu/{filename}"
-    file.save(filepath)
+    ext = upload_extension(file.filename)
+    temp_path = incoming_path('uploads/menu', ext)
+    file.save(temp_path)
+    image_url = store_upload(temp_path, 'uploads/menu', ext, MENU_IMAGE_VARIANTS)
     
-    return jsonify({'imageUrl': f"/uploads/menu/{filename}"})
+    return jsonify({'imageUrl': image_url})
+
+STATS_COLUMNS = ('orders', 'items_sold', 'gross_naira', 'verified_orders', 'revenue_naira',
+                 'delivered_orders', 'cancelled_orders')
+
+@api.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Sales figures from the rollup tables.
+
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD pick the range (both default to today, local
+    time) and ?top=N the number of best sellers. Every query reads the rollups
+    for the range only, so the cost does not grow with order history.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    start, end = request.args.get('from', today), request.args.get('to', today)
+    try:
+        for day in (start, end):
+            datetime.strptime(day, '%Y-%m-%d')
+        top = min(int(request.args.get('top', 5)), 50)
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD and top a number'}), 400
 
-@app.route('/api/orders', methods=['GET'])
-def get_orders():
     db = get_db()
-    orders = db.execute('''SELECT o.*, u.name as customer_name, u.telegram_id as customer_telegram,
-                                  r.image_url as receipt_url
-                           FROM orders o
-                           JOIN users u ON o.user_id = u.id
-                           LEFT JOIN receipts r ON o.id = r.order_id
-                           ORDER BY o.created_at DESC''').fetchall()
+    days = [dict(row) for row in db.execute('SELECT * FROM daily_stats WHERE day BETWEEN ? AND ? ORDER BY day',
+                                            (start, end))]
+    totals = {column: sum(day[column] for day in days) for column in STATS_COLUMNS}
+    today_row = db.execute('SELECT * FROM daily_stats WHERE day = ?', (today,)).fetchone()
+
+    hourly = [{'hour': hour, 'orders': 0, 'revenue_naira': 0} for hour in range(24)]
+    for row in db.execute('''SELECT hour, SUM(orders) AS orders, SUM(revenue_naira) AS revenue_naira
+                             FROM hourly_stats WHERE day BETWEEN ? AND ? GROUP BY hour''', (start, end)):
+        hourly[row['hour']].update(orders=row['orders'], revenue_naira=row['revenue_naira'])
+
+    top_items = db.execute('''SELECT s.menu_item_id, mi.name, SUM(s.qty) AS qty, SUM(s.gross_naira) AS gross_naira
+                              FROM item_daily_stats s LEFT JOIN menu_items mi ON mi.id = s.menu_item_id
+                              WHERE s.day BETWEEN ? AND ?
+                              GROUP BY s.menu_item_id ORDER BY qty DESC, gross_naira DESC LIMIT ?''',
+                           (start, end, top)).fetchall()
+
+    status_counts = {'payment': {}, 'order': {}}
+    for row in db.execute('SELECT kind, status, orders FROM order_status_counts WHERE orders > 0'):
+        status_counts[row['kind']][row['status']] = row['orders']
+    db.close()
+
+    return jsonify({
+        'today': dict(today_row) if today_row else {'day': today, **dict.fromkeys(STATS_COLUMNS, 0)},
+        'range': {'from': start, 'to': end, 'totals': totals, 'days': days},
+        'hourly': hourly,
+        'top_items': [dict(item) for item in top_items],
+        'status_counts': status_counts,
+    })
+
+ORDERS_PAGE_SIZE = 50
+ORDERS_PAGE_MAX = 200
+ORDER_PAGE_ARGS = ('payment_status', 'order_status', 'from', 'to', 'customer', 'before', 'limit')
+
+@api.route('/api/orders', methods=['GET'])
+def get_orders():
+    """List orders, newest first.
+
+    With ?updated_since=<cursor> only orders changed at or after the cursor are
+    returned, wrapped as {"orders": [...], "cursor": ...}; pass the returned
+    cursor on the next poll (an empty value means a full sync).
+
+    With any of the order_filters() arguments or ?limit=N (1 to 200, default 50)
+    one page is returned as {"orders": [...], "next": ..., "cursor": ...}; pass
+    next as ?before= for the following page (null on the last one), and cursor
+    as ?updated_since= to follow changes from then on.
+
+    Without either the full list is returned as before. Every response carries
+    an ETag so idle polls with If-None-Match get an empty 304.
+    """
+    since = request.args.get('updated_since')
+    paged = since is None and any(arg in request.args for arg in ORDER_PAGE_ARGS)
+    try:
+        clauses, params = order_filters(request.args)
+        limit = None
+        if paged:
+            limit = int(request.args.get('limit', ORDERS_PAGE_SIZE))
+            if limit < 1:
+                raise ValueError('limit must be at least 1')
+            limit = min(limit, ORDERS_PAGE_MAX)
+    except ValueError:
+        return jsonify({'error': 'Invalid filter or cursor'}), 400
+    if since is not None:
+        clauses.append('o.updated_at >= ?')
+        params.append(since)
     
-    result = []
-    for order in orders:
-        order_dict = dict(order)
-        items = db.execute('''SELECT ci.qty, mi.name, mi.price_naira
-                              FROM cart_items ci
-                              JOIN menu_items mi ON ci.menu_item_id = mi.id
-                              WHERE ci.cart_id = ?''', (order['cart_id'],)).fetchall()
-        
-        order_dict['items'] = [dict(item) for item in items]
-        order_dict['customer'] = {'name': order['customer_name'], 'telegram_id': order['customer_telegram']}
-        result.append(order_dict)
+    db = get_db()
     
-    db.close()
-    return jsonify(result)
+    # Every write to an order bumps updated_at, so its max versions the whole table
+    cursor = db.execute('SELECT MAX(updated_at) FROM orders').fetchone()[0] or ''
+    etag = hashlib.sha1(f'{cursor}|{request.query_string.decode()}'.encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        db.close()
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    orders = iter_order_payloads(db, where, params, limit)
+    
+    def generate():
+        # Stream the JSON array row by row rather than building the whole list in memory
+        try:
+            yield '[' if since is None and not paged else '{"orders": ['
+            count, last = 0, None
+            for order in orders:
+                yield (',' if count else '') + json.dumps(order)
+                count += 1
+                last = order
+            if paged:
+                more = json.dumps(order_page_cursor(last) if last is not None and count == limit else None)
+                yield f'], "next": {more}, "cursor": {json.dumps(cursor)}}}'
+            else:
+                yield f'], "cursor": {json.dumps(cursor)}}}' if since is not None else ']'
+        finally:
+            db.close()
+    
+    response = Response(generate(), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+@api.route('/api/orders/stream', methods=['GET'])
+def stream_orders():
+    """Server-Sent Events feed of order changes for the dashboard"""
+    subscription = order_events.subscribe()
+    
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    frame = subscription.get(timeout=ORDER_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if frame is None:
+                    return  # fell too far behind; the client reconnects and resyncs
+                yield frame
+        finally:
+            order_events.unsubscribe(subscription)
+    
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-@app.route('/api/orders/<int:order_id>/verify', methods=['POST'])
+@api.route('/api/orders/<int:order_id>/verify', methods=['POST'])
 def verify_payment(order_id):
     data = request.json
     db = get_db()
     
     if data.get('verified'):
-        db.execute('''UPDATE orders SET payment_status = 'verified', order_status = 'processing', 
-                      updated_at = CURRENT_TIMESTAMP WHERE id = ?''', (order_id,))
+        db.execute(f'''UPDATE orders SET payment_status = 'verified', order_status = 'processing', 
+                       updated_at = {SQL_NOW} WHERE id = ?''', (order_id,))
         db.execute('''UPDATE receipts SET admin_verified = 1, verified_at = CURRENT_TIMESTAMP 
                       WHERE order_id = ?''', (order_id,))
         
@@ -790,27 +3418,26 @@ def verify_payment(order_id):
         order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
         user = db.execute('SELECT * FROM users WHERE id = ?', (order['user_id'],)).fetchone()
         
-        asyncio.run(telegram_app.bot.send_message(
-            user['telegram_id'],
-            f"✅ Payment confirmed for {order['order_id']}\nTotal: ₦{order['total_naira']:,}\nYour order is being prepared."
-        ))
+        queue_message(db, user['telegram_id'],
+                      f"✅ Payment confirmed for {order['order_id']}\nTotal: ₦{order['total_naira']:,}\nYour order is being prepared.")
     else:
-        db.execute('''UPDATE orders SET payment_status = 'denied', updated_at = CURRENT_TIMESTAMP 
-                      WHERE id = ?''', (order_id,))
+        db.execute(f'''UPDATE orders SET payment_status = 'denied', updated_at = {SQL_NOW} 
+                       WHERE id = ?''', (order_id,))
     
     db.commit()
+    outbound.wake()
+    order_events.publish(order_id)
     order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
     db.close()
     return jsonify(dict(order))
 
-@app.route('/api/orders/<int:order_id>/status', methods=['PATCH'])
+@api.route('/api/orders/<int:order_id>/status', methods=['PATCH'])
 def update_order_status(order_id):
     data = request.json
     db = get_db()
     
-    db.execute('''UPDATE orders SET order_status = ?, rider_contact = ?, updated_at = CURRENT_TIMESTAMP 
-                  WHERE id = ?''', (data['status'], data.get('rider_contact'), order_id))
-    db.commit()    
+    db.execute(f'''UPDATE orders SET order_status = ?, rider_contact = ?, updated_at = {SQL_NOW} 
+                   WHERE id = ?''', (data['status'], data.get('rider_contact'), order_id))
     
     # Notify customer
     order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
@@ -822,20 +3449,19 @@ def update_order_status(order_id):
     if data.get('rider_contact'):
         text += f"\nRider contact: {data['rider_contact']}"
     
-    try:
-        asyncio.run(telegram_app.bot.send_message(user['telegram_id'], text))
-    except:
-        pass
+    queue_message(db, user['telegram_id'], text)
+    db.commit()
+    outbound.wake()
+    order_events.publish(order_id)
     
     db.close()
     return jsonify(dict(order))
 
-@app.route('/api/orders/<int:order_id>/cancel', methods=['POST'])
+@api.route('/api/orders/<int:order_id>/cancel', methods=['POST'])
 def cancel_order(order_id):
     db = get_db()
-    db.execute('''UPDATE orders SET order_status = 'cancelled', updated_at = CURRENT_TIMESTAMP 
-                  WHERE id = ?''', (order_id,))
-    db.commit()
+    db.execute(f'''UPDATE orders SET order_status = 'cancelled', updated_at = {SQL_NOW} 
+                   WHERE id = ?''', (order_id,))
     
     # Notify customer
     order = db.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
@@ -843,15 +3469,15 @@ def cancel_order(order_id):
     
     text = f"❌ Order {order['order_id']} has been cancelled. Please contact us if you have any questions."
     
-    try:
-        asyncio.run(telegram_app.bot.send_message(user['telegram_id'], text))
-    except:
-        pass
+    queue_message(db, user['telegram_id'], text)
+    db.commit()
+    outbound.wake()
+    order_events.publish(order_id)
     
     db.close()
     return jsonify(dict(order))
 
-@app.route('/api/orders/<int:order_id>/query', methods=['POST'])
+@api.route('/api/orders/<int:order_id>/query', methods=['POST'])
 def query_customer(order_id):
     data = request.json
     db = get_db()
@@ -860,49 +3486,205 @@ def query_customer(order_id):
     user = db.execute('SELECT * FROM users WHERE id = ?', (order['user_id'],)).fetchone()
     
     # Send query to admin
-    asyncio.run(telegram_app.bot.send_message(
-        ADMIN_CHAT_ID,
-        f"❓ Query about {order['order_id']}:\n\n{data['message']}"
-    ))
+    queue_message(db, ADMIN_CHAT_ID, f"❓ Query about {order['order_id']}:\n\n{data['message']}")
+    db.commit()
+    outbound.wake()
     
     db.close()
     return jsonify({'success': True})
 
+# ============================================================================
+# WEBHOOK MODE (ASGI)
+# ============================================================================
+
+# With WEBHOOK_URL set, one uvicorn server on PORT hosts Telegram's webhook and
+# the admin API on a single event loop, instead of a getUpdates long-poll plus
+# Flask's dev server in a thread. Updates are acknowledged once queued and
+# handled concurrently by PerChatUpdateProcessor, as in polling mode.
+
+WEBHOOK_PATH = '/telegram/webhook'
+
+def webhook_secret():
+    """Value Telegram sends in X-Telegram-Bot-Api-Secret-Token with every update"""
+    return WEBHOOK_SECRET or hashlib.sha256(f'webhook:{BOT_TOKEN}'.encode()).hexdigest()[:32]
+
+class WebhookApp:
+    """ASGI entry point: Telegram updates on WEBHOOK_PATH, everything else to Flask.
+
+    The lifespan events run the bot. Startup initializes it, starts its workers
+    and registers the webhook. Shutdown only comes once uvicorn has finished the
+    in-flight requests, so every update already acknowledged is in the queue,
+    and Application.stop() handles all of them before the workers stop.
+    """
+
+    def __init__(self, application, flask_app=None):
+        self.application = application
+        self.flask = WsgiToAsgi(flask_app) if flask_app else None  # None: the API runs elsewhere
+        self.secret = webhook_secret().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['path'] == WEBHOOK_PATH:
+            await self.webhook(scope, receive, send)
+        elif self.flask is None:
+            await self.respond(send, 404)
+        else:
+            # Flask blocks (the order stream for as long as it is open), so each
+            # request gets its own thread as with the dev server, not asgiref's shared one
+            async with ThreadSensitiveContext():
+                await self.flask(scope, receive, send)
+
+    async def webhook(self, scope, receive, send):
+        if scope['method'] != 'POST':
+            return await self.respond(send, 405)
+        token = dict(scope['headers']).get(b'x-telegram-bot-api-secret-token', b'')
+        if not hmac.compare_digest(token, self.secret):
+            return await self.respond(send, 403)
+        
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError):
+            return await self.respond(send, 400)
+        
+        await self.application.update_queue.put(update)
+        await self.respond(send, 200)
+
+    @staticmethod
+    async def respond(send, status):
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-length', b'0')]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        application = self.application
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        await application.bot.set_webhook(f'{WEBHOOK_URL}{WEBHOOK_PATH}', secret_token=self.secret.decode(),
+                                          allowed_updates=Update.ALL_TYPES,
+                                          max_connections=WEBHOOK_MAX_CONNECTIONS)
+        log.info(f'🪝 Webhook registered at {WEBHOOK_URL}{WEBHOOK_PATH}')
+
+    async def shutdown(self):
+        # The webhook stays registered: Telegram holds and retries updates
+        # until this or the next instance is up again
+        application = self.application
+        queued = application.update_queue.qsize()
+        log.info(f'🛑 Draining {queued} queued updates...')
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        log.info('✅ Bot stopped cleanly')
+
+def run_webhook(application, flask_app=None):
+    """Serve the webhook, and the admin API if given, with uvicorn until SIGINT/SIGTERM"""
+    config = uvicorn.Config(WebhookApp(application, flask_app), host='0.0.0.0', port=PORT,
+                            lifespan='on', ws='none', log_level='warning',
+                            timeout_graceful_shutdown=SHUTDOWN_GRACE)
+    server = uvicorn.Server(config)
+    handle_exit = server.handle_exit
+    
+    def drain(sig, frame):
+        # Open dashboard streams never finish by themselves; end them so they
+        # don't hold shutdown for the whole grace period
+        order_events.close()
+        handle_exit(sig, frame)
+    
+    server.handle_exit = drain
+    server.run()
+
 # ============================================================================
 # START SERVERS
 # ============================================================================
 
 def run_flask():
     """Run Flask in separate thread"""
-    app.run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False, use_reloader=False)
+
+def build_telegram_app():
+    """The bot Application with its handlers, for polling or webhook mode"""
+    application = (Application.builder()
+                   # A ready-made bot skips the builder's request setup: without its own
+                   # requests it would share one HTTP connection between all updates
+                   .bot(CountingBot(BOT_TOKEN, base_url=f'{TELEGRAM_API_URL}/bot',
+                                    base_file_url=f'{TELEGRAM_API_URL}/file/bot',
+                                    request=HTTPXRequest(connection_pool_size=BOT_API_CONNECTIONS,
+                                                         pool_timeout=10),
+                                    get_updates_request=HTTPXRequest()))
+                   .concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+                   .post_init(on_startup)
+                   .post_shutdown(on_shutdown)
+                   .build())
+    application.add_handler(CommandHandler('start', start))
+    application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    return application
 
 # Global telegram app reference
 telegram_app = None
 
 if __name__ == '__main__':
-    print('✅ SOCHOW Bot Starting...')
-    print(f'🔑 Bot Token: {BOT_TOKEN[:10]}...')
-    print(f'👤 Admin ID: {ADMIN_CHAT_ID}')
+    setup_logging()
+    if sys.argv[1:] == ['bootstrap']:
+        bootstrap()
+        sys.exit(0)
+    if sys.argv[1:] == ['backfill-stats']:
+        ensure_started()
+        backfill_stats()
+        sys.exit(0)
+    
+    log.info('✅ SOCHOW Bot Starting...')
+    log.info(f'🔑 Bot Token: {BOT_TOKEN[:10]}...')
+    log.info(f'👤 Admin ID: {ADMIN_CHAT_ID}')
     os.makedirs('uploads', exist_ok=True)
+    ensure_started()
+    log.info('✅ SOCHOW Bot Ready')
     
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
-    print(f'📡 API Server running on http://localhost:{PORT}')
-    
-    telegram_app = Application.builder().token(BOT_TOKEN).build()
-    telegram_app.add_handler(CommandHandler('start', start))
-    telegram_app.add_handler(CallbackQueryHandler(button_handler))
-    telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    telegram_app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
-    
-    print('🤖 Telegram bot starting...')
-    print('✅ Bot handlers registered')
-    print('📱 Listening for messages...')
+    # 'python bot.py bot' runs the bot on its own, with the API under a WSGI server (see create_app)
+    with_api = sys.argv[1:] != ['bot']
+    telegram_app = build_telegram_app()
+    log.info('✅ Bot handlers registered')
+    if METRICS_PORT and metrics.enabled:
+        serve_metrics(METRICS_PORT)
+        log.info(f'📈 Metrics on http://localhost:{METRICS_PORT}/metrics')
     
     try:
-        telegram_app.run_polling(allowed_updates=Update.ALL_TYPES)
+        if WEBHOOK_URL:
+            if uvicorn is None:
+                sys.exit('❌ Webhook mode needs uvicorn and asgiref: pip install uvicorn asgiref')
+            log.info(f'📡 Webhook{" + API" if with_api else ""} server running on http://localhost:{PORT}')
+            run_webhook(telegram_app, create_app() if with_api else None)
+        else:
+            if with_api:
+                flask_thread = Thread(target=run_flask, daemon=True)
+                flask_thread.start()
+                log.info(f'📡 API Server running on http://localhost:{PORT}')
+            log.info('🤖 Telegram bot starting...')
+            log.info('📱 Listening for messages...')
+            telegram_app.run_polling(allowed_updates=Update.ALL_TYPES)
     except Exception as e:
-        print(f'❌ Telegram bot error: {e}')
-        import traceback
-        traceback.print_exc()
-
+        log.exception(f'❌ Telegram bot error: {e}')
+    finally:
+        db_executor.shutdown(wait=True)